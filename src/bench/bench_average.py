@@ -0,0 +1,110 @@
+"""
+Benchmark the average image.
+
+# SCRIPT   : bench_average.py
+# POURPOSE : Compare the frames/sec of average.py before and after the
+#            block accumulation, reading the images from disk, and of the
+#            accumulation step alone.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import os
+import argparse
+import tempfile
+
+from glob import glob
+from natsort import natsorted
+
+import numpy as np
+
+from skimage.io import imread, imsave
+from skimage.util import img_as_float64
+
+from benchmark import add_input_arguments, image_folder, load_frames, timeit
+from products import compute_products
+from reducers import MeanReducer
+
+
+def legacy_average_py(folder, output):
+    """average.py as it was before the block accumulation."""
+    imlist = natsorted(glob(folder + "/*"))
+    h, w, c = imread(imlist[0]).shape
+    N = len(imlist)
+    arr = np.zeros((h, w, c), np.float64)
+    for im in imlist:
+        img = imread(im)
+        imarr = img_as_float64(img)
+        arr = arr + imarr / N
+    new_arr = ((arr - arr.min()) *
+               (1 / (arr.max() - arr.min()) * 255)).astype('uint8')
+    imsave(output, new_arr)
+
+
+def average_py(folder, output, precision, block_size):
+    """average.py with its default decoding workers."""
+    compute_products(folder, {"average": output}, precision=precision,
+                     block_size=block_size, progress=False)
+
+
+def legacy_average(frames):
+    """Per-frame accumulation as originally done in average.py."""
+    N = len(frames)
+    arr = np.zeros(frames[0].shape, np.float64)
+    for img in frames:
+        imarr = img_as_float64(img)
+        arr = arr + imarr / N
+    return arr
+
+
+def block_average(frames, block_size, dtype):
+    """Block accumulation as done by MeanReducer."""
+    reducer = MeanReducer(block_size=block_size, dtype=dtype)
+    for img in frames:
+        reducer.update(img)
+    return reducer.mean()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    add_input_arguments(parser, 100)
+
+    args = parser.parse_args()
+    n = int(args.n_images)
+
+    # end-to-end, images are read from disk and the average is saved
+    with image_folder(args.input, n) as folder, \
+            tempfile.TemporaryDirectory() as tmp:
+        n = len(os.listdir(folder))
+        print(f"\nRunning average.py on {n} images\n")
+
+        fname = os.path.join(tmp, "legacy.png")
+        base, _ = timeit(legacy_average_py, n, folder, fname)
+        ref = imread(fname).astype(int)
+        print(f"  -- before, float64 per frame : {base:8.1f} frames/sec")
+
+        for dtype in ["float32", "float64"]:
+            fname = os.path.join(tmp, f"average_{dtype}.png")
+            fps, _ = timeit(average_py, n, folder, fname, dtype, 16)
+            err = np.abs(imread(fname) - ref).max()
+            print(f"  -- after, block=16 {dtype:8s}  : {fps:8.1f} "
+                  f"frames/sec ({fps / base:5.2f}x, max. difference "
+                  f"{err} DN)")
+
+    # accumulation only, frames are decoded before timing
+    frames = load_frames(args.input, n)
+    n = len(frames)
+    print(f"\nAccumulating {n} decoded frames of shape {frames[0].shape}\n")
+
+    fps, ref = timeit(legacy_average, n, frames)
+    print(f"  -- legacy float64 per frame  : {fps:8.1f} frames/sec")
+
+    for dtype in ["float32", "float64"]:
+        for block_size in [1, 16, 64]:
+            fps, avg = timeit(block_average, n, frames, block_size, dtype)
+            err = np.abs(avg - ref * 255).max()
+            print(f"  -- block={block_size:<3d} {dtype:8s}        : "
+                  f"{fps:8.1f} frames/sec (max. error {err:.2e})")
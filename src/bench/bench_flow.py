@@ -0,0 +1,120 @@
+"""
+Benchmark the optical flow with an increasing number of processes.
+
+# SCRIPT   : bench_flow.py
+# POURPOSE : Measure the pairs/sec of the FlowEngine used by
+#            optical_flow.py from one process up to the number of CPUs.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "post"))
+from frames import FrameSource, list_images  # noqa
+from flow import FlowEngine  # noqa
+
+
+def moving_frames(n, shape, speed=2):
+    """Smooth random texture moving diagonally by speed pixels per frame."""
+    rng = np.random.default_rng(42)
+    h, w = shape
+    pad = speed * n
+    texture = rng.integers(0, 256, (h + pad, w + pad), dtype=np.uint8)
+    texture = cv2.GaussianBlur(texture, (0, 0), 2)
+    return [texture[i * speed:i * speed + h, i * speed:i * speed + w]
+            for i in range(n)]
+
+
+def worker_counts(maximum):
+    """1, 2, 4, ... up to maximum, always including maximum."""
+    counts = [1]
+    while counts[-1] * 2 < maximum:
+        counts.append(counts[-1] * 2)
+    if maximum > 1:
+        counts.append(maximum)
+    return counts
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--input", "-i",
+                        action="store",
+                        dest="input",
+                        default=None,
+                        required=False,
+                        help="Input folder with images. Default is to use "
+                             "a synthetic moving texture.")
+
+    parser.add_argument("--number_of_images", "-N",
+                        action="store",
+                        dest="n_images",
+                        default=65,
+                        required=False,
+                        help="Number of images to use. Default is 65.")
+
+    parser.add_argument("--size",
+                        action="store",
+                        dest="size",
+                        default=500,
+                        required=False,
+                        help="Frames are resized to size x size pixels, "
+                             "like a rectified grid. Default is 500.")
+
+    parser.add_argument("--max_workers",
+                        action="store",
+                        dest="max_workers",
+                        default=os.cpu_count(),
+                        required=False,
+                        help="Largest number of processes to try. "
+                             "Default is the number of CPUs.")
+
+    parser.add_argument("--pairs_per_task",
+                        action="store",
+                        dest="pairs_per_task",
+                        default=4,
+                        required=False,
+                        help="Number of pairs given to a process at once. "
+                             "Default is 4.")
+
+    args = parser.parse_args()
+
+    # frames are decoded before timing, only the flow is measured
+    n = int(args.n_images)
+    size = int(args.size)
+    if args.input:
+        images = list_images(args.input)[:n]
+        frames = [cv2.resize(img, (size, size))
+                  for _, img in FrameSource(images, color="gray")]
+    else:
+        frames = moving_frames(n, (size, size))
+    npairs = len(frames) - 1
+    print(f"\nComputing the flow of {npairs} pairs of {size}x{size} "
+          "frames\n")
+
+    reference = None
+    base = None
+    for workers in worker_counts(int(args.max_workers)):
+        engine = FlowEngine((size, size), workers=workers,
+                            pairs_per_task=int(args.pairs_per_task))
+        start = time.perf_counter()
+        flows = np.array(list(engine(frames)))
+        pps = npairs / (time.perf_counter() - start)
+
+        # the order and the values must not depend on the workers
+        if reference is None:
+            reference, base = flows, pps
+        same = np.array_equal(flows, reference)
+        print(f"  -- {workers:3d} worker(s): {pps:8.2f} pairs/sec "
+              f"({pps / base:5.2f}x){'' if same else ', results differ!'}")
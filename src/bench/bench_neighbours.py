@@ -0,0 +1,89 @@
+"""
+Benchmark the timestack sampling with several neighbours per point.
+
+# SCRIPT   : bench_neighbours.py
+# POURPOSE : Compare the frames/sec of the original per-frame gather and
+#            numpy reduction with the sparse StackSampler used by
+#            timestack.py for k = 1, 4, 9 and 25 neighbours.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import argparse
+
+import numpy as np
+
+from benchmark import add_input_arguments, load_frames, timeit
+from geometry import bilinear_taps
+from sampling import StackSampler
+
+
+# numpy reductions used by the original timestack.py
+OPERATORS = {"mean": np.mean, "median": np.median, "max": np.max,
+             "min": np.min, "deviation": np.std, "variance": np.var}
+
+
+def stack_pixels(shape, npoints, neighbours):
+    """Sub-pixel positions of k neighbours around points on a diagonal."""
+    h, w = shape[:2]
+    x = np.linspace(0.1 * w, 0.9 * w, npoints)
+    y = np.linspace(0.2 * h, 0.8 * h, npoints)
+    r = int(np.ceil(np.sqrt(neighbours)))
+    di, dj = np.meshgrid(np.arange(r) - r // 2, np.arange(r) - r // 2)
+    di = di.ravel()[:neighbours]
+    dj = dj.ravel()[:neighbours]
+    return (x[:, None] + dj[None, :] + 0.3), (y[:, None] + di[None, :] + 0.6)
+
+
+def legacy_sampling(frames, istk, jstk, operator):
+    """Gather and reduce as originally done in timestack.py."""
+    out = []
+    for img in frames:
+        dst = img / 255.
+        out.append(operator(dst[istk, jstk, :], axis=1))
+    return np.array(out)
+
+
+def sparse_sampling(frames, sampler):
+    """Gather and reduce with the StackSampler."""
+    return np.array([sampler(img) for img in frames])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    add_input_arguments(parser, 50)
+
+    parser.add_argument("--npoints",
+                        action="store",
+                        dest="npoints",
+                        default=1024,
+                        required=False,
+                        help="Number of points in the timestack. "
+                             "Default is 1024.")
+
+    args = parser.parse_args()
+
+    # frames are decoded before timing, only the sampling is measured
+    frames = load_frames(args.input, int(args.n_images))
+    n = len(frames)
+    npoints = int(args.npoints)
+    print(f"\nSampling {npoints} points from {n} frames of shape "
+          f"{frames[0].shape}\n")
+
+    for neighbours in [1, 4, 9, 25]:
+        x, y = stack_pixels(frames[0].shape, npoints, neighbours)
+        idx, w = bilinear_taps(x, y, frames[0].shape)
+        istk = np.rint(y).astype(int)
+        jstk = np.rint(x).astype(int)
+
+        for statistic in ["mean", "median", "variance"]:
+            fps_old, _ = timeit(legacy_sampling, n, frames, istk, jstk,
+                                OPERATORS[statistic])
+            sampler = StackSampler(idx, w, statistic)
+            fps_new, _ = timeit(sparse_sampling, n, frames, sampler)
+            print(f"  -- k={neighbours:<3d} {statistic:9s}: legacy "
+                  f"{fps_old:8.1f} frames/sec, sparse {fps_new:8.1f} "
+                  f"frames/sec ({fps_new / fps_old:5.1f}x)")
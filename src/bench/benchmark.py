@@ -0,0 +1,128 @@
+"""
+Shared tools of the benchmarks.
+
+# SCRIPT   : benchmark.py
+# POURPOSE : Load or generate the frames used by the benchmarks and measure
+#            their frames/sec.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from contextlib import contextmanager
+
+import numpy as np
+
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "post"))
+from frames import FrameSource, list_images  # noqa
+
+# size of the random frames, 1080p RGB
+SHAPE = (1080, 1920, 3)
+
+
+def add_input_arguments(parser, n_images):
+    """
+    Add the input folder and number of images to an argument parser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        Argument parser.
+    n_images : int
+        Default number of images.
+
+    Returns
+    -------
+    None
+    """
+    parser.add_argument("--input", "-i",
+                        action="store",
+                        dest="input",
+                        default=None,
+                        required=False,
+                        help="Input folder with images. Default is to use "
+                             "random 1080p frames.")
+
+    parser.add_argument("--number_of_images", "-N",
+                        action="store",
+                        dest="n_images",
+                        default=n_images,
+                        required=False,
+                        help="Number of images to use. "
+                             f"Default is {n_images}.")
+
+
+def random_frames(n, shape=SHAPE):
+    """Random uint8 frames, generated one at a time."""
+    rng = np.random.default_rng(42)
+    for _ in range(n):
+        yield rng.integers(0, 256, shape, dtype=np.uint8)
+
+
+def load_frames(folder, n):
+    """
+    Decode the first n images of a folder, or generate random frames.
+
+    Parameters
+    ----------
+    folder : str
+        Input folder, or None for random 1080p frames.
+    n : int
+        Number of frames.
+
+    Returns
+    -------
+    list
+        Decoded RGB frames.
+    """
+    if folder:
+        return [img for _, img in FrameSource(list_images(folder)[:n])]
+    return list(random_frames(n))
+
+
+@contextmanager
+def image_folder(folder, n, ext="jpg"):
+    """
+    Temporary folder with the first n images of a folder, or random frames.
+
+    The images of the input folder are linked, not copied. Random frames
+    are written with OpenCV. The folder is deleted on exit.
+
+    Parameters
+    ----------
+    folder : str
+        Input folder, or None for random 1080p frames.
+    n : int
+        Number of images.
+    ext : str, optional
+        Extension of the random frames, by default jpg.
+
+    Yields
+    ------
+    str
+        Folder name.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        if folder:
+            for fname in list_images(folder)[:n]:
+                os.symlink(os.path.abspath(fname),
+                           os.path.join(tmp, os.path.basename(fname)))
+        else:
+            for i, img in enumerate(random_frames(n)):
+                cv2.imwrite(os.path.join(tmp, f"{i:06d}.{ext}"), img)
+        yield tmp
+
+
+def timeit(f, n, *args, **kwargs):
+    """Run f and return the frames/sec and the result."""
+    start = time.perf_counter()
+    out = f(*args, **kwargs)
+    return n / (time.perf_counter() - start), out
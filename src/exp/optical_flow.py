@@ -21,17 +21,14 @@ from natsort import natsorted
 
 import numpy as np
 
-import pickle
-import pandas as pd
 import xarray as xr
 
-import cv2
+import netCDF4
 
-from scipy.interpolate import (LinearNDInterpolator,
-                               NearestNDInterpolator,
-                               CloughTocher2DInterpolator)
+import cv2
 
-import xarray as xr
+from scipy.spatial import Delaunay
+from scipy.interpolate import CloughTocher2DInterpolator
 
 from tqdm import tqdm
 
@@ -47,6 +44,85 @@ except ImportError:
 import warnings
 # warnings.simplefilter("ignore", UserWarning)
 
+# shared tools live with the post-processing scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "post"))
+from frames import FrameSource, add_frame_source_arguments  # noqa
+from ncstream import NetCDFStream  # noqa
+from flow import (FlowEngine, FlowStatistics, StageTimer, lattice,  # noqa
+                  flow_window)
+from geometry import (GeometryBundle, find_homography, read_camera_matrix,  # noqa
+                      read_gcps, parse_bbox, hash_parameters,
+                      add_geometry_arguments)
+
+
+# output variables, their units and the resolution used to pack them as int16
+FLOW_VARIABLES = {"u": ("pixels", 0.01),
+                  "v": ("pixels", 0.01),
+                  "angle": ("radians", 0.0002),
+                  "displacement": ("pixels", 0.01)}
+
+# packed value of cells without flow
+PACKED_FILL = -32767
+
+
+def flow_variables(precision: str = "float32", chunks: tuple = None):
+    """
+    Describe the output variables for NetCDFStream.
+
+    Parameters
+    ----------
+    precision : str, optional
+        float32, or int16 to pack the values with the scale factors in
+        FLOW_VARIABLES. By default float32.
+    chunks : tuple, optional
+        Chunk sizes along y and x, by default the whole grid.
+
+    Returns
+    -------
+    dict
+        Variable specifications. Cells without flow are NaN, or PACKED_FILL
+        when packed, and are flagged with _FillValue.
+    """
+    if precision not in ["float32", "int16"]:
+        raise ValueError(f"Unknown precision \"{precision}\". Use float32 "
+                         "or int16.")
+    variables = {}
+    for name, (units, scale) in FLOW_VARIABLES.items():
+        spec = dict(dims=("time", "y", "x"), dtype=precision, chunks=chunks,
+                    attrs={"units": units}, fill_value=np.float32(np.nan))
+        if precision == "int16":
+            spec.update(scale_factor=scale, fill_value=PACKED_FILL)
+        variables[name] = spec
+    return variables
+
+
+def pack(values: np.ndarray, name: str, precision: str = "float32"):
+    """
+    Pack a flow variable for NetCDFStream.append().
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Values of one time step.
+    name : str
+        Variable name, one of FLOW_VARIABLES.
+    precision : str, optional
+        float32 or int16. By default float32.
+
+    Returns
+    -------
+    np.ndarray
+        Values as stored in the file. Packed NaNs are set to PACKED_FILL.
+    """
+    if precision == "float32":
+        return values
+    scale = FLOW_VARIABLES[name][1]
+    packed = np.rint(values / scale)
+    packed = np.clip(packed, PACKED_FILL + 1, 32767, out=packed)
+    packed[np.isnan(values)] = PACKED_FILL
+    return packed
+
 
 # <<< GUI >>>
 def flex_add_argument(f):
@@ -83,101 +159,6 @@ else:
 # <<< END GUI >>>
 
 
-def find_homography(uv: np.ndarray, xyz: np.ndarray, mtx: np.ndarray,
-                    dist_coeffs: np.ndarray = np.zeros((1, 4)), z: float = 0,
-                    compute_error: bool = False):
-    """
-    Find homography based on ground control points.
-
-    Parameters
-    ----------
-    uv : np.ndarray
-        Nx2 array of image coordinates of gcps.
-    xyz : np.ndarray
-        Nx3 array of real-world coordinates of gcps.
-    mtx : np.ndarray
-        3x3 array containing the camera matrix
-    dist_coeffs : np.ndarray
-        1xN array with distortion coefficients with N = 4, 5 or 8
-    z : float
-        Real-world elevation to which the image should be projected.
-    compute_error : bool
-        Will compute re-projection erros in pixels if true.
-
-    Returns
-    -------
-    error: float
-        Rectification error in pixels or nan if compute_error=False.
-    H: np.ndarray
-        3x3 homography matrix.
-    """
-    uv = np.asarray(uv).astype(np.float32)
-    xyz = np.asarray(xyz).astype(np.float32)
-    mtx = np.asarray(mtx).astype(np.float32)
-
-    # compute camera pose
-    retval, rvec, tvec = cv2.solvePnP(xyz, uv, mtx, dist_coeffs)
-
-    # convert rotation vector to rotation matrix
-    R = cv2.Rodrigues(rvec)[0]
-
-    # assume height of projection plane
-    R[:, 2] = R[:, 2] * z
-
-    # add translation vector
-    R[:, 2] = R[:, 2] + tvec.flatten()
-
-    # compute homography
-    H = np.linalg.inv(np.dot(mtx, R))
-
-    # normalize homography
-    H = H / H[-1, -1]
-
-    # compute errors
-    if compute_error:
-        tot_error = 0
-        total_points = 0
-        for i in range(len(xyz)):
-            reprojected_points, _ = cv2.projectPoints(xyz[i],
-                                                      rvec, tvec,
-                                                      mtx,
-                                                      dist_coeffs)
-            tot_error += np.sum(np.abs(uv[i] - reprojected_points)**2)
-            total_points += i
-        mean_error_px = np.sqrt(tot_error / total_points)
-    else:
-        mean_error_px = None
-
-    return mean_error_px, H
-
-
-def rectify_image(img: np.ndarray, mtx: np.ndarray):
-    """
-    Rectify mage coordinates.
-
-    Parameters
-    ----------
-    img : np.ndarray
-        Input image aray.
-    mtx : np.ndarray
-        3x3 array containing the camera matrix
-
-    Returns
-    -------
-    x, y: np.ndarray
-        rectified coordinates
-    """
-
-    # get_pixel_coordinates(img)
-    u, v = np.meshgrid(range(img.shape[1]), range(img.shape[0]))
-    uv = np.vstack((u.flatten(), v.flatten())).T
-
-    # transform image using homography
-    xy = cv2.perspectiveTransform(np.asarray([uv]).astype(np.float32), mtx)[0]
-
-    return xy[:, 0].reshape(u.shape[:2]), xy[:, 1].reshape(v.shape[:2])
-
-
 @gui_decorator
 def main():
 
@@ -389,24 +370,98 @@ def main():
                              "for the polynomial expansion; for poly_n=5, you can set poly_sigma=1.1, for poly_n=7, "
                              "a good value would be poly_sigma=1.5.")
 
+    parser.add_argument("--flow_workers",
+                        action="store",
+                        dest="flow_workers",
+                        default=1,
+                        required=False,
+                        help="Number of processes computing the flow of "
+                             "image pairs. Default is 1.")
+
+    parser.add_argument("--pairs_per_task",
+                        action="store",
+                        dest="pairs_per_task",
+                        default=4,
+                        required=False,
+                        help="Number of consecutive image pairs given to a "
+                             "flow process at once. Default is 4.")
+
+    parser.add_argument("--spacing",
+                        action="store",
+                        dest="spacing",
+                        default=0,
+                        required=False,
+                        help="Compute a sparse flow by tracking a lattice of "
+                             "interrogation windows spaced by this number of "
+                             "grid cells (Lucas-Kanade). Default is 0, which "
+                             "computes the dense flow (Farneback).")
+
+    parser.add_argument("--window",
+                        action="store",
+                        dest="window",
+                        default=None,
+                        required=False,
+                        help="Size of the interrogation windows of the sparse "
+                             "flow in grid cells. Default is the spacing.")
+
+    parser.add_argument("--precision",
+                        action="store",
+                        dest="precision",
+                        default="float32",
+                        choices=["float32", "int16"],
+                        required=False,
+                        help="Storage type of the output. int16 packs the "
+                             "values with a scale factor. Default is float32.")
+
+    parser.add_argument("--chunk_size",
+                        action="store",
+                        dest="chunk_size",
+                        default=8,
+                        required=False,
+                        help="Number of frames per chunk in the netCDF "
+                             "output. Default is 8.")
+
+    parser.add_argument("--complevel",
+                        action="store",
+                        dest="complevel",
+                        default=4,
+                        required=False,
+                        help="Compression level of the netCDF output from 0 "
+                             "(none) to 9. Default is 4.")
+
+    parser.add_argument("--mean_output",
+                        action="store",
+                        dest="mean_output",
+                        default=None,
+                        required=False,
+                        help="Also write the time-averaged flow to this "
+                             "netCDF file. It is computed as the flow is "
+                             "computed.")
+
+    parser.add_argument("--no_cube",
+                        action="store_true",
+                        dest="no_cube",
+                        help="Do not write the flow of every pair, only the "
+                             "time-averaged flow (needs --mean_output).")
+
+    parser.add_argument("--resume",
+                        action="store_true",
+                        dest="resume",
+                        help="Continue a partially written output instead of "
+                             "overwriting it.")
+
     parser.add_argument("--show_results", "-show",
                         action="store_true",
                         dest="show",
                         help="Show results on screen.")
 
+    add_frame_source_arguments(parser)
+    add_geometry_arguments(parser)
+
     args = parser.parse_args()
 
     # read camera matrix and distortion coefficients
-    if args.camera_matrix.lower().endswith("json"):
-        with open(args.camera_matrix, 'r') as f:
-            cam = json.load(f)
-            mtx = np.asarray(cam["camera_matrix"])
-            dist = np.asarray(cam["distortion_coefficients"])
-    else:
-        with open(args.camera_matrix, 'rb') as f:
-            cam = pickle.load(f)
-            mtx = cam["camera_matrix"]
-            dist = cam["distortion_coefficients"]
+    mtx, dist = read_camera_matrix(args.camera_matrix)
 
     # parse time and FPS
     start_date = datetime.datetime.strptime(args.start_time, "%Y%m%d:%H%M%S")
@@ -428,10 +483,7 @@ def main():
     first_img = cv2.imread(images[0])
 
     # read gcp coordinates
-    df = pd.read_csv(args.gcps)
-
-    xyz = df[["x", "y", "z"]].values.astype(np.float32)
-    uv = df[["u", "v"]].values.astype(np.float32)
+    xyz, uv = read_gcps(args.gcps)
 
     # rectify
     if int(args.projection_height) == int(-999):
@@ -439,28 +491,11 @@ def main():
     else:
         pheight = float(args.projection_height)
 
-    error, H = find_homography(uv, xyz, mtx, dist_coeffs=dist, z=pheight,
-                               compute_error=args.reprojection_error)
-    ximg, yimg = rectify_image(first_img, H)
-    if error:
+    if args.reprojection_error:
+        error, _ = find_homography(uv, xyz, mtx, dist_coeffs=dist, z=pheight,
+                                   compute_error=True)
         print(f"  -- Re-projection error is {round(error, 1)} pixels")
 
-    # image coordinate points
-    XY = np.vstack([ximg.flatten(), yimg.flatten()]).T
-
-    # get points inside bbox
-    bbox = args.bbox.split(",")
-    bbox = np.array([float(bbox[0]), float(bbox[1]),
-                     float(bbox[2]), float(bbox[3])])
-    rect = patches.Rectangle((bbox[0], bbox[1]), bbox[2], bbox[3],
-                             linewidth=2, edgecolor='r', facecolor='none')
-    insiders = rect.contains_points(XY)
-    insiders_idx = np.arange(0, len(XY), 1)[insiders]
-    outsiders_idx = np.arange(0, len(XY), 1)[~insiders]
-    # iimg, jimg = np.unravel_index(outsiders_idx, ximg.shape)
-
-    points = XY[insiders_idx, :]
-
     # define grid
     dx = float(args.dx)
     dy = float(args.dy)
@@ -469,9 +504,18 @@ def main():
         dy = min(dx, dy)
         print("   -- warning: can only handle dx=dy. I am using the smallest.")
 
-    xlin = np.arange(bbox[0], bbox[0] + bbox[2], dx)
-    ylin = np.arange(bbox[1], bbox[1] + bbox[3], dy)
-    grid_x, grid_y = np.meshgrid(xlin, ylin)
+    # homography, pixels inside the bounding box and grid are cached
+    bbox = parse_bbox(args.bbox)
+    cache = None if args.no_geometry_cache else args.geometry_cache
+    geom = GeometryBundle.load(mtx, dist, xyz, uv, pheight, first_img.shape,
+                               bbox=bbox, dx=dx, dy=dy, cache=cache)
+
+    XY = geom.XY
+    insiders_idx = geom.insiders_idx
+
+    xlin = geom.xlin
+    ylin = geom.ylin
+    grid_x, grid_y = geom.grid()
 
     # read the mask
     with open(args.mask) as f:
@@ -481,9 +525,9 @@ def main():
     # mask points outside the mask
     grid_points = np.vstack([grid_x.flatten(), grid_y.flatten()]).T
     mask = patches.Polygon(coords, linewidth=2, edgecolor='r', facecolor='none')
-    insiders = mask.contains_points(grid_points)
-    outsiders_idx = np.arange(0, len(grid_points), 1)[~insiders]
-    imask, jmask = np.unravel_index(outsiders_idx, grid_x.shape)
+    insiders = mask.contains_points(grid_points).reshape(grid_x.shape)
+    if not insiders.any():
+        raise ValueError("The mask does not cover any grid cell.")
 
     # get new camera matrix
     h,  w = first_img.shape[:2]
@@ -516,95 +560,202 @@ def main():
     # a good value would be poly_sigma=1.5.
     poly_sigma = float(args.poly_sigma)  # 1.1
 
-    # < timeloop >
-    pbar = tqdm(total=len(images) - 1)
-
-    # output variables
-    uout = np.zeros([len(images) - 1, grid_x.shape[0], grid_y.shape[1]])
-    vout = np.zeros([len(images) - 1, grid_x.shape[0], grid_y.shape[1]])
-    mout = np.zeros([len(images) - 1, grid_x.shape[0], grid_y.shape[1]])
-    aout = np.zeros([len(images) - 1, grid_x.shape[0], grid_y.shape[1]])
-
-    times = np.array([start_date] * (len(images) - 1))
-    now = start_date
+    # the flow is only computed in the bounding window of the mask, with a
+    # margin for the flow windows at the coarsest pyramid level. The window
+    # starts on the lattice of the sparse flow.
+    spacing = int(args.spacing)
+    window = int(args.window) if args.window else None
+    step = max(spacing, 1)
+    rows = np.where(insiders.any(axis=1))[0]
+    cols = np.where(insiders.any(axis=0))[0]
+    crop = flow_window((rows[0], rows[-1] + 1), (cols[0], cols[-1] + 1),
+                       grid_x.shape,
+                       {"pyr_scale": pyr_scale, "levels": levels,
+                        "winsize": winsize, "poly_n": poly_n},
+                       spacing=spacing, window=window)
+    r0, r1, c0, c1 = crop
+    print(f"  -- Computing the flow in a {r1 - r0}x{c1 - c0} window of the "
+          f"{grid_x.shape[0]}x{grid_x.shape[1]} grid")
+
+    # the interpolation to the grid is computed only once: linear and
+    # nearest use a cached sparse operator that reads the raw images
+    # directly, ct reuses the same triangulation and undistortion maps
+    method = args.interp_method.lower()
+    if method in ["linear", "nearest"]:
+        geom.raw_grid_operator(mtx, dist, method)
+    elif method == "ct":
+        tri = Delaunay(XY[insiders_idx])
+        map_x, map_y = cv2.initUndistortRectifyMap(
+            mtx, dist, None, newcameramtx, (w, h), cv2.CV_16SC2)
+    else:
+        raise ValueError("Wrong interpolation methd. Use linear, nearest or ct.")
+
+    def project_timed(img, timer):
+        """Project an image as one item of the project stage."""
+        with timer("project"):
+            return project(img)
+
+    def project(img):
+        """Interpolate a raw image onto the window of the grid."""
+        if method == "ct":
+            img = cv2.remap(img, map_x, map_y, cv2.INTER_LINEAR)
+            f = CloughTocher2DInterpolator(tri, img.flatten()[insiders_idx])
+            return f(grid_x[r0:r1, c0:c1], grid_y[r0:r1, c0:c1])
+        return geom.to_grid(img, method, mtx, dist, crop)
+
+    # each image is decoded and projected only once, pairs of projected
+    # images are given to the flow workers in order
+    engine = FlowEngine((r1 - r0, c1 - c0),
+                        {"pyr_scale": pyr_scale, "levels": levels,
+                         "winsize": winsize, "iterations": iterations,
+                         "poly_n": poly_n, "poly_sigma": poly_sigma},
+                        workers=int(args.flow_workers),
+                        pairs_per_task=int(args.pairs_per_task),
+                        spacing=spacing, window=window)
+
+    # the output covers the whole grid (or the lattice of the sparse flow)
+    # and is NaN outside the mask
+    if spacing:
+        out_rows, out_cols = lattice(grid_x.shape, spacing)
+    else:
+        out_rows = np.arange(grid_x.shape[0])
+        out_cols = np.arange(grid_x.shape[1])
+    flow_x = xlin[out_cols]
+    flow_y = ylin[out_rows]
+    out_shape = (len(out_rows), len(out_cols))
+    outside = ~insiders[np.ix_(out_rows, out_cols)]
+    in_window = (slice(r0 // step, r0 // step + len(engine.rows)),
+                 slice(c0 // step, c0 // step + len(engine.cols)))
+
+    # flow results are streamed to disk, memory does not depend on the
+    # number of images
+    npairs = len(images) - 1
     dt = datetime.timedelta(seconds=1 / freq)
+    times = [start_date + i * dt for i in range(npairs)]
+
+    attrs = {"geometry": geom.key, "method": method,
+             "pyr_scale": pyr_scale, "levels": levels, "win_size": winsize,
+             "iterations": iterations, "poly_n": poly_n,
+             "poly_sigma": poly_sigma, "precision": args.precision,
+             "spacing": spacing, "window": str(args.window),
+             "mask": hash_parameters(coords),
+             "start_time": args.start_time, "frequency": freq}
+
+    cube = not args.no_cube
+    if not cube and not args.mean_output:
+        raise ValueError("--no_cube needs --mean_output.")
+    if not cube and args.resume:
+        raise ValueError("--resume needs the flow of every pair, it cannot "
+                         "be used with --no_cube.")
+
+    # pairs that are already on disk are skipped
+    done = 0
+    if args.resume and os.path.isfile(args.output):
+        with netCDF4.Dataset(args.output) as ds:
+            changed = [k for k, v in attrs.items()
+                       if str(ds.__dict__.get(k)) != str(v)]
+            done = len(ds.dimensions["time"])
+        if changed:
+            raise ValueError(f"\"{args.output}\" was created with different "
+                             f"parameters ({', '.join(changed)}).")
+        if done >= npairs and not args.mean_output:
+            print("  -- All pairs are already in the output, nothing to do.")
+            return
+        print(f"  -- Resuming after {done} pairs")
+
+    # time-averaged flow, pairs already on disk are read back in chunks
+    stats = None
+    if args.mean_output:
+        stats = FlowStatistics(out_shape)
+        if done:
+            with netCDF4.Dataset(args.output) as ds:
+                nchunk = ds["u"].chunking()[0]
+                for k in range(0, done, nchunk):
+                    block = {name: np.ma.filled(
+                        ds[name][k:k + nchunk].astype(np.float64), np.nan)
+                        for name in ["u", "v", "displacement", "angle"]}
+                    stats.add_batch(**block)
+
+    if cube:
+        chunks = (min(len(flow_y), 256), min(len(flow_x), 256))
+        nc = NetCDFStream(
+            args.output, flow_variables(args.precision, chunks),
+            coords={"x": (flow_x, {"units": "m"}),
+                    "y": (flow_y, {"units": "m"})},
+            attrs=attrs,
+            buffer_size=int(args.chunk_size),
+            complevel=int(args.complevel),
+            mode="a" if args.resume else "w",
+            start=done if args.resume else None)
 
-    for i in range(len(images) - 1):
-
-        # read the image
-        prv = cv2.cvtColor(cv2.imread(images[i]), cv2.COLOR_BGR2GRAY)
-        nxt = cv2.cvtColor(cv2.imread(images[i + 1]), cv2.COLOR_BGR2GRAY)
-        
-        # undistort
-        prv = cv2.undistort(prv, mtx, dist, None, newcameramtx)
-        nxt = cv2.undistort(nxt, mtx, dist, None, newcameramtx)
-
-        # project
-        if args.interp_method.lower()  == "linear":
-            fp = LinearNDInterpolator(XY[insiders_idx], prv.flatten()[insiders_idx])
-            fn = LinearNDInterpolator(XY[insiders_idx], nxt.flatten()[insiders_idx])
-        elif args.interp_method.lower()  == "nearest":
-            fp = NearestNDInterpolator(XY[insiders_idx], prv.flatten()[insiders_idx])
-            fn = NearestNDInterpolator(XY[insiders_idx], nxt.flatten()[insiders_idx])
-        elif args.interp_method.lower()  == "ct":
-            fp = CloughTocher2DInterpolator(XY[insiders_idx], prv.flatten()[insiders_idx])
-            fn = CloughTocher2DInterpolator(XY[insiders_idx], nxt.flatten()[insiders_idx])
-        else:
-            raise ValueError("Wrong interpolation methd. Use linear, nearest or ct.")
-        
-        prv = fp(grid_x, grid_y)
-        nxt = fn(grid_x, grid_y)
-
-        # compute the flow
-        uv = cv2.calcOpticalFlowFarneback(prv, nxt, None, pyr_scale, levels,
-                                          winsize, iterations,
-                                          poly_n, poly_sigma, 0)
-
-        # convert to m/s
-        # magnitude is how much the pixel moved
-        mag, ang = cv2.cartToPolar(uv[...,0], uv[...,1])
-        displacement = mag * dx  # how much the pixel moved times the grid size
-        # speed = displacement * freq  # dS/dt -> this gives m/s
-
-        # go back to u,v
-        u, v = uv[...,0], uv[...,1]
-
-        u[imask, jmask] = np.ma.masked  # apply mask
-        v[imask, jmask] = np.ma.masked  # apply mask
-        mag[imask, jmask] = np.ma.masked  # apply mask
-        ang[imask, jmask] = np.ma.masked  # apply mask
-
-
-        uout[i, :, :] = u
-        vout[i, :, :] = v
-        mout[i, :, :] = mag
-        aout[i, :, :] = ang
-
-        # time increment
-        times[i] = now
-        now += dt
+    # < timeloop >
+    pbar = tqdm(total=npairs, initial=done)
+
+    frames = FrameSource(images[done:], workers=int(args.workers),
+                         prefetch_mb=float(args.prefetch_mb),
+                         processes=args.use_processes, color="gray")
+
+    timer = StageTimer()
+    flows = engine(project_timed(img, timer)
+                   for _, img in timer.iterate(frames, "decode"))
+    for i, uv in enumerate(timer.iterate(flows, "flow"), done):
+
+        with timer("output"):
+
+            # magnitude is how much the pixel moved
+            mag, ang = cv2.cartToPolar(uv[..., 0], uv[..., 1])
+            # displacement = mag * dx  # how much the pixel moved times the grid size
+            # speed = displacement * freq  # dS/dt -> this gives m/s
+
+            # back to the whole grid, NaN outside the mask
+            values = {}
+            for name, x in zip(["u", "v", "angle", "displacement"],
+                               [uv[..., 0], uv[..., 1], ang, mag]):
+                values[name] = np.full(out_shape, np.nan, np.float32)
+                values[name][in_window] = x
+                values[name][outside] = np.nan
+            values["angle"][np.isnan(values["displacement"])] = np.nan
+
+            if stats is not None:
+                stats.add(**values)
+            if cube:
+                nc.append(times[i], **{name: pack(values[name], name,
+                                                  args.precision)
+                                       for name in values})
 
         pbar.update()
     pbar.close()
-
-    ds = xr.Dataset()
-    # write flow variable
-    ds['u'] = (('time', 'x', 'y'), uout)
-    ds['v'] = (('time', 'x', 'y'), vout)
-    ds['angle'] = (('time', 'x', 'y'), aout)
-    ds['displacement'] = (('time', 'x', 'y'), mout)
-    # write coordinates
-    ds.coords['time'] = times
-    ds.coords["x"] = xlin
-    ds.coords["y"] = ylin
-    # write to file
-    units = 'days since 2000-01-01 00:00:00'
-    calendar = 'gregorian'
-    encoding = dict(time=dict(units=units, calendar=calendar))
-    ds.to_netcdf(args.output, encoding=encoding)
-
-    print("\n Final dataset:")
-    print(ds)
+    if cube:
+        nc.close()
+
+    print("\n Throughput per stage:")
+    print(timer.report())
+
+    if cube:
+        print("\n Final dataset:")
+        with xr.open_dataset(args.output) as ds:
+            print(ds)
+
+    # compact time-averaged flow
+    if stats is not None:
+        units = {"u": "pixels", "v": "pixels", "displacement": "pixels"}
+        mean = xr.Dataset(attrs=dict(attrs, pairs=npairs,
+                                     time_start=times[0].isoformat(),
+                                     time_end=times[-1].isoformat()))
+        for name, values in stats.result().items():
+            base = name.split("_")[0]
+            mean[name] = (("y", "x"), values,
+                          {"units": units[base]} if base in units else {})
+        mean["angle"].attrs["units"] = "radians"
+        mean["angle"].attrs["long_name"] = "vector-averaged direction"
+        mean["steadiness"].attrs["long_name"] = "length of the mean unit " \
+                                                "vector"
+        mean.coords["x"] = ("x", flow_x, {"units": "m"})
+        mean.coords["y"] = ("y", flow_y, {"units": "m"})
+        mean.to_netcdf(args.mean_output)
+
+        print("\n Time-averaged flow:")
+        print(mean)
 
     print("\nMy work is done!")
 
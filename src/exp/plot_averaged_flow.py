@@ -10,11 +10,7 @@ Plot averaged optical flow vectors.
 
 import argparse
 
-import xarray as xr
-
-from welford import Welford
-
-import cv2
+import netCDF4
 
 import numpy as np
 
@@ -31,6 +27,95 @@ import warnings
 warnings.filterwarnings("ignore")
 
 
+def time_chunk(var, chunk_size: int = 0, memory_mb: float = 128):
+    """
+    Number of time steps to read at once.
+
+    Parameters
+    ----------
+    var : netCDF4.Variable
+        Variable with time as first dimension.
+    chunk_size : int, optional
+        Number of time steps, by default 0 to use as many whole chunks of
+        the file as fit in memory_mb.
+    memory_mb : float, optional
+        Memory for one variable, in MB. By default 128.
+
+    Returns
+    -------
+    int
+        Number of time steps.
+    """
+    if int(chunk_size) > 0:
+        return int(chunk_size)
+    chunking = var.chunking()
+    base = 1 if chunking == "contiguous" else chunking[0]
+    step = np.prod(var.shape[1:]) * 8  # read as float64
+    return max(int(memory_mb * 2**20 // (step * base)), 1) * base
+
+
+def time_average(fname: str, chunk_size: int = 0):
+    """
+    Vector-averaged direction and mean displacement of a flow file.
+
+    The angle is averaged as unit vectors, so that directions on both sides
+    of 0 (or 2 pi) do not cancel out. The file is read in large time
+    chunks, so the memory used does not depend on its length. Files written
+    with optical_flow.py --mean_output are already averaged and are read
+    directly.
+
+    Parameters
+    ----------
+    fname : str
+        Flow file from optical_flow.py.
+    chunk_size : int, optional
+        Number of time steps read at once, see time_chunk().
+
+    Returns
+    -------
+    x, y : np.ndarray
+        Grid axes.
+    angle : np.ndarray
+        Mean direction in radians.
+    displacement : np.ndarray
+        Mean displacement.
+    """
+    with netCDF4.Dataset(fname) as ds:
+        x = ds["x"][:]
+        y = ds["y"][:]
+        if "time" not in ds["angle"].dimensions:
+            return x, y, np.ma.filled(ds["angle"][:], np.nan), \
+                np.ma.filled(ds["displacement_mean"][:], np.nan)
+
+        n = len(ds.dimensions["time"])
+        chunk = time_chunk(ds["angle"], chunk_size)
+
+        shape = ds["angle"].shape[1:]
+        sin = np.zeros(shape)
+        cos = np.zeros(shape)
+        dsum = np.zeros(shape)
+        count = np.zeros(shape, np.int64)
+
+        pbar = tqdm(total=n)
+        for k in range(0, n, chunk):
+            a = np.ma.filled(ds["angle"][k:k + chunk].astype(np.float64),
+                             np.nan)
+            d = np.ma.filled(
+                ds["displacement"][k:k + chunk].astype(np.float64), np.nan)
+            valid = np.isfinite(a) & np.isfinite(d)
+            count += valid.sum(axis=0)
+            cos += np.where(valid, np.cos(a), 0).sum(axis=0)
+            sin += np.where(valid, np.sin(a), 0).sum(axis=0)
+            dsum += np.where(valid, d, 0).sum(axis=0)
+            pbar.update(len(a))
+        pbar.close()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        angle = np.where(count > 0, np.arctan2(sin, cos), np.nan)
+        displacement = np.where(count > 0, dsum / count, np.nan)
+    return x, y, angle, displacement
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
@@ -63,6 +148,14 @@ if __name__ == '__main__':
                         required=False,
                         help="Scale for the arrows.")
 
+    parser.add_argument("--chunk_size",
+                        action="store",
+                        dest="chunk_size",
+                        default=0,
+                        required=False,
+                        help="Number of time steps read at once. Default is "
+                             "0, which reads as many as fit in 128MB.")
+
     parser.add_argument("--output", "-o",
                         action="store",
                         dest="output",
@@ -90,38 +183,17 @@ if __name__ == '__main__':
     except Exception:
         has_avg = False
 
-    # read the data
-    ds = xr.open_dataset(args.input)
-    x = ds["x"].values
-    y = ds["y"].values
+    # read the data and average it
+    x, y, a_mean, d_mean = time_average(args.input, int(args.chunk_size))
     grid_x, grid_y = np.meshgrid(x, y)
 
-    # instanciate Welford's objects
-    Wd = Welford()
-    Wa = Welford()
-    # Wd = Welford()
-
-    # compute the average iteratively
-    pbar = tqdm(total=len(ds["time"].values))
-    for i, time in enumerate(ds["time"].values):
-
-        a = ds.isel(time=i)["angle"].values
-        d = ds.isel(time=i)["displacement"].values
-
-        # Wu.add(u)
-        Wa.add(a)
-        Wd.add(d)
-
-        pbar.update()
-    pbar.close()
-
-    # get the average and deviations
-    a_mean = Wa.mean
-    d_mean = Wd.mean
-
     u_mean = np.cos(a_mean)  # scaled vector component
     v_mean = np.sin(a_mean)  # scaled vector component
 
+    d_mean = np.ma.masked_invalid(d_mean)
+    u_mean = np.ma.masked_invalid(u_mean)
+    v_mean = np.ma.masked_invalid(v_mean)
+
     d_mean = np.ma.masked_equal(d_mean, 0)
     v_mean = np.ma.masked_equal(v_mean, 0)
     u_mean = np.ma.masked_equal(u_mean, 0)
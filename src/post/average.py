@@ -8,15 +8,9 @@ Average a series of images iteratively.
 # VERSION  : 1.0
 """
 import argparse
-from glob import glob
-from natsort import natsorted
 
-import numpy as np
-
-from skimage.io import imread, imsave
-from skimage.util import img_as_float64
-
-from tqdm import tqdm
+from frames import add_frame_source_arguments
+from products import compute_products, add_average_arguments
 
 
 if __name__ == "__main__":
@@ -40,42 +34,14 @@ if __name__ == "__main__":
                         required=False,
                         help="Output average image name.",)
 
-    args = parser.parse_args()
-
-    # main()
-
-    imlist = natsorted(glob(args.input + "/*"))
-
-    # assuming all images are the same size, get dimensions of first image
-    h, w, c = imread(imlist[0]).shape
-    N = len(imlist)
-
-    # create a numpy array of floats to store the average (assume RGB images)
-    arr = np.zeros((h, w, c), np.float64)
+    add_average_arguments(parser)
+    add_frame_source_arguments(parser)
 
-    # progress bar
-    pbar = tqdm(total=N)
-
-    # build up average pixel intensities, casting each image as an array of
-    # floats
-    for i, im in enumerate(imlist):
-
-        # ignore files that are not images
-        try:
-            img = imread(im)
-        except Exception:
-            pass
-
-        imarr = img_as_float64(img)
-        arr = arr + imarr / N
-
-        pbar.update()
-
-    pbar.close()
-
-    # scale the values and cast to integers
-    new_arr = ((arr - arr.min()) *
-               (1 / (arr.max() - arr.min()) * 255)).astype('uint8')
+    args = parser.parse_args()
 
-    # save the output
-    imsave(args.output, new_arr)
+    compute_products(args.input, {"average": args.output},
+                     workers=int(args.workers),
+                     prefetch_mb=float(args.prefetch_mb),
+                     processes=args.use_processes,
+                     precision=args.precision,
+                     block_size=int(args.block_size))
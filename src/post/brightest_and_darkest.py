@@ -1,5 +1,5 @@
 """
-Find the brightest and darkest images via color space conversions.
+Find the brightest and darkest images in a series of images.
 
 # SCRIPT   : brightest_and_darkest.py
 # POURPOSE : ind the brightest and darkest images in a series of images.
@@ -8,16 +8,9 @@ Find the brightest and darkest images via color space conversions.
 # VERSION  : 1.0
 """
 import argparse
-from glob import glob
-from natsort import natsorted
 
-import numpy as np
-
-from skimage.io import imread, imsave
-
-from skimage.color import rgb2hsv
-
-from tqdm import tqdm
+from frames import add_frame_source_arguments
+from products import compute_products, add_brightness_arguments
 
 
 if __name__ == "__main__":
@@ -48,41 +41,16 @@ if __name__ == "__main__":
                         required=False,
                         help="Output name for darkest image.",)
 
-    args = parser.parse_args()
-
-    # main()
-
-    imlist = natsorted(glob(args.input + "/*"))
-
-    # assuming all images are the same size, get dimensions of first image
-    h, w, c = imread(imlist[0]).shape
-    N = len(imlist)
-
-    # create a numpy array of floats to store the average (assume RGB images)
-    arr = np.zeros((h, w, c), np.float64)
+    add_brightness_arguments(parser)
+    add_frame_source_arguments(parser)
 
-    # progress bar
-    pbar = tqdm(total=N)
-
-    # build up average pixel intensities, casting each image as an array of
-    # floats
-    brightness = []
-    for i, im in enumerate(imlist):
-
-        # ignore files that are not images
-        try:
-            img = imread(im)
-        except Exception:
-            pass
-
-        imarr = rgb2hsv(img)
-
-        brightness.append(imarr[:, :, 2].sum())
-
-        pbar.update()
-
-    pbar.close()
+    args = parser.parse_args()
 
-    # save the outputs
-    imsave(args.brightest, imread(imlist[np.argmax(brightness)]))
-    imsave(args.darkest, imread(imlist[np.argmin(brightness)]))
+    compute_products(args.input, {"brightest": args.brightest,
+                                  "darkest": args.darkest},
+                     workers=int(args.workers),
+                     prefetch_mb=float(args.prefetch_mb),
+                     processes=args.use_processes,
+                     metric=args.metric,
+                     stride=int(args.stride),
+                     keep=int(args.keep))
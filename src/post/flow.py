@@ -0,0 +1,623 @@
+"""
+Dense optical flow between consecutive frames.
+
+# SCRIPT   : flow.py
+# POURPOSE : Compute dense Farneback or sparse Lucas-Kanade optical flow
+#            for all consecutive pairs of a series of rectified frames, in
+#            order, with one process or with a pool of processes that share
+#            the frames through shared memory.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import time
+
+from itertools import islice
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import cv2
+
+from reducers import StreamingMoments
+
+
+# default parameters of cv2.calcOpticalFlowFarneback()
+FARNEBACK = {"pyr_scale": 0.5, "levels": 3, "winsize": 3, "iterations": 10,
+             "poly_n": 5, "poly_sigma": 1.1}
+
+# cv2.FarnebackOpticalFlow stops adding pyramid levels below this size
+FARNEBACK_MIN_SIZE = 32
+
+# shared arrays of a worker process
+_shared = {}
+
+
+def farneback_create(params: dict = None):
+    """
+    Farneback optical flow object.
+
+    The object keeps its pyramid and polynomial expansion buffers between
+    calls, so one object should be used for all pairs of a series.
+
+    Parameters
+    ----------
+    params : dict, optional
+        Farneback parameters, by default FARNEBACK.
+
+    Returns
+    -------
+    cv2.FarnebackOpticalFlow
+        Use its calc(prv, nxt, None) method.
+    """
+    p = dict(FARNEBACK, **(params or {}))
+    return cv2.FarnebackOpticalFlow_create(
+        numLevels=int(p["levels"]), pyrScale=float(p["pyr_scale"]),
+        fastPyramids=False, winSize=int(p["winsize"]),
+        numIters=int(p["iterations"]), polyN=int(p["poly_n"]),
+        polySigma=float(p["poly_sigma"]), flags=0)
+
+
+def farneback(prv: np.ndarray, nxt: np.ndarray, params: dict = None):
+    """
+    Dense optical flow between two frames.
+
+    Parameters
+    ----------
+    prv, nxt : np.ndarray
+        Single-band frames.
+    params : dict, optional
+        Farneback parameters, by default FARNEBACK.
+
+    Returns
+    -------
+    np.ndarray
+        Flow in pixels, (rows, cols, 2) float32.
+    """
+    return farneback_create(params).calc(prv, nxt, None)
+
+
+def lattice(shape: tuple, spacing: int):
+    """
+    Rows and columns of the centres of a lattice of interrogation windows.
+
+    Parameters
+    ----------
+    shape : tuple
+        Frame shape, (rows, cols).
+    spacing : int
+        Distance between window centres, in pixels.
+
+    Returns
+    -------
+    rows, cols : np.ndarray
+        Row and column indexes of the window centres.
+    """
+    spacing = max(int(spacing), 1)
+    return (np.arange(spacing // 2, shape[0], spacing),
+            np.arange(spacing // 2, shape[1], spacing))
+
+
+class LucasKanade:
+    """
+    Sparse optical flow at the centres of a lattice of windows.
+
+    Each window centre is tracked from one frame to the next with the
+    pyramidal Lucas-Kanade method. Frames are converted to uint8, with NaN
+    set to 0. Windows that cannot be tracked get a NaN flow.
+
+    Parameters
+    ----------
+    shape : tuple
+        Frame shape, (rows, cols).
+    spacing : int
+        Distance between window centres, in pixels.
+    window : int, optional
+        Size of the interrogation windows, by default spacing.
+    levels : int, optional
+        Number of pyramid levels including the frame itself, by default 3.
+    iterations : int, optional
+        Maximum number of iterations at each level, by default 10.
+    """
+
+    def __init__(self, shape: tuple, spacing: int, window: int = None,
+                 levels: int = 3, iterations: int = 10):
+        self.rows, self.cols = lattice(shape, spacing)
+        self.shape = (len(self.rows), len(self.cols))
+        cols, rows = np.meshgrid(self.cols, self.rows)
+        self.points = np.stack([cols.ravel(), rows.ravel()],
+                               axis=-1).astype(np.float32)[:, None, :]
+        window = max(int(window or spacing), 3)
+        self.options = dict(winSize=(window, window),
+                            maxLevel=max(int(levels) - 1, 0),
+                            criteria=(cv2.TERM_CRITERIA_EPS |
+                                      cv2.TERM_CRITERIA_COUNT,
+                                      int(iterations), 0.01))
+
+    @staticmethod
+    def _uint8(img):
+        """Frame as uint8."""
+        if img.dtype == np.uint8:
+            return img
+        img = np.nan_to_num(img, nan=0, posinf=255, neginf=0)
+        return np.clip(np.rint(img), 0, 255).astype(np.uint8)
+
+    def calc(self, prv: np.ndarray, nxt: np.ndarray, flow=None):
+        """
+        Flow between two frames, like cv2.FarnebackOpticalFlow.calc().
+
+        Parameters
+        ----------
+        prv, nxt : np.ndarray
+            Single-band frames.
+        flow : None
+            Unused.
+
+        Returns
+        -------
+        np.ndarray
+            Flow in pixels on the lattice, (rows, cols, 2) float32.
+        """
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(
+            self._uint8(prv), self._uint8(nxt), self.points, None,
+            **self.options)
+        uv = (moved - self.points)[:, 0, :]
+        uv[status.ravel() == 0] = np.nan
+        return uv.reshape(self.shape + (2, ))
+
+
+def flow_create(shape: tuple, params: dict = None, spacing: int = 0,
+                window: int = None):
+    """
+    Flow object for dense (spacing = 0) or sparse flow.
+
+    Parameters
+    ----------
+    shape : tuple
+        Frame shape, (rows, cols).
+    params : dict, optional
+        Farneback parameters, by default FARNEBACK. The sparse flow uses
+        levels and iterations.
+    spacing : int, optional
+        Distance between window centres of the sparse flow, by default 0
+        (dense flow).
+    window : int, optional
+        Size of the interrogation windows, by default spacing.
+
+    Returns
+    -------
+    object
+        Use its calc(prv, nxt, None) method.
+    """
+    if not spacing:
+        return farneback_create(params)
+    p = dict(FARNEBACK, **(params or {}))
+    return LucasKanade(shape, spacing, window, p["levels"], p["iterations"])
+
+
+def flow_window(rows: tuple, cols: tuple, shape: tuple, params: dict = None,
+                spacing: int = 0, window: int = None):
+    """
+    Window of a frame needed to compute the flow of a region of it.
+
+    The flow inside the region is the same as on the whole frame when the
+    window adds a margin of twice the flow support at the coarsest pyramid
+    level around it. Farneback has levels extra levels, each pyr_scale
+    times smaller, and its support is winsize plus poly_n. Lucas-Kanade
+    halves the frame levels - 1 times and its support is the window. The
+    window is also kept large enough for OpenCV to build the same pyramid
+    levels as on the whole frame. Its first row and column are multiples of
+    spacing, so that it starts on the lattice of the sparse flow.
+
+    Parameters
+    ----------
+    rows, cols : tuple
+        First and last + 1 row and column of the region.
+    shape : tuple
+        Frame shape, (rows, cols).
+    params : dict, optional
+        Farneback parameters, by default FARNEBACK. The sparse flow uses
+        levels.
+    spacing : int, optional
+        Distance between window centres of the sparse flow, by default 0
+        (dense flow).
+    window : int, optional
+        Size of the interrogation windows, by default spacing.
+
+    Returns
+    -------
+    tuple
+        First and last + 1 row and column of the window, (r0, r1, c0, c1).
+    """
+    p = dict(FARNEBACK, **(params or {}))
+    if spacing:
+        scale = 0.5 ** max(int(p["levels"]) - 1, 0)
+        support = max(int(window or spacing), 3)
+        min_size = 0
+    else:
+        scale = float(p["pyr_scale"]) ** int(p["levels"])
+        support = int(p["winsize"]) + int(p["poly_n"])
+        min_size = int(np.ceil(FARNEBACK_MIN_SIZE / scale))
+    margin = int(np.ceil(2 * support / scale))
+    step = max(int(spacing), 1)
+
+    out = []
+    for (first, last), size in zip([rows, cols], shape):
+        lo = max(first - margin, 0)
+        hi = min(last + margin, size)
+
+        # grow on both sides up to min_size, or the whole frame
+        grow = min(min_size, size) - (hi - lo)
+        if grow > 0:
+            lo = max(lo - (grow + 1) // 2, 0)
+            hi = min(max(hi + grow // 2, lo + min_size), size)
+            lo = max(min(lo, hi - min_size), 0)
+        out.extend([lo // step * step, hi])
+    return tuple(out)
+
+
+def _attach(arrays: dict, options: dict):
+    """Map the shared arrays in a worker process."""
+    for key, (name, shape) in arrays.items():
+        # pool workers share the resource tracker of the parent, which
+        # owns the memory and releases it with unlink()
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[key] = (shm, np.ndarray(shape, np.float32, buffer=shm.buf))
+    _shared["flow"] = flow_create(**options)
+
+
+def _flow_range(batch: int, start: int, stop: int):
+    """Compute the flow of pairs start to stop - 1 of a batch."""
+    frames = _shared["frames"][1][batch]
+    flows = _shared["flows"][1][batch]
+    for k in range(start, stop):
+        flows[k] = _shared["flow"].calc(frames[k], frames[k + 1], None)
+    return batch, start, stop
+
+
+class FlowEngine:
+    """
+    Optical flow of all consecutive pairs of a series of frames.
+
+    With one worker, pairs are computed one after the other. With more
+    workers, frames are copied to a shared memory buffer of two batches of
+    ``workers * pairs_per_task`` pairs. Each batch is split into ranges of
+    ``pairs_per_task`` pairs that are computed by a pool of processes while
+    the next batch is being filled. Flows are always yielded in order.
+
+    With a spacing, the flow is only computed at the centres of a lattice
+    of interrogation windows (see LucasKanade), which is much cheaper than
+    the dense flow.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the frames, (rows, cols).
+    params : dict, optional
+        Farneback parameters, by default FARNEBACK.
+    workers : int, optional
+        Number of processes, by default 1.
+    pairs_per_task : int, optional
+        Number of consecutive pairs given to a process at once, by
+        default 4.
+    spacing : int, optional
+        Distance between window centres of the sparse flow, in pixels. By
+        default 0, which computes the dense flow.
+    window : int, optional
+        Size of the interrogation windows, by default spacing.
+    """
+
+    def __init__(self, shape: tuple, params: dict = None, workers: int = 1,
+                 pairs_per_task: int = 4, spacing: int = 0,
+                 window: int = None):
+
+        self.shape = tuple(shape[:2])
+        self.params = dict(FARNEBACK, **(params or {}))
+        self.workers = max(int(workers), 1)
+        self.pairs_per_task = max(int(pairs_per_task), 1)
+        self.batch_size = self.workers * self.pairs_per_task
+        self.options = dict(shape=self.shape, params=self.params,
+                            spacing=int(spacing or 0), window=window)
+
+        # output lattice
+        if spacing:
+            self.rows, self.cols = lattice(self.shape, spacing)
+        else:
+            self.rows = np.arange(self.shape[0])
+            self.cols = np.arange(self.shape[1])
+        self.flow_shape = (len(self.rows), len(self.cols))
+
+    def __call__(self, frames):
+        """
+        Yield the flow of each pair of consecutive frames.
+
+        Parameters
+        ----------
+        frames : iterable
+            Single-band frames of the shape given to the engine.
+
+        Yields
+        ------
+        np.ndarray
+            Flow in pixels, (rows, cols, 2) float32, on the lattice given
+            by self.rows and self.cols.
+        """
+        frames = iter(frames)
+        if self.workers == 1:
+            yield from self._serial(frames)
+        else:
+            yield from self._parallel(frames)
+
+    def _serial(self, frames):
+        """Compute the pairs one after the other."""
+        flow = flow_create(**self.options)
+        prv = next(frames, None)
+        for nxt in frames:
+            yield flow.calc(prv, nxt, None)
+            prv = nxt
+
+    def _parallel(self, frames):
+        """Compute the pairs with a pool of processes."""
+        first = next(frames, None)
+        if first is None:
+            return
+
+        nbatch = self.batch_size
+        shapes = {"frames": (2, nbatch + 1) + self.shape,
+                  "flows": (2, nbatch) + self.flow_shape + (2, )}
+        shms = {key: shared_memory.SharedMemory(
+                    create=True, size=int(np.prod(shape)) * 4)
+                for key, shape in shapes.items()}
+        try:
+            buf = {key: np.ndarray(shape, np.float32, buffer=shms[key].buf)
+                   for key, shape in shapes.items()}
+            arrays = {key: (shms[key].name, shape)
+                      for key, shape in shapes.items()}
+
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     initializer=_attach,
+                                     initargs=(arrays, self.options)) as pool:
+
+                buf["frames"][0, 0] = first
+                batch = 0
+                pending = None
+                while True:
+
+                    # slot 0 already holds the last frame of the last batch
+                    n = 0
+                    for n, img in enumerate(islice(frames, nbatch), 1):
+                        buf["frames"][batch, n] = img
+                    futures = [pool.submit(_flow_range, batch, a,
+                                           min(a + self.pairs_per_task, n))
+                               for a in range(0, n, self.pairs_per_task)]
+
+                    # results of the last batch while this one is computed
+                    if pending is not None:
+                        yield from self._collect(buf["flows"], *pending)
+                    if n == 0:
+                        break
+                    pending = (batch, n, futures)
+
+                    # the next batch starts where this one ends
+                    buf["frames"][1 - batch, 0] = buf["frames"][batch, n]
+                    batch = 1 - batch
+        finally:
+            buf = None
+            for shm in shms.values():
+                shm.close()
+                shm.unlink()
+
+    @staticmethod
+    def _collect(flows, batch, n, futures):
+        """Wait for a batch and yield its flows in order."""
+        for future in futures:
+            future.result()
+        for k in range(n):
+            yield flows[batch, k].copy()
+
+
+class StageTimer:
+    """
+    Time the stages of a frame pipeline.
+
+    Stages can be nested, e.g. the frames decoded while waiting for a flow.
+    The time of a stage does not include the time of the stages nested in
+    it.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        self._nested = []
+
+    @contextmanager
+    def __call__(self, name: str):
+        """Time one item of a stage."""
+        self._nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            self.seconds[name] = self.seconds.get(name, 0) + elapsed - nested
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def iterate(self, iterable, name: str):
+        """
+        Time each item drawn from an iterable.
+
+        Parameters
+        ----------
+        iterable : iterable
+            Stage input.
+        name : str
+            Stage name.
+
+        Yields
+        ------
+        object
+            Items of the iterable.
+        """
+        items = iter(iterable)
+        while True:
+            with self(name):
+                item = next(items, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def report(self):
+        """
+        Throughput of each stage.
+
+        Returns
+        -------
+        str
+            One line per stage, in the order the stages were first timed.
+        """
+        lines = []
+        for name, seconds in self.seconds.items():
+            count = self.counts[name]
+            lines.append(f"  -- {name:10s}: {count:6d} items in "
+                         f"{seconds:8.2f}s, "
+                         f"{count / max(seconds, 1e-9):8.2f} items/sec")
+        return "\n".join(lines)
+
+
+class FlowStatistics:
+    """
+    Running time statistics of a flow field.
+
+    The mean and variance of u, v and the displacement are kept by
+    StreamingMoments (see reducers.py), which reduces blocks of pairs at
+    once and skips cells without flow (NaN), so that they do not spoil the
+    others. The mean direction is the direction of the mean unit vector,
+    and its length (from 0 to 1) tells how steady the direction is.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the flow field, (rows, cols).
+    block_size : int, optional
+        Number of pairs reduced at once, by default 16.
+    """
+
+    VARIABLES = ["u", "v", "displacement"]
+
+    def __init__(self, shape: tuple, block_size: int = 16):
+        self.moments = {name: StreamingMoments(skipna=True, shape=shape)
+                        for name in self.VARIABLES}
+        self.cos = np.zeros(shape)
+        self.sin = np.zeros(shape)
+        self.block = {name: np.empty((max(int(block_size), 1), ) + shape,
+                                     np.float32)
+                      for name in self.VARIABLES + ["angle"]}
+        self.k = 0  # pairs in the current block
+
+    def _flush(self):
+        if self.k == 0:
+            return
+        k, self.k = self.k, 0
+        self._reduce(**{name: block[:k] for name, block in self.block.items()})
+
+    def _reduce(self, u, v, displacement, angle):
+        valid = np.isfinite(u) & np.isfinite(v)
+        for name, x in zip(self.VARIABLES, [u, v, displacement]):
+            self.moments[name].add_batch(np.where(valid, x, np.nan))
+        self.cos += np.where(valid, np.cos(angle), 0).sum(axis=0)
+        self.sin += np.where(valid, np.sin(angle), 0).sum(axis=0)
+
+    @property
+    def n(self):
+        """Number of pairs with flow in each cell."""
+        self._flush()
+        return self.moments["u"].n
+
+    def add(self, u: np.ndarray, v: np.ndarray, displacement: np.ndarray,
+            angle: np.ndarray):
+        """
+        Add the flow of one pair.
+
+        Parameters
+        ----------
+        u, v : np.ndarray
+            Flow components.
+        displacement : np.ndarray
+            Flow magnitude.
+        angle : np.ndarray
+            Flow direction in radians.
+
+        Returns
+        -------
+        None
+        """
+        for name, x in zip(self.VARIABLES + ["angle"],
+                           [u, v, displacement, angle]):
+            self.block[name][self.k] = x
+        self.k += 1
+        if self.k == len(self.block["u"]):
+            self._flush()
+
+    def add_batch(self, u: np.ndarray, v: np.ndarray,
+                  displacement: np.ndarray, angle: np.ndarray):
+        """
+        Add the flow of several pairs stacked along the first axis.
+
+        Parameters
+        ----------
+        u, v, displacement, angle : np.ndarray
+            Flow of the pairs, (pairs, rows, cols), see add().
+
+        Returns
+        -------
+        None
+        """
+        self._flush()
+        self._reduce(u, v, displacement, angle)
+
+    def variance(self, name: str, ddof: int = 1):
+        """Variance of a variable, by default the sample variance."""
+        n = self.n
+        return np.where(n > ddof, self.moments[name].variance(ddof), np.nan)
+
+    def direction(self):
+        """
+        Vector-averaged direction.
+
+        Returns
+        -------
+        angle : np.ndarray
+            Mean direction in radians, from 0 to 2 pi.
+        steadiness : np.ndarray
+            Length of the mean unit vector, from 0 to 1.
+        """
+        n = self.n
+        with np.errstate(divide="ignore", invalid="ignore"):
+            c = np.where(n > 0, self.cos / n, np.nan)
+            s = np.where(n > 0, self.sin / n, np.nan)
+        return np.mod(np.arctan2(s, c), 2 * np.pi), np.hypot(c, s)
+
+    def result(self):
+        """
+        All statistics.
+
+        Returns
+        -------
+        dict
+            Name to (rows, cols) array. Cells without flow are NaN.
+        """
+        n = self.n
+        out = {}
+        for name in self.VARIABLES:
+            out[f"{name}_mean"] = np.where(n > 0, self.moments[name].mean,
+                                           np.nan)
+            out[f"{name}_std"] = np.sqrt(self.variance(name))
+        out["angle"], out["steadiness"] = self.direction()
+        out["count"] = n
+        return out
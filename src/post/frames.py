@@ -0,0 +1,202 @@
+"""
+Decode a series of images in parallel.
+
+# SCRIPT   : frames.py
+# POURPOSE : Decode images with a pool of workers and a bounded prefetch
+#            queue, yielding them in natural order.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import os
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from glob import glob
+from natsort import natsorted
+
+import cv2
+
+
+# colour conversions from OpenCV's BGR order
+COLORS = {"rgb": cv2.COLOR_BGR2RGB,
+          "gray": cv2.COLOR_BGR2GRAY,
+          "bgr": None}
+
+
+def list_images(folder: str, ext: str = ""):
+    """
+    List all files in a folder in natural order.
+
+    Parameters
+    ----------
+    folder : str
+        Input folder with images.
+    ext : str, optional
+        Only list files ending with this extension, by default all files.
+
+    Returns
+    -------
+    list
+        Sorted list of files.
+    """
+    return natsorted(glob(folder + "/*{}".format(ext)))
+
+
+def decode(fname: str, color: str = "rgb"):
+    """
+    Read an image from disk.
+
+    Parameters
+    ----------
+    fname : str
+        Image file name.
+    color : str, optional
+        Output colour space, one of rgb, bgr or gray. By default rgb.
+
+    Returns
+    -------
+    np.ndarray
+        Decoded image.
+    """
+    img = cv2.imread(fname)
+    if img is None:
+        raise IOError(f"Could not read image \"{fname}\"")
+    if COLORS[color] is not None:
+        img = cv2.cvtColor(img, COLORS[color])
+    return img
+
+
+class FrameSource:
+    """
+    Iterate over decoded images using a pool of workers.
+
+    Images are decoded ahead of time by a thread (default) or process pool
+    and are yielded in the same order as the input list. The number of
+    decoded images waiting to be consumed is bounded by ``prefetch_mb``.
+
+    Parameters
+    ----------
+    images : list
+        List of image files, usually from list_images().
+    workers : int, optional
+        Number of decoding workers, by default the number of CPUs.
+    prefetch_mb : float, optional
+        Maximum memory used by decoded images waiting to be consumed, in
+        megabytes. By default 256.
+    color : str, optional
+        Output colour space, one of rgb, bgr or gray. By default rgb.
+    processes : bool, optional
+        Use processes instead of threads, by default False.
+    skip_unreadable : bool, optional
+        Silently skip files that are not images instead of raising an
+        error, by default False.
+    """
+
+    def __init__(self, images: list, workers: int = None,
+                 prefetch_mb: float = 256, color: str = "rgb",
+                 processes: bool = False, skip_unreadable: bool = False):
+
+        if color not in COLORS:
+            raise ValueError(f"Unknown colour space \"{color}\". Use one of "
+                             f"{', '.join(COLORS)}.")
+
+        self.images = list(images)
+        self.workers = max(int(workers or os.cpu_count() or 1), 1)
+        self.prefetch_mb = float(prefetch_mb)
+        self.color = color
+        self.processes = processes
+        self.skip_unreadable = skip_unreadable
+
+    def __len__(self):
+        return len(self.images)
+
+    def _max_pending(self, nbytes: int):
+        """Number of images that fit in the prefetch memory."""
+        return max(int(self.prefetch_mb * 2**20 // max(nbytes, 1)),
+                   self.workers, 1)
+
+    def __iter__(self):
+        """
+        Yield decoded images in order.
+
+        Yields
+        ------
+        fname : str
+            Image file name.
+        img : np.ndarray
+            Decoded image.
+        """
+        if self.processes:
+            pool = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+
+        with pool:
+            queue = deque()
+            files = iter(self.images)
+            max_pending = self.workers  # until we know the image size
+
+            while True:
+
+                # keep the queue full
+                while len(queue) < max_pending:
+                    fname = next(files, None)
+                    if fname is None:
+                        break
+                    queue.append((fname, pool.submit(decode, fname,
+                                                     self.color)))
+                if not queue:
+                    break
+
+                # wait for the oldest image
+                fname, future = queue.popleft()
+                try:
+                    img = future.result()
+                except IOError:
+                    if self.skip_unreadable:
+                        continue
+                    for _, f in queue:
+                        f.cancel()
+                    raise
+                max_pending = self._max_pending(img.nbytes)
+
+                yield fname, img
+
+
+def add_frame_source_arguments(parser):
+    """
+    Add the frame decoding options to an argument parser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        Argument parser.
+
+    Returns
+    -------
+    None
+    """
+    parser.add_argument("--workers",
+                        action="store",
+                        dest="workers",
+                        default=os.cpu_count(),
+                        required=False,
+                        help="Number of workers decoding images. "
+                             "Default is the number of CPUs.")
+
+    parser.add_argument("--prefetch_mb",
+                        action="store",
+                        dest="prefetch_mb",
+                        default=256,
+                        required=False,
+                        help="Maximum memory used by decoded images waiting "
+                             "to be processed, in MB. Default is 256.")
+
+    parser.add_argument("--use_processes",
+                        action="store_true",
+                        dest="use_processes",
+                        help="Decode images in separate processes instead "
+                             "of threads.")
@@ -0,0 +1,906 @@
+"""
+Image geometry shared by the rectification, timestack and flow scripts.
+
+# SCRIPT   : geometry.py
+# POURPOSE : Compute the image geometry (homography, rectified pixel
+#            coordinates, bounding box and timestack indexes) once and cache
+#            it on disk so that it can be memory-mapped by every script.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+
+import cv2
+
+from scipy.spatial import KDTree, Delaunay
+from scipy.interpolate import griddata
+
+import matplotlib.patches as patches
+
+
+# default location of the geometry cache
+GEOMETRY_CACHE = os.path.join(os.path.expanduser("~"), ".cache",
+                              "picoastal", "geometry")
+
+# OpenCV interpolation flags used to rectify images with cv2.remap()
+REMAP_METHODS = {"nearest": cv2.INTER_NEAREST,
+                 "linear": cv2.INTER_LINEAR,
+                 "cubic": cv2.INTER_CUBIC}
+
+
+def read_camera_matrix(fname: str):
+    """
+    Read camera matrix and distortion coefficients.
+
+    Parameters
+    ----------
+    fname : str
+        Camera matrix in JSON or pickle format.
+
+    Returns
+    -------
+    mtx : np.ndarray
+        3x3 camera matrix.
+    dist : np.ndarray
+        Distortion coefficients.
+    """
+    if fname.lower().endswith("json"):
+        with open(fname, 'r') as f:
+            cam = json.load(f)
+            mtx = np.asarray(cam["camera_matrix"])
+            dist = np.asarray(cam["distortion_coefficients"])
+    else:
+        with open(fname, 'rb') as f:
+            cam = pickle.load(f)
+            mtx = cam["camera_matrix"]
+            dist = cam["distortion_coefficients"]
+    return mtx, dist
+
+
+def read_gcps(fname: str):
+    """
+    Read ground control points.
+
+    Parameters
+    ----------
+    fname : str
+        File with x,y,z,u,v data in csv format. The first line is a header.
+
+    Returns
+    -------
+    xyz : np.ndarray
+        Nx3 array of real-world coordinates.
+    uv : np.ndarray
+        Nx2 array of image coordinates.
+    """
+    xyz = []
+    uv = []
+    f = open(fname, "r")
+    for i, line in enumerate(f.readlines()):
+        if i > 0:  # ignore header
+            xyz.append([line.split(",")[0],
+                        line.split(",")[1],
+                        line.split(",")[2]])
+            uv.append([line.split(",")[3],
+                       line.split(",")[4]])
+    f.close()
+    xyz = np.array(xyz).astype(np.float32)
+    uv = np.array(uv).astype(np.float32)
+    return xyz, uv
+
+
+def find_homography(uv: np.ndarray, xyz: np.ndarray, mtx: np.ndarray,
+                    dist_coeffs: np.ndarray = np.zeros((1, 4)), z: float = 0,
+                    compute_error: bool = False):
+    """
+    Find homography based on ground control points.
+
+    Parameters
+    ----------
+    uv : np.ndarray
+        Nx2 array of image coordinates of gcps.
+    xyz : np.ndarray
+        Nx3 array of real-world coordinates of gcps.
+    mtx : np.ndarray
+        3x3 array containing the camera matrix
+    dist_coeffs : np.ndarray
+        1xN array with distortion coefficients with N = 4, 5 or 8
+    z : float
+        Real-world elevation to which the image should be projected.
+    compute_error : bool
+        Will compute re-projection erros in pixels if true.
+
+    Returns
+    -------
+    error: float
+        Rectification error in pixels or nan if compute_error=False.
+    H: np.ndarray
+        3x3 homography matrix.
+    """
+    uv = np.asarray(uv).astype(np.float32)
+    xyz = np.asarray(xyz).astype(np.float32)
+    mtx = np.asarray(mtx).astype(np.float32)
+
+    # compute camera pose
+    retval, rvec, tvec = cv2.solvePnP(xyz, uv, mtx, dist_coeffs)
+
+    # convert rotation vector to rotation matrix
+    R = cv2.Rodrigues(rvec)[0]
+
+    # assume height of projection plane
+    R[:, 2] = R[:, 2] * z
+
+    # add translation vector
+    R[:, 2] = R[:, 2] + tvec.flatten()
+
+    # compute homography
+    H = np.linalg.inv(np.dot(mtx, R))
+
+    # normalize homography
+    H = H / H[-1, -1]
+
+    # compute errors
+    if compute_error:
+        tot_error = 0
+        total_points = 0
+        for i in range(len(xyz)):
+            reprojected_points, _ = cv2.projectPoints(xyz[i],
+                                                      rvec, tvec,
+                                                      mtx,
+                                                      dist_coeffs)
+            tot_error += np.sum(np.abs(uv[i] - reprojected_points)**2)
+            total_points += i
+        mean_error_px = np.sqrt(tot_error / total_points)
+    else:
+        mean_error_px = None
+
+    return mean_error_px, H
+
+
+def rectify_image(img: np.ndarray, mtx: np.ndarray):
+    """
+    Rectify mage coordinates.
+
+    Parameters
+    ----------
+    img : np.ndarray
+        Input image aray.
+    mtx : np.ndarray
+        3x3 array containing the camera matrix
+
+    Returns
+    -------
+    x, y: np.ndarray
+        rectified coordinates
+    """
+
+    # get_pixel_coordinates(img)
+    u, v = np.meshgrid(range(img.shape[1]), range(img.shape[0]))
+    uv = np.vstack((u.flatten(), v.flatten())).T
+
+    # transform image using homography
+    xy = cv2.perspectiveTransform(np.asarray([uv]).astype(np.float32), mtx)[0]
+
+    return xy[:, 0].reshape(u.shape[:2]), xy[:, 1].reshape(v.shape[:2])
+
+
+def undistorted_to_raw(uv: np.ndarray, mtx: np.ndarray, dist: np.ndarray,
+                       shape: tuple):
+    """
+    Map pixel coordinates of the undistorted image to the raw image.
+
+    The undistorted image is the one given by cv2.undistort() with the
+    camera matrix from cv2.getOptimalNewCameraMatrix(alpha=1), as used
+    everywhere else.
+
+    Parameters
+    ----------
+    uv : np.ndarray
+        Nx2 array of undistorted x (column) and y (row) coordinates.
+    mtx : np.ndarray
+        3x3 camera matrix.
+    dist : np.ndarray
+        Distortion coefficients.
+    shape : tuple
+        Image shape (rows, cols).
+
+    Returns
+    -------
+    np.ndarray
+        Nx2 array of raw x (column) and y (row) coordinates.
+    """
+    h, w = shape[:2]
+    mtx = np.asarray(mtx, np.float64)
+    dist = np.asarray(dist, np.float64)
+
+    # same new camera matrix used to undistort the images
+    newcameramtx, _ = cv2.getOptimalNewCameraMatrix(mtx, dist, (w, h), 1,
+                                                    (w, h))
+
+    # undistorted pixel to normalized camera coordinates
+    uv = np.asarray(uv, np.float64).reshape(-1, 2)
+    xyn = cv2.perspectiveTransform(uv[None], np.linalg.inv(newcameramtx))[0]
+
+    # apply distortion and camera matrix
+    xyz = np.hstack([xyn, np.ones((len(xyn), 1))])
+    raw, _ = cv2.projectPoints(xyz, np.zeros(3), np.zeros(3), mtx, dist)
+
+    return raw[:, 0, :]
+
+
+def grid_to_pixel(H: np.ndarray, mtx: np.ndarray, dist: np.ndarray,
+                  shape: tuple, grid_x: np.ndarray, grid_y: np.ndarray):
+    """
+    Map real-world grid coordinates to pixel coordinates of the raw image.
+
+    This is the analytical inverse of the rectification: the grid is
+    projected to the undistorted image with the inverse homography and then
+    distorted back with the camera model, exactly as cv2.undistort does.
+    The result can be used directly with cv2.remap() to rectify raw images
+    without undistorting them first.
+
+    Parameters
+    ----------
+    H : np.ndarray
+        3x3 homography matrix from find_homography().
+    mtx : np.ndarray
+        3x3 camera matrix.
+    dist : np.ndarray
+        Distortion coefficients.
+    shape : tuple
+        Image shape (rows, cols).
+    grid_x, grid_y : np.ndarray
+        Grid coordinates.
+
+    Returns
+    -------
+    np.ndarray
+        2xNxM float32 array with the x (column) and y (row) pixel
+        coordinates of every grid cell.
+    """
+    # world to undistorted pixel coordinates
+    xy = np.vstack([grid_x.flatten(), grid_y.flatten()]).T.astype(np.float64)
+    uv = cv2.perspectiveTransform(xy[None], np.linalg.inv(H))[0]
+
+    # undistorted to raw pixel coordinates
+    raw = undistorted_to_raw(uv, mtx, dist, shape)
+    raw = raw.T.reshape((2, ) + grid_x.shape)
+
+    return raw.astype(np.float32)
+
+
+def bilinear_taps(x: np.ndarray, y: np.ndarray, shape: tuple):
+    """
+    Flat indexes and weights of the four pixels around each point.
+
+    A point is sampled as ``(pixels[idx] * w[..., None]).sum(-2)`` where
+    pixels is the image reshaped to (rows * cols, bands). Taps that fall
+    outside the image get zero weight, like cv2.BORDER_CONSTANT.
+
+    Parameters
+    ----------
+    x, y : np.ndarray
+        Column and row coordinates of the points, any shape.
+    shape : tuple
+        Image shape (rows, cols).
+
+    Returns
+    -------
+    idx : np.ndarray
+        Flat pixel indexes, shape x.shape + (4, ).
+    w : np.ndarray
+        float32 weights, shape x.shape + (4, ).
+    """
+    h, w = shape[:2]
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    fx = x - x0
+    fy = y - y0
+
+    rows = np.stack([y0, y0, y0 + 1, y0 + 1], axis=-1).astype(np.int64)
+    cols = np.stack([x0, x0 + 1, x0, x0 + 1], axis=-1).astype(np.int64)
+    weights = np.stack([(1 - fx) * (1 - fy), fx * (1 - fy),
+                        (1 - fx) * fy, fx * fy], axis=-1)
+
+    inside = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+    idx = np.clip(rows, 0, h - 1) * w + np.clip(cols, 0, w - 1)
+
+    return idx, (weights * inside).astype(np.float32)
+
+
+def parse_bbox(bbox: str):
+    """
+    Parse a bounding box given as 'xmin,ymin,dx,dy'.
+
+    Parameters
+    ----------
+    bbox : str
+        Bounding box string.
+
+    Returns
+    -------
+    np.ndarray
+        Bounding box as an array of floats.
+    """
+    bbox = bbox.split(",")
+    return np.array([float(bbox[0]), float(bbox[1]),
+                     float(bbox[2]), float(bbox[3])])
+
+
+def hash_parameters(*args):
+    """
+    Hash arrays and scalars into a short hexadecimal key.
+
+    Parameters
+    ----------
+    *args
+        Arrays, scalars or None.
+
+    Returns
+    -------
+    str
+        Hexadecimal key.
+    """
+    h = hashlib.sha1()
+    for arg in args:
+        if arg is None:
+            h.update(b"none")
+        else:
+            arr = np.ascontiguousarray(np.asarray(arg, dtype=np.float64))
+            h.update(str(arr.shape).encode())
+            h.update(arr.tobytes())
+        h.update(b"|")
+    return h.hexdigest()[:16]
+
+
+class GeometryBundle:
+    """
+    Cached image geometry.
+
+    The bundle holds the homography, the rectified coordinates of every
+    pixel, the pixels inside the bounding box, the grid axes and any
+    timestack indexes. It is computed once per set of parameters, stored in
+    a folder named after a hash of the parameters, and memory-mapped every
+    time it is loaded again.
+
+    Use GeometryBundle.load() instead of creating instances directly.
+    """
+
+    def __init__(self, path: str, arrays: dict, meta: dict):
+        self.path = path
+        self.arrays = arrays
+        self.meta = meta
+        self.key = meta["key"]
+        self.windows = {}  # operators cropped by to_grid()
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["arrays"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @classmethod
+    def load(cls, mtx: np.ndarray, dist: np.ndarray, xyz: np.ndarray,
+             uv: np.ndarray, z: float, shape: tuple, bbox: np.ndarray = None,
+             dx: float = 1, dy: float = 1, cache: str = GEOMETRY_CACHE):
+        """
+        Load the geometry from the cache or compute it.
+
+        Parameters
+        ----------
+        mtx : np.ndarray
+            3x3 camera matrix.
+        dist : np.ndarray
+            Distortion coefficients.
+        xyz : np.ndarray
+            Nx3 array of real-world coordinates of gcps.
+        uv : np.ndarray
+            Nx2 array of image coordinates of gcps.
+        z : float
+            Projection height.
+        shape : tuple
+            Image shape, only the first two values (rows, cols) are used.
+        bbox : np.ndarray, optional
+            Bounding box as (xmin, ymin, dx, dy), by default no bbox.
+        dx, dy : float, optional
+            Grid resolution in x and y, by default 1.
+        cache : str, optional
+            Cache folder. If empty or None, nothing is read from or written
+            to disk.
+
+        Returns
+        -------
+        GeometryBundle
+            The image geometry.
+        """
+        shape = tuple(int(s) for s in shape[:2])
+        key = hash_parameters(mtx, dist, xyz, uv, z, shape, bbox,
+                              dx if bbox is not None else None,
+                              dy if bbox is not None else None)
+
+        if cache:
+            path = os.path.join(cache, key)
+            if os.path.isfile(os.path.join(path, "meta.json")):
+                return cls._read(path)
+
+        arrays, meta = cls._compute(mtx, dist, xyz, uv, z, shape, bbox,
+                                    dx, dy)
+        meta["key"] = key
+
+        if not cache:
+            return cls(None, arrays, meta)
+        cls._write(path, arrays, meta)
+        return cls._read(path)
+
+    @staticmethod
+    def _compute(mtx, dist, xyz, uv, z, shape, bbox, dx, dy):
+        """Compute all arrays of the bundle."""
+        _, H = find_homography(uv, xyz, mtx, dist_coeffs=dist, z=z)
+        ximg, yimg = rectify_image(np.empty(shape, np.uint8), H)
+
+        # image coordinate points
+        XY = np.vstack([ximg.flatten(), yimg.flatten()]).T
+
+        arrays = {"H": H, "XY": XY}
+        meta = {"shape": list(shape), "projection_height": float(z),
+                "bbox": None, "dx": None, "dy": None}
+
+        if bbox is not None:
+
+            # get points inside bbox
+            rect = patches.Rectangle((bbox[0], bbox[1]), bbox[2], bbox[3],
+                                     linewidth=2, edgecolor='r',
+                                     facecolor='none')
+            insiders = rect.contains_points(XY)
+            arrays["insiders_idx"] = np.arange(0, len(XY), 1)[insiders]
+
+            # grid axes
+            arrays["xlin"] = np.arange(bbox[0], bbox[0] + bbox[2], dx)
+            arrays["ylin"] = np.arange(bbox[1], bbox[1] + bbox[3], dy)
+
+            meta.update(bbox=[float(b) for b in bbox], dx=float(dx),
+                        dy=float(dy))
+
+        return arrays, meta
+
+    @staticmethod
+    def _write(path, arrays, meta):
+        """Write the bundle atomically so that concurrent runs are safe."""
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), arr)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        try:
+            os.rename(tmp, path)
+        except OSError:  # someone else got there first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @classmethod
+    def _read(cls, path):
+        """Memory-map all arrays of a cached bundle."""
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        arrays = {}
+        for fname in os.listdir(path):
+            if fname.endswith(".npy"):
+                arrays[fname[:-4]] = np.load(os.path.join(path, fname),
+                                             mmap_mode="r")
+        return cls(path, arrays, meta)
+
+    def grid(self):
+        """
+        Rectification grid.
+
+        Returns
+        -------
+        grid_x, grid_y : np.ndarray
+            Grid coordinates.
+        """
+        return np.meshgrid(self.xlin, self.ylin)
+
+    def cached(self, name: str, key: str, compute):
+        """
+        Get an extra array from the bundle, computing it if needed.
+
+        Parameters
+        ----------
+        name : str
+            Array name prefix.
+        key : str
+            Hash of the parameters used to compute the array.
+        compute : callable
+            Function with no arguments that computes the array.
+
+        Returns
+        -------
+        np.ndarray
+            The array, memory-mapped if the bundle lives on disk.
+        """
+        fname = f"{name}_{key}"
+        if fname in self.arrays:
+            return self.arrays[fname]
+        arr = compute()
+        if self.path is not None:
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".npy")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, os.path.join(self.path, fname + ".npy"))
+            arr = np.load(os.path.join(self.path, fname + ".npy"),
+                          mmap_mode="r")
+        self.arrays[fname] = arr
+        return arr
+
+    def remap_tables(self, mtx: np.ndarray, dist: np.ndarray):
+        """
+        Lookup tables to rectify raw images with cv2.remap().
+
+        Parameters
+        ----------
+        mtx : np.ndarray
+            3x3 camera matrix.
+        dist : np.ndarray
+            Distortion coefficients.
+
+        Returns
+        -------
+        map_x, map_y : np.ndarray
+            Raw image column and row of every grid cell.
+        """
+        key = hash_parameters(mtx, dist)
+
+        def compute():
+            grid_x, grid_y = self.grid()
+            return grid_to_pixel(self.H, mtx, dist, self.meta["shape"],
+                                 grid_x, grid_y)
+
+        maps = self.cached("remap", key, compute)
+        return maps[0], maps[1]
+
+    def remap(self, img: np.ndarray, mtx: np.ndarray, dist: np.ndarray,
+              method: str = "nearest"):
+        """
+        Rectify a raw image onto the grid.
+
+        Parameters
+        ----------
+        img : np.ndarray
+            Raw (distorted) image.
+        mtx : np.ndarray
+            3x3 camera matrix.
+        dist : np.ndarray
+            Distortion coefficients.
+        method : str, optional
+            Interpolation method, nearest, linear or cubic. By default
+            nearest.
+
+        Returns
+        -------
+        np.ndarray
+            Rectified image. Cells that do not see the image are set to 0.
+        """
+        if method not in REMAP_METHODS:
+            raise ValueError("Wrong interpolation method. Use "
+                             f"{', '.join(REMAP_METHODS)}.")
+        map_x, map_y = self.remap_tables(mtx, dist)
+        return cv2.remap(img, np.asarray(map_x), np.asarray(map_y),
+                         REMAP_METHODS[method],
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+    def griddata(self, img: np.ndarray, mtx: np.ndarray, dist: np.ndarray,
+                 method: str = "nearest"):
+        """
+        Rectify a raw image by triangulating the undistorted pixels.
+
+        This is the original rectification. It is much slower than remap()
+        and is only kept as a reference.
+
+        Parameters
+        ----------
+        img : np.ndarray
+            Raw (distorted) RGB image.
+        mtx : np.ndarray
+            3x3 camera matrix.
+        dist : np.ndarray
+            Distortion coefficients.
+        method : str, optional
+            Interpolation method, nearest or linear. By default nearest.
+
+        Returns
+        -------
+        np.ndarray
+            Rectified image. Cells outside the image are extrapolated with
+            nearest and set to NaN with linear.
+        """
+        # undistort
+        h,  w = img.shape[:2]
+        newcameramtx, roi = cv2.getOptimalNewCameraMatrix(
+            mtx, dist, (w, h), 1, (w, h))
+
+        # undistort image
+        dst = cv2.undistort(img, mtx, dist, None, newcameramtx)
+
+        # interpolate
+        points = self.XY[self.insiders_idx, :]
+        grid_x, grid_y = self.grid()
+        values = dst.reshape(-1, 3)[self.insiders_idx]
+        return griddata(points,
+                        values,
+                        (grid_x, grid_y),
+                        method=method).clip(0, 255)
+
+    def stack_indexes(self, stack_points: np.ndarray, neighbours: int = 1):
+        """
+        Pixel indexes of the nearest neighbours of the timestack points.
+
+        Parameters
+        ----------
+        stack_points : np.ndarray
+            Nx2 array of real-world coordinates of the timestack points.
+        neighbours : int, optional
+            Number of nearest pixels per point, by default 1.
+
+        Returns
+        -------
+        istk, jstk : np.ndarray
+            Row and column indexes of the pixels.
+        """
+        key = hash_parameters(stack_points, neighbours)
+
+        def compute():
+            # search for nearest points to the timestack line
+            _, stack_indexes = KDTree(self.XY).query(stack_points,
+                                                     neighbours)
+            return np.asarray(stack_indexes)
+
+        stack_indexes = self.cached("stack", key, compute)
+        return np.unravel_index(stack_indexes, tuple(self.meta["shape"]))
+
+    def stack_taps(self, stack_points: np.ndarray, mtx: np.ndarray,
+                   dist: np.ndarray, neighbours: int = 1):
+        """
+        Bilinear taps to sample the timestack pixels from raw images.
+
+        The timestack pixels are found in the undistorted image (see
+        stack_indexes()) and mapped back to the raw image once, so frames
+        do not need to be undistorted.
+
+        Parameters
+        ----------
+        stack_points : np.ndarray
+            Nx2 array of real-world coordinates of the timestack points.
+        mtx : np.ndarray
+            3x3 camera matrix.
+        dist : np.ndarray
+            Distortion coefficients.
+        neighbours : int, optional
+            Number of nearest pixels per point, by default 1.
+
+        Returns
+        -------
+        idx, w : np.ndarray
+            Flat indexes and weights, see bilinear_taps().
+        """
+        key = hash_parameters(stack_points, mtx, dist, neighbours)
+        shape = tuple(self.meta["shape"])
+        taps = {}
+
+        def compute_taps():
+            if not taps:
+                istk, jstk = self.stack_indexes(stack_points, neighbours)
+                uv = np.vstack([np.ravel(jstk), np.ravel(istk)]).T
+                raw = undistorted_to_raw(uv, mtx, dist, shape)
+                idx, w = bilinear_taps(raw[:, 0].reshape(istk.shape),
+                                       raw[:, 1].reshape(istk.shape), shape)
+                taps.update(idx=idx, w=w)
+            return taps
+
+        idx = self.cached("stack_idx", key, lambda: compute_taps()["idx"])
+        w = self.cached("stack_w", key, lambda: compute_taps()["w"])
+        return idx, w
+
+    def grid_operator(self, method: str = "linear"):
+        """
+        Sparse operator from the undistorted image to the grid.
+
+        Every grid cell is a weighted sum of a few pixels of the undistorted
+        image. With linear, these are the vertices of the Delaunay triangle
+        of rectified pixels (inside the bounding box) that contains the cell
+        and the weights are its barycentric coordinates, as in scipy's
+        LinearNDInterpolator. With nearest, it is the closest rectified
+        pixel, as in NearestNDInterpolator. The triangulation is done only
+        once and the operator is cached.
+
+        Parameters
+        ----------
+        method : str, optional
+            Interpolation method, linear or nearest. By default linear.
+
+        Returns
+        -------
+        idx : np.ndarray
+            Flat pixel indexes, shape (cells, 3) or (cells, 1).
+        w : np.ndarray
+            Weights, same shape as idx. Cells outside the convex hull of
+            the pixels have NaN weights.
+        """
+        if method not in ["linear", "nearest"]:
+            raise ValueError("Wrong interpolation method. Use linear or "
+                             "nearest.")
+        key = hash_parameters(method == "linear")
+        operator = {}
+
+        def compute_operator():
+            if operator:
+                return operator
+            grid_x, grid_y = self.grid()
+            cells = np.vstack([grid_x.flatten(), grid_y.flatten()]).T
+            points = self.XY[self.insiders_idx]
+
+            if method == "nearest":
+                _, nearest = KDTree(points).query(cells)
+                idx = np.asarray(self.insiders_idx)[nearest][:, None]
+                w = np.ones(idx.shape)
+            else:
+                tri = Delaunay(points)
+                simplex = tri.find_simplex(cells)
+                outside = simplex == -1
+                simplex[outside] = 0
+
+                # barycentric coordinates
+                T = tri.transform[simplex]
+                b = np.einsum("ijk,ik->ij", T[:, :2], cells - T[:, 2])
+                w = np.hstack([b, 1 - b.sum(axis=1, keepdims=True)])
+                w[outside] = np.nan
+
+                idx = np.asarray(self.insiders_idx)[tri.simplices[simplex]]
+
+            operator.update(idx=idx, w=w)
+            return operator
+
+        name = f"grid_{method}"
+        idx = self.cached(f"{name}_idx", key,
+                          lambda: compute_operator()["idx"])
+        w = self.cached(f"{name}_w", key, lambda: compute_operator()["w"])
+        return idx, w
+
+    def raw_grid_operator(self, mtx: np.ndarray, dist: np.ndarray,
+                          method: str = "linear"):
+        """
+        Sparse operator from the raw image to the grid.
+
+        Each pixel of the undistorted image used by grid_operator() is
+        mapped back to the raw image and replaced by its four bilinear taps,
+        as cv2.undistort() would interpolate it. Frames can then be put on
+        the grid without undistorting them first.
+
+        Parameters
+        ----------
+        mtx : np.ndarray
+            3x3 camera matrix.
+        dist : np.ndarray
+            Distortion coefficients.
+        method : str, optional
+            Interpolation method, linear or nearest. By default linear.
+
+        Returns
+        -------
+        idx : np.ndarray
+            Flat raw pixel indexes, shape (cells, 12) or (cells, 4).
+        w : np.ndarray
+            Weights, same shape as idx, see grid_operator().
+        """
+        key = hash_parameters(mtx, dist, method == "linear")
+        shape = tuple(self.meta["shape"])
+        operator = {}
+
+        def compute_operator():
+            if operator:
+                return operator
+            idx, w = self.grid_operator(method)
+            rows, cols = np.unravel_index(np.asarray(idx), shape[:2])
+            uv = np.vstack([cols.ravel(), rows.ravel()]).T
+            raw = undistorted_to_raw(uv, mtx, dist, shape)
+            taps, tw = bilinear_taps(raw[:, 0].reshape(idx.shape),
+                                     raw[:, 1].reshape(idx.shape), shape)
+            operator.update(idx=taps.reshape(len(idx), -1),
+                            w=(np.asarray(w)[..., None] * tw).reshape(
+                                len(idx), -1))
+            return operator
+
+        name = f"raw_grid_{method}"
+        idx = self.cached(f"{name}_idx", key,
+                          lambda: compute_operator()["idx"])
+        w = self.cached(f"{name}_w", key, lambda: compute_operator()["w"])
+        return idx, w
+
+    def to_grid(self, img: np.ndarray, method: str = "linear",
+                mtx: np.ndarray = None, dist: np.ndarray = None,
+                window: tuple = None):
+        """
+        Interpolate a single-band image onto the grid.
+
+        Parameters
+        ----------
+        img : np.ndarray
+            Undistorted image, (rows, cols), or raw image if mtx and dist
+            are given.
+        method : str, optional
+            Interpolation method, linear or nearest. By default linear.
+        mtx : np.ndarray, optional
+            3x3 camera matrix of a raw image.
+        dist : np.ndarray, optional
+            Distortion coefficients of a raw image.
+        window : tuple, optional
+            Only interpolate the grid cells in rows r0:r1 and columns c0:c1,
+            given as (r0, r1, c0, c1). By default the whole grid.
+
+        Returns
+        -------
+        np.ndarray
+            Image on the grid (or window). nearest on an undistorted image
+            keeps the image type, otherwise float64 with NaN outside the
+            convex hull of the pixels.
+        """
+        shape = (len(self.ylin), len(self.xlin))
+        pixels = img.ravel()
+        if mtx is not None:
+            idx, w = self.raw_grid_operator(mtx, dist, method)
+        else:
+            idx, w = self.grid_operator(method)
+
+        # the cropped operator is computed once per window
+        if window is not None:
+            key = (method, None if mtx is None else
+                   hash_parameters(mtx, dist), tuple(window))
+            if key not in self.windows:
+                r0, r1, c0, c1 = window
+                k = idx.shape[1]
+                self.windows[key] = tuple(
+                    np.ascontiguousarray(np.asarray(a).reshape(
+                        shape + (k, ))[r0:r1, c0:c1].reshape(-1, k))
+                    for a in (idx, w))
+            idx, w = self.windows[key]
+            shape = (window[1] - window[0], window[3] - window[2])
+
+        if mtx is None and method == "nearest":
+            return pixels[idx[:, 0]].reshape(shape)
+        return (pixels[idx] * w).sum(axis=1).reshape(shape)
+
+
+def add_geometry_arguments(parser):
+    """
+    Add the geometry cache options to an argument parser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        Argument parser.
+
+    Returns
+    -------
+    None
+    """
+    parser.add_argument("--geometry_cache",
+                        action="store",
+                        dest="geometry_cache",
+                        default=GEOMETRY_CACHE,
+                        required=False,
+                        help="Folder where the image geometry is cached. "
+                             "Default is ~/.cache/picoastal/geometry.")
+
+    parser.add_argument("--no_geometry_cache",
+                        action="store_true",
+                        dest="no_geometry_cache",
+                        help="Do not read or write the geometry cache.")
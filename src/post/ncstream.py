@@ -0,0 +1,447 @@
+"""
+Write large NetCDF files one time step at a time.
+
+# SCRIPT   : ncstream.py
+# POURPOSE : Stream time steps to a chunked and compressed NetCDF file
+#            through a bounded buffer.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+import netCDF4
+
+
+# same time encoding as the other NetCDF outputs
+TIME_UNITS = "days since 2000-01-01 00:00:00"
+CALENDAR = "gregorian"
+
+
+class NetCDFStream:
+    """
+    Append time steps to a NetCDF file with an unlimited time dimension.
+
+    Time steps are copied to a buffer of ``buffer_size`` steps and written
+    to disk when the buffer is full, so the memory used does not depend on
+    the number of time steps. The buffer size is also the chunk size along
+    the time dimension.
+
+    In append mode an existing file is opened and new time steps are added
+    after the last one. Variables, coordinates, chunks and time units are
+    then taken from the file. Time steps already in the file are never
+    overwritten.
+
+    Parameters
+    ----------
+    fname : str
+        Output file name.
+    variables : dict
+        Variable name to a dict with the keys dims (tuple of dimension
+        names, starting with "time"), dtype and, optionally, attrs,
+        fill_value, scale_factor, add_offset and chunks (chunk sizes of the
+        dimensions after time).
+    coords : dict, optional
+        Coordinate name to values or to a (values, attrs) tuple. Each
+        coordinate creates a dimension with the same name and size.
+    statics : dict, optional
+        Name to a (dims, values) or (dims, values, attrs) tuple for
+        variables that do not depend on time.
+    attrs : dict, optional
+        Global attributes.
+    buffer_size : int, optional
+        Number of time steps buffered before writing, by default 32.
+    complevel : int, optional
+        Compression level from 0 (none) to 9, by default 4.
+    units : str, optional
+        Time units, by default TIME_UNITS.
+    calendar : str, optional
+        Time calendar, by default CALENDAR.
+    mode : str, optional
+        "w" to create a new file or "a" to append to an existing file (it
+        is created if it does not exist). By default "w".
+    start : int, optional
+        Number of time steps the caller expects in the file in append mode.
+        An error is raised if the file has a different number of steps. By
+        default, this is not checked.
+    """
+
+    def __init__(self, fname: str, variables: dict, coords: dict = None,
+                 statics: dict = None, attrs: dict = None,
+                 buffer_size: int = 32, complevel: int = 4,
+                 units: str = TIME_UNITS,
+                 calendar: str = CALENDAR, mode: str = "w",
+                 start: int = None):
+
+        self.fname = fname
+        self.times = []
+
+        if mode == "a" and os.path.isfile(fname):
+            self._open(fname, variables, start)
+        elif mode == "a" and start:
+            raise ValueError(f"\"{fname}\" does not exist but {start} time "
+                             "steps were expected, cannot append to it.")
+        elif mode in ["w", "a"]:
+            self._create(fname, variables, coords, statics, attrs,
+                         buffer_size, complevel, units, calendar)
+        else:
+            raise ValueError(f"Unknown mode \"{mode}\". Use w or a.")
+
+    def _create(self, fname, variables, coords, statics, attrs, buffer_size,
+                complevel, units, calendar):
+        """Create a new file."""
+        self.buffer_size = max(int(buffer_size), 1)
+        self.units = units
+        self.calendar = calendar
+
+        self.ds = netCDF4.Dataset(fname, "w")
+        if attrs:
+            self.ds.setncatts(attrs)
+
+        # time is the only unlimited dimension
+        self.ds.createDimension("time", None)
+        time = self.ds.createVariable("time", "f8", ("time", ))
+        time.setncatts({"units": units, "calendar": calendar,
+                        "standard_name": "time"})
+
+        # coordinates
+        for name, values in (coords or {}).items():
+            values, cattrs = values if isinstance(values, tuple) else \
+                (values, {})
+            values = np.asarray(values)
+            self.ds.createDimension(name, len(values))
+            dtype = str if values.dtype.kind in "US" else values.dtype
+            var = self.ds.createVariable(name, dtype, (name, ))
+            var[:] = values.astype(object) if dtype is str else values
+            if cattrs:
+                var.setncatts(cattrs)
+
+        # variables that do not depend on time
+        for name, (dims, values, *sattrs) in (statics or {}).items():
+            values = np.asarray(values)
+            var = self.ds.createVariable(name, values.dtype, dims)
+            var[:] = values
+            if sattrs:
+                var.setncatts(sattrs[0])
+
+        # data variables and their buffers
+        self.buffers = {}
+        for name, spec in variables.items():
+            dims = tuple(spec["dims"])
+            if dims[0] != "time":
+                raise ValueError(f"The first dimension of \"{name}\" must be "
+                                 "time.")
+            shape = tuple(len(self.ds.dimensions[d]) for d in dims[1:])
+            chunks = spec.get("chunks") or shape
+            var = self.ds.createVariable(
+                name, spec["dtype"], dims, zlib=complevel > 0,
+                complevel=complevel, shuffle=True,
+                chunksizes=(self.buffer_size, ) + tuple(chunks),
+                fill_value=spec.get("fill_value", False))
+            for key in ["scale_factor", "add_offset"]:
+                if key in spec:
+                    var.setncattr(key, spec[key])
+            if spec.get("attrs"):
+                var.setncatts(spec["attrs"])
+
+            # values are packed by us, not by netCDF4
+            var.set_auto_maskandscale(False)
+
+            self.buffers[name] = np.empty((self.buffer_size, ) + shape,
+                                          dtype=var.dtype)
+
+        self.written = 0
+
+    def _open(self, fname, variables, start):
+        """Open an existing file to append to it."""
+        self.ds = netCDF4.Dataset(fname, "a")
+        self.units = self.ds["time"].units
+        self.calendar = self.ds["time"].calendar
+
+        self.buffers = {}
+        for name, spec in variables.items():
+            if name not in self.ds.variables or \
+                    self.ds[name].dimensions != tuple(spec["dims"]):
+                self.ds.close()
+                raise ValueError(f"Variable \"{name}\" of \"{fname}\" does "
+                                 "not match, cannot append to it.")
+            var = self.ds[name]
+            var.set_auto_maskandscale(False)
+            self.buffer_size = var.chunking()[0]
+            self.buffers[name] = np.empty(
+                (self.buffer_size, ) + var.shape[1:], dtype=var.dtype)
+
+        n = len(self.ds.dimensions["time"])
+        if start is not None and int(start) != n:
+            self.ds.close()
+            raise ValueError(f"\"{fname}\" has {n} time steps but {start} "
+                             "were expected, cannot append to it.")
+        self.written = n
+
+    def __len__(self):
+        return self.written + len(self.times)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, time, **values):
+        """
+        Add one time step.
+
+        Parameters
+        ----------
+        time : datetime.datetime
+            Time of this step.
+        **values : np.ndarray
+            Variable name to data for this step, without the time dimension.
+            Data are cast to the variable type, so packed variables must be
+            packed before calling this.
+
+        Returns
+        -------
+        None
+        """
+        k = len(self.times)
+        for name, buf in self.buffers.items():
+            buf[k] = values[name]
+        self.times.append(time)
+
+        if len(self.times) == self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered time steps to disk.
+
+        Returns
+        -------
+        None
+        """
+        k = len(self.times)
+        if k == 0:
+            return
+        n = self.written
+        for name, buf in self.buffers.items():
+            self.ds[name][n:n + k] = buf[:k]
+        self.ds["time"][n:n + k] = netCDF4.date2num(
+            self.times, self.units, self.calendar)
+        self.ds.sync()
+
+        self.written += k
+        self.times = []
+
+    def close(self):
+        """
+        Write any buffered time steps and close the file.
+
+        Returns
+        -------
+        None
+        """
+        if self.ds.isopen():
+            self.flush()
+            self.ds.close()
+
+
+def truncate(fname: str, steps: int):
+    """
+    Keep only the first time steps of a NetCDF file.
+
+    NetCDF cannot shrink a dimension, so the file is copied with the same
+    variables, attributes, chunks and compression and then replaced
+    atomically. Time-dependent variables are copied one chunk at a time.
+
+    Parameters
+    ----------
+    fname : str
+        File name.
+    steps : int
+        Number of time steps to keep.
+
+    Returns
+    -------
+    None
+    """
+    folder = os.path.dirname(os.path.abspath(fname))
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=".nc")
+    os.close(fd)
+    try:
+        with netCDF4.Dataset(fname) as src, \
+                netCDF4.Dataset(tmp, "w", format=src.data_model) as dst:
+            dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+            for name, dim in src.dimensions.items():
+                dst.createDimension(name, None if dim.isunlimited()
+                                    else len(dim))
+            for name, var in src.variables.items():
+                var.set_auto_maskandscale(False)
+                filters = var.filters() or {}
+                chunks = var.chunking()
+                attrs = {k: var.getncattr(k) for k in var.ncattrs()}
+                out = dst.createVariable(
+                    name, var.datatype, var.dimensions,
+                    zlib=bool(filters.get("zlib")),
+                    complevel=filters.get("complevel", 4),
+                    shuffle=bool(filters.get("shuffle")),
+                    chunksizes=None if chunks == "contiguous" else chunks,
+                    fill_value=attrs.pop("_FillValue", False))
+                out.setncatts(attrs)
+                out.set_auto_maskandscale(False)
+                if var.dimensions[:1] != ("time", ):
+                    out[:] = var[:]
+                    continue
+                step = steps if chunks == "contiguous" else chunks[0]
+                for i in range(0, steps, max(step, 1)):
+                    out[i:min(i + step, steps)] = var[i:min(i + step, steps)]
+        os.replace(tmp, fname)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class Manifest:
+    """
+    Record of the inputs already written to an appendable NetCDF file.
+
+    The manifest lives next to the file as ``<fname>.manifest.json`` and
+    holds the parameters used to create the file and one entry per input
+    (e.g. one capture cycle) with the number of time steps it added. It is
+    saved before the file is created and again after the data of each
+    input are on disk, so re-running a finished job never duplicates time
+    steps and the steps of an interrupted one can be dropped, see
+    recover().
+
+    Parameters
+    ----------
+    fname : str
+        NetCDF file name.
+    """
+
+    def __init__(self, fname: str):
+        self.data = fname
+        self.fname = fname + ".manifest.json"
+        self.params = None
+        self.entries = []
+        if os.path.isfile(self.fname):
+            with open(self.fname, "r") as f:
+                manifest = json.load(f)
+            self.params = manifest["params"]
+            self.entries = manifest["entries"]
+
+    def __contains__(self, key):
+        return any(entry["key"] == key for entry in self.entries)
+
+    def __len__(self):
+        """Number of time steps written by all entries."""
+        return sum(entry["steps"] for entry in self.entries)
+
+    @staticmethod
+    def key(*args):
+        """
+        Hash strings into a short hexadecimal key.
+
+        Parameters
+        ----------
+        *args
+            Strings, e.g. the input file names.
+
+        Returns
+        -------
+        str
+            Hexadecimal key.
+        """
+        h = hashlib.sha1()
+        for arg in args:
+            h.update(str(arg).encode())
+            h.update(b"|")
+        return h.hexdigest()[:16]
+
+    def check(self, params: dict):
+        """
+        Make sure the file is always extended with the same parameters.
+
+        Parameters
+        ----------
+        params : dict
+            JSON serializable parameters.
+
+        Returns
+        -------
+        None
+        """
+        params = json.loads(json.dumps(params))
+        if self.params is None:
+            self.params = params
+        elif self.params != params:
+            changed = [k for k in set(params) | set(self.params)
+                       if params.get(k) != self.params.get(k)]
+            raise ValueError(f"\"{self.fname}\" was created with different "
+                             f"parameters ({', '.join(sorted(changed))}).")
+
+    def add(self, key: str, steps: int, **info):
+        """
+        Add an entry and save the manifest.
+
+        Parameters
+        ----------
+        key : str
+            Input key, see Manifest.key().
+        steps : int
+            Number of time steps written.
+        **info
+            Other JSON serializable information.
+
+        Returns
+        -------
+        None
+        """
+        self.entries.append(dict(key=key, steps=int(steps), **info))
+        self.save()
+
+    def save(self):
+        """
+        Write the manifest to disk.
+
+        Returns
+        -------
+        None
+        """
+        # write atomically
+        folder = os.path.dirname(os.path.abspath(self.fname))
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"params": self.params, "entries": self.entries}, f,
+                      indent=2)
+        os.replace(tmp, self.fname)
+
+    def recover(self):
+        """
+        Drop the time steps that are not listed in the manifest.
+
+        These are left in the file by an append that was interrupted
+        before its entry was saved, e.g. by a power cut.
+
+        Returns
+        -------
+        int
+            Number of time steps dropped.
+        """
+        steps = 0
+        if os.path.isfile(self.data):
+            with netCDF4.Dataset(self.data) as ds:
+                steps = len(ds.dimensions["time"])
+        if steps < len(self):
+            raise ValueError(f"\"{self.data}\" has {steps} time steps but "
+                             f"its manifest lists {len(self)}, it was "
+                             "modified or replaced.")
+        if steps > len(self):
+            truncate(self.data, len(self))
+        return steps - len(self)
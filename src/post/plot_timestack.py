@@ -14,6 +14,8 @@ import argparse
 
 import numpy as np
 
+import xarray as xr
+
 import matplotlib.pyplot as plt
 
 
@@ -57,7 +59,7 @@ if __name__ == '__main__':
                         action="store",
                         dest="input",
                         required=True,
-                        help="Input timestack in pickle format.",)
+                        help="Input timestack in netCDF or pickle format.",)
 
     parser.add_argument("--output", "-o",
                         action="store",
@@ -65,17 +67,60 @@ if __name__ == '__main__':
                         required=True,
                         help="Output figure name.",)
 
-    args = parser.parse_args()
+    parser.add_argument("--transect", "-t",
+                        action="store",
+                        dest="transect",
+                        default=None,
+                        required=False,
+                        help="Transect name to plot when the timestack has "
+                             "several transects. Default is the first one.",)
 
-    # read
-    with open(args.input, 'rb') as f:
-        inp = pickle.load(f)
+    parser.add_argument("--max_times",
+                        action="store",
+                        dest="max_times",
+                        default=2000,
+                        required=False,
+                        help="Maximum number of time steps to plot. Longer "
+                             "netCDF timestacks are decimated when read. "
+                             "Default is 2000.",)
+
+    args = parser.parse_args()
 
-    # extrat the needed variables
-    rgb = inp["rgb"]
-    stack_length = inp["length"]
-    stack_time = inp["time"]
-    stack_points = inp["points"]
+    if args.input.lower().endswith(".pkl"):
+        # read
+        with open(args.input, 'rb') as f:
+            inp = pickle.load(f)
+
+        # pick one transect
+        if "transects" in inp:
+            k = 0
+            if args.transect is not None:
+                k = inp["transects"].index(args.transect)
+            inp["rgb"] = inp["rgb"][k]
+            inp["length"] = inp["length"][k]
+
+        # extrat the needed variables
+        rgb = inp["rgb"]
+        stack_length = inp["length"]
+        stack_time = inp["time"]
+        stack_points = inp["points"]
+
+    else:
+        # lazy, only the decimated time steps are read from disk
+        ds = xr.open_dataset(args.input)
+        k = 0
+        if args.transect is not None:
+            k = list(ds["transect"].values).index(args.transect)
+        step = max(int(np.ceil(ds.sizes["time"] / int(args.max_times))), 1)
+        stack = ds["rgb"].isel(transect=k, time=slice(None, None, step))
+
+        rgb = np.swapaxes(stack.values, 0, 1)
+        if rgb.dtype != np.uint8:  # deviation or variance of neighbours
+            rgb = rgb / max(rgb.max(), 1e-12)
+        stack_length = float(ds["length"][k])
+        stack_time = stack["time"].values
+        stack_points = ds.sizes["point"]
+        ds.close()
 
     distance = np.linspace(0, stack_length, stack_points)
 
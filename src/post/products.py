@@ -0,0 +1,263 @@
+"""
+Compute all statistical images of a series of images in a single pass.
+
+# SCRIPT   : products.py
+# POURPOSE : Compute the average, variance, brightest and darkest images
+#            reading each frame only once.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+import os
+import argparse
+
+from skimage.io import imsave
+
+from tqdm import tqdm
+
+from frames import FrameSource, list_images, add_frame_source_arguments
+from reducers import (MeanReducer, VarianceReducer, BrightnessReducer,
+                      REDUCERS)
+
+
+def reduce_images(frames: FrameSource, reducers: list,
+                  progress: bool = True):
+    """
+    Feed every decoded image to all reducers.
+
+    Parameters
+    ----------
+    frames : FrameSource
+        Decoded images.
+    reducers : list
+        List of reducers to update.
+    progress : bool, optional
+        Show a progress bar, by default True.
+
+    Returns
+    -------
+    dict
+        Product name to uint8 image for all reducers.
+    """
+    pbar = tqdm(total=len(frames), disable=not progress)
+    for _, img in frames:
+
+        for reducer in reducers:
+            reducer.update(img)
+
+        pbar.update()
+    pbar.close()
+
+    products = {}
+    for reducer in reducers:
+        products.update(reducer.result())
+    return products
+
+
+def compute_products(folder: str, outputs: dict, workers: int = None,
+                     prefetch_mb: float = 256, processes: bool = False,
+                     precision: str = "float64", block_size: int = 16,
+                     metric: str = "v", stride: int = 1, keep: int = 1,
+                     progress: bool = True):
+    """
+    Compute the requested products and save them to disk.
+
+    Parameters
+    ----------
+    folder : str
+        Input folder with images.
+    outputs : dict
+        Product name (average, variance, brightest or darkest) to output
+        file name. Products mapped to None are not computed.
+    workers : int, optional
+        Number of workers decoding images, by default the number of CPUs.
+    prefetch_mb : float, optional
+        Memory cap for decoded images waiting to be reduced, by default 256.
+    processes : bool, optional
+        Decode images in separate processes, by default False.
+    precision : str, optional
+        Precision of the average and variance, float32 or float64. By
+        default float64.
+    block_size : int, optional
+        Number of frames summed at once for the average, by default 16.
+    metric : str, optional
+        Brightness metric, v or luma. By default v.
+    stride : int, optional
+        Pixel stride used to score the brightness, by default 1.
+    keep : int, optional
+        Number of brightest and darkest images to save, by default 1. The
+        extra images get the rank appended to their name.
+    progress : bool, optional
+        Show a progress bar, by default True.
+
+    Returns
+    -------
+    None
+        Will write to file instead.
+    """
+    outputs = {k: v for k, v in outputs.items() if v}
+    for name in outputs:
+        if name not in REDUCERS:
+            raise ValueError(f"Unknown product \"{name}\". Use one of "
+                             f"{', '.join(REDUCERS)}.")
+
+    # one reducer per class, e.g. brightest and darkest share a reducer
+    classes = []
+    for name in outputs:
+        if REDUCERS[name] not in classes:
+            classes.append(REDUCERS[name])
+    options = {MeanReducer: dict(block_size=block_size, dtype=precision),
+               VarianceReducer: dict(dtype=precision),
+               BrightnessReducer: dict(metric=metric, stride=stride,
+                                       keep=keep)}
+    reducers = [cls(**options.get(cls, {})) for cls in classes]
+
+    # ignore files that are not images
+    frames = FrameSource(list_images(folder), workers=workers,
+                         prefetch_mb=prefetch_mb, processes=processes,
+                         skip_unreadable=True)
+    products = reduce_images(frames, reducers, progress)
+
+    # save the outputs
+    for name, fname in outputs.items():
+        imsave(fname, products[name])
+
+        # extra brightest and darkest images, e.g. brightest_2.png
+        root, ext = os.path.splitext(fname)
+        rank = 2
+        while f"{name}_{rank}" in products:
+            imsave(f"{root}_{rank}{ext}", products[f"{name}_{rank}"])
+            rank += 1
+
+
+def add_average_arguments(parser):
+    """
+    Add the averaging options to an argument parser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        Argument parser.
+
+    Returns
+    -------
+    None
+    """
+    parser.add_argument("--precision",
+                        action="store",
+                        dest="precision",
+                        default="float64",
+                        choices=["float32", "float64"],
+                        required=False,
+                        help="Precision of the average and variance. "
+                             "Default is float64.")
+
+    parser.add_argument("--block_size",
+                        action="store",
+                        dest="block_size",
+                        default=16,
+                        required=False,
+                        help="Number of frames summed at once to compute the "
+                             "average. Default is 16.")
+
+
+def add_brightness_arguments(parser):
+    """
+    Add the brightness options to an argument parser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        Argument parser.
+
+    Returns
+    -------
+    None
+    """
+    parser.add_argument("--metric",
+                        action="store",
+                        dest="metric",
+                        default="v",
+                        choices=["v", "luma"],
+                        required=False,
+                        help="Brightness metric. v is the V channel of the "
+                             "HSV colour space and luma is Rec. 601 luma. "
+                             "Default is v.")
+
+    parser.add_argument("--stride",
+                        action="store",
+                        dest="stride",
+                        default=1,
+                        required=False,
+                        help="Only use every n-th row and column to compute "
+                             "the brightness. Default is 1 (all pixels).")
+
+    parser.add_argument("--keep", "-k",
+                        action="store",
+                        dest="keep",
+                        default=1,
+                        required=False,
+                        help="Number of brightest and darkest images to save. "
+                             "Default is 1.")
+
+
+if __name__ == "__main__":
+
+    print("\nComputing statistical images, please wait...\n")
+
+    # Argument parser
+    parser = argparse.ArgumentParser()
+
+    # input file
+    parser.add_argument("--input", "-i",
+                        action="store",
+                        dest="input",
+                        required=True,
+                        help="Input folder with images file.",)
+
+    parser.add_argument("--average", "-a",
+                        action="store",
+                        dest="average",
+                        default=None,
+                        required=False,
+                        help="Output average image name.",)
+
+    parser.add_argument("--variance", "-v",
+                        action="store",
+                        dest="variance",
+                        default=None,
+                        required=False,
+                        help="Output variance image name.",)
+
+    parser.add_argument("--brightest", "-b",
+                        action="store",
+                        dest="brightest",
+                        default=None,
+                        required=False,
+                        help="Output name for brightest image.",)
+
+    parser.add_argument("--darkest", "-d",
+                        action="store",
+                        dest="darkest",
+                        default=None,
+                        required=False,
+                        help="Output name for darkest image.",)
+
+    add_average_arguments(parser)
+    add_brightness_arguments(parser)
+    add_frame_source_arguments(parser)
+
+    args = parser.parse_args()
+
+    compute_products(args.input, {"average": args.average,
+                                  "variance": args.variance,
+                                  "brightest": args.brightest,
+                                  "darkest": args.darkest},
+                     workers=int(args.workers),
+                     prefetch_mb=float(args.prefetch_mb),
+                     processes=args.use_processes,
+                     precision=args.precision,
+                     block_size=int(args.block_size),
+                     metric=args.metric,
+                     stride=int(args.stride),
+                     keep=int(args.keep))
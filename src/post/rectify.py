@@ -12,18 +12,15 @@ import os
 import sys
 
 # arguments
-import json
 import argparse
 
-import numpy as np
+from glob import glob
+from natsort import natsorted
 
-import pickle
+import numpy as np
 
 import cv2
 
-from scipy.interpolate import griddata
-
-import matplotlib.patches as patches
 import matplotlib.pyplot as plt
 
 from osgeo import gdal
@@ -35,6 +32,9 @@ try:
 except ImportError:
     gooey = None
 
+from geometry import (GeometryBundle, find_homography, read_camera_matrix,
+                      read_gcps, parse_bbox, add_geometry_arguments)
+
 import warnings
 warnings.simplefilter("ignore", UserWarning)
 
@@ -75,103 +75,47 @@ else:
 # <<< END GUI >>>
 
 
-def find_homography(uv: np.ndarray, xyz: np.ndarray, mtx: np.ndarray,
-                    dist_coeffs: np.ndarray = np.zeros((1, 4)), z: float = 0,
-                    compute_error: bool = False):
-    """
-    Find homography based on ground control points.
-
-    Parameters
-    ----------
-    uv : np.ndarray
-        Nx2 array of image coordinates of gcps.
-    xyz : np.ndarray
-        Nx3 array of real-world coordinates of gcps.
-    mtx : np.ndarray
-        3x3 array containing the camera matrix
-    dist_coeffs : np.ndarray
-        1xN array with distortion coefficients with N = 4, 5 or 8
-    z : float
-        Real-world elevation to which the image should be projected.
-    compute_error : bool
-        Will compute re-projection erros in pixels if true.
-
-    Returns
-    -------
-    error: float
-        Rectification error in pixels or nan if compute_error=False.
-    H: np.ndarray
-        3x3 homography matrix.
-    """
-    uv = np.asarray(uv).astype(np.float32)
-    xyz = np.asarray(xyz).astype(np.float32)
-    mtx = np.asarray(mtx).astype(np.float32)
-
-    # compute camera pose
-    retval, rvec, tvec = cv2.solvePnP(xyz, uv, mtx, dist_coeffs)
-
-    # convert rotation vector to rotation matrix
-    R = cv2.Rodrigues(rvec)[0]
-
-    # assume height of projection plane
-    R[:, 2] = R[:, 2] * z
-
-    # add translation vector
-    R[:, 2] = R[:, 2] + tvec.flatten()
-
-    # compute homography
-    H = np.linalg.inv(np.dot(mtx, R))
-
-    # normalize homography
-    H = H / H[-1, -1]
-
-    # compute errors
-    if compute_error:
-        tot_error = 0
-        total_points = 0
-        for i in range(len(xyz)):
-            reprojected_points, _ = cv2.projectPoints(xyz[i],
-                                                      rvec, tvec,
-                                                      mtx,
-                                                      dist_coeffs)
-            tot_error += np.sum(np.abs(uv[i] - reprojected_points)**2)
-            total_points += i
-        mean_error_px = np.sqrt(tot_error / total_points)
-    else:
-        mean_error_px = None
-
-    return mean_error_px, H
-
-
-def rectify_image(img: np.ndarray, mtx: np.ndarray):
+def rectify(img: np.ndarray, geom: GeometryBundle, mtx: np.ndarray,
+            dist: np.ndarray, method: str = "nearest",
+            engine: str = "remap"):
     """
-    Rectify mage coordinates.
+    Rectify an image onto the grid of a geometry bundle.
 
     Parameters
     ----------
     img : np.ndarray
-        Input image aray.
+        Raw (distorted) RGB image.
+    geom : GeometryBundle
+        Image geometry with a bounding box.
     mtx : np.ndarray
-        3x3 array containing the camera matrix
+        3x3 camera matrix.
+    dist : np.ndarray
+        Distortion coefficients.
+    method : str, optional
+        Interpolation method, nearest, linear or cubic (remap only). By
+        default nearest.
+    engine : str, optional
+        remap uses precomputed lookup tables from the grid to the raw image
+        (fast). griddata triangulates the rectified pixels every time
+        (slow, kept for reference). By default remap.
 
     Returns
     -------
-    x, y: np.ndarray
-        rectified coordinates
+    np.ndarray
+        Rectified image. Cells that do not see the image are set to 0.
     """
+    if engine == "remap":
+        return geom.remap(img, mtx, dist, method)
 
-    # get_pixel_coordinates(img)
-    u, v = np.meshgrid(range(img.shape[1]), range(img.shape[0]))
-    uv = np.vstack((u.flatten(), v.flatten())).T
+    elif engine == "griddata":
+        return geom.griddata(img, mtx, dist, method)
 
-    # transform image using homography
-    xy = cv2.perspectiveTransform(np.asarray([uv]).astype(np.float32), mtx)[0]
-
-    return xy[:, 0].reshape(u.shape[:2]), xy[:, 1].reshape(v.shape[:2])
+    raise ValueError("Wrong rectification engine. Use remap or griddata.")
 
 
 def save_as_geotiff(grid_x: np.ndarray, grid_y: np.ndarray, dx: float,
-                    dy: float, rgb: np.ndarray, epsg: int, outfile: str):
+                    dy: float, rgb: np.ndarray, epsg: int, outfile: str,
+                    descriptions: list = None):
     """
     Save output image as geotiff using GDAL.
 
@@ -184,25 +128,32 @@ def save_as_geotiff(grid_x: np.ndarray, grid_y: np.ndarray, dx: float,
     dx, dy : float
         Grid resolution in x and y.
     rgb : np.ndarray
-        Image data.
+        Image data. Every entry of the last dimension is written as a band,
+        so a stack of several RGB images becomes a multi-band raster.
     epsg : int
         EPSG code for georefencing.
     outfile : str
         Output file name.
+    descriptions : list, optional
+        Description of each band. Optional.
 
     Returns
     -------
     None
         Will write to file instead.
     """
+    if rgb.ndim == 2:
+        rgb = rgb[:, :, None]
+
     # set geotransform
     nx = rgb.shape[0]
     ny = rgb.shape[1]
+    nbands = rgb.shape[2]
     geotransform = [grid_x.min(), dx, 0, grid_y.min(), 0, dy]
 
-    # create the 3-band raster file
+    # create the n-band raster file
     dst_ds = gdal.GetDriverByName('GTiff').Create(
-        outfile, ny, nx, 3, gdal.GDT_Byte)
+        outfile, ny, nx, nbands, gdal.GDT_Byte)
 
     dst_ds.SetGeoTransform(geotransform)  # specify coords
     srs = osr.SpatialReference()  # establish encoding
@@ -210,16 +161,68 @@ def save_as_geotiff(grid_x: np.ndarray, grid_y: np.ndarray, dx: float,
     srs.ImportFromEPSG(int(epsg))
     dst_ds.SetProjection(srs.ExportToWkt())  # export coords to file
 
-    # write rgb bands to the raster
-    dst_ds.GetRasterBand(1).WriteArray(rgb[:, :, 0])
-    dst_ds.GetRasterBand(2).WriteArray(rgb[:, :, 1])
-    dst_ds.GetRasterBand(3).WriteArray(rgb[:, :, 2])
+    # write bands to the raster
+    for band in range(nbands):
+        dst_ds.GetRasterBand(band + 1).WriteArray(rgb[:, :, band])
+        if descriptions:
+            dst_ds.GetRasterBand(band + 1).SetDescription(descriptions[band])
 
     # write to disk
     dst_ds.FlushCache()
     dst_ds = None
 
 
+def expand_inputs(inputs: list):
+    """
+    Expand glob patterns in a list of input images.
+
+    Parameters
+    ----------
+    inputs : list
+        File names or glob patterns, e.g. "*.png".
+
+    Returns
+    -------
+    list
+        File names in the given order, patterns sorted naturally.
+    """
+    files = []
+    for pattern in inputs:
+        matches = natsorted(glob(pattern))
+        if not matches:
+            raise IOError(f"No image matches \"{pattern}\"")
+        files += matches
+    return files
+
+
+def output_names(inputs: list, outputs: list):
+    """
+    Output file name of every input image.
+
+    Parameters
+    ----------
+    inputs : list
+        Input images.
+    outputs : list
+        One output per input or a single template. Templates may use
+        {name} (input name without extension) and {i} (input number).
+
+    Returns
+    -------
+    list
+        Output file names.
+    """
+    if len(outputs) == len(inputs) and (len(inputs) > 1 or
+                                        "{" not in outputs[0]):
+        return outputs
+    if len(outputs) != 1 or "{" not in outputs[0]:
+        raise ValueError("Give one output per input or a single output "
+                         "template such as \"{name}_rect.tiff\".")
+    names = [os.path.splitext(os.path.basename(f))[0] for f in inputs]
+    return [outputs[0].format(name=name, i=i)
+            for i, name in enumerate(names)]
+
+
 def plot(grid_x: np.ndarray, grid_y: np.ndarray, rgb: np.ndarray,
          gcps: np.ndarray = None):
     """
@@ -284,9 +287,10 @@ def main():
         parser.add_argument("--input", "-i",
                             action="store",
                             dest="input",
-                            default="../../doc/average.png",
+                            nargs="+",
+                            default=["../../doc/average.png"],
                             required=False,
-                            help="Input Image.",)
+                            help="Input image(s) or glob pattern(s).",)
 
         parser.add_argument("--camera_matrix", "-mtx",
                             action="store",
@@ -305,18 +309,22 @@ def main():
         parser.add_argument("--output", "-o",
                             action="store",
                             dest="output",
+                            nargs="+",
                             required=False,
-                            default="rectified.tiff",
-                            help="Rectified image in geotiff format.")
+                            default=["rectified.tiff"],
+                            help="Rectified image(s) in geotiff format. Give "
+                                 "one output per input or a template such "
+                                 "as \"{name}_rect.tiff\".")
 
     else:  # add the same thing but a nicer widget
         parser.add_argument("--input", "-i",
                             action="store",
                             dest="input",
+                            nargs="+",
                             required=False,
-                            help="Input image.",
-                            default="../../doc/average.png",
-                            widget='FileChooser')
+                            help="Input image(s).",
+                            default=["../../doc/average.png"],
+                            widget='MultiFileChooser')
 
         parser.add_argument("--camera_matrix", "-mtx",
                             action="store",
@@ -337,9 +345,12 @@ def main():
         parser.add_argument("--output", "-o",
                             action="store",
                             dest="output",
+                            nargs="+",
                             required=False,
-                            default="rectified.tiff",
-                            help="Rectified image in geotiff format.",
+                            default=["rectified.tiff"],
+                            help="Rectified image(s) in geotiff format. Give "
+                                 "one output per input or a template such "
+                                 "as \"{name}_rect.tiff\".",
                             widget='FileChooser')
 
     parser.add_argument("--projection_height",
@@ -376,6 +387,15 @@ def main():
                         default="nearest",
                         help="Interpolation method. Default is nearest.")
 
+    parser.add_argument("--engine",
+                        action="store",
+                        dest="engine",
+                        default="remap",
+                        choices=["remap", "griddata"],
+                        help="Rectification engine. remap uses precomputed "
+                             "lookup tables and is much faster than "
+                             "griddata. Default is remap.")
+
     parser.add_argument("--dx", "-dx",
                         action="store",
                         dest="dx",
@@ -388,50 +408,35 @@ def main():
                         default=1,
                         help="Grid resolution (y) in meters. Default is 1m.")
 
+    parser.add_argument("--stack",
+                        action="store_true",
+                        dest="stack",
+                        help="Write all rectified images to a single "
+                             "multi-band geotiff given by --output.")
+
     parser.add_argument("--show_results", "-show",
                         action="store_true",
                         dest="show",
                         help="Show results on screen.")
 
+    add_geometry_arguments(parser)
+
     args = parser.parse_args()
 
     # read camera matrix and distortion coefficients
-    if args.camera_matrix.lower().endswith("json"):
-        with open(args.camera_matrix, 'r') as f:
-            cam = json.load(f)
-            mtx = np.asarray(cam["camera_matrix"])
-            dist = np.asarray(cam["distortion_coefficients"])
+    mtx, dist = read_camera_matrix(args.camera_matrix)
+
+    # input and output images
+    inputs = expand_inputs(args.input)
+    if args.stack:
+        if len(args.output) != 1:
+            raise ValueError("Give a single output when using --stack.")
+        outputs = args.output
     else:
-        with open(args.camera_matrix, 'rb') as f:
-            cam = pickle.load(f)
-            mtx = cam["camera_matrix"]
-            dist = cam["distortion_coefficients"]
-
-    # read image
-    img = cv2.cvtColor(cv2.imread(args.input), cv2.COLOR_BGR2RGB)
-
-    # undistort
-    h,  w = img.shape[:2]
-    newcameramtx, roi = cv2.getOptimalNewCameraMatrix(
-        mtx, dist, (w, h), 1, (w, h))
-
-    # undistort image
-    dst = cv2.undistort(img, mtx, dist, None, newcameramtx)
+        outputs = output_names(inputs, args.output)
 
     # read coordinates
-    xyz = []
-    uv = []
-    f = open(args.gcps, "r")
-    for i, line in enumerate(f.readlines()):
-        if i > 0:  # ignore header
-            xyz.append([line.split(",")[0],
-                        line.split(",")[1],
-                        line.split(",")[2]])
-            uv.append([line.split(",")[3],
-                       line.split(",")[4]])
-    f.close()
-    xyz = np.array(xyz).astype(np.float32)
-    uv = np.array(uv).astype(np.float32)
+    xyz, uv = read_gcps(args.gcps)
 
     # rectify
     if int(args.projection_height) == int(-999):
@@ -439,63 +444,58 @@ def main():
     else:
         pheight = float(args.projection_height)
 
-    error, H = find_homography(uv, xyz, mtx, dist_coeffs=dist, z=pheight,
-                               compute_error=args.reprojection_error)
-    ximg, yimg = rectify_image(img, H)
-    if error:
+    if args.reprojection_error:
+        error, _ = find_homography(uv, xyz, mtx, dist_coeffs=dist, z=pheight,
+                                   compute_error=True)
         print(f"  -- Re-projection error is {round(error, 1)} pixels")
 
-    # image coordinate points
-    XY = np.vstack([ximg.flatten(), yimg.flatten()]).T
-
     # bounding box
-    bbox = args.bbox.split(",")
-    bbox = np.array([float(bbox[0]), float(bbox[1]),
-                     float(bbox[2]), float(bbox[3])])
-
-    # mask points outside the bounding box
-    rect = patches.Rectangle((bbox[0], bbox[1]), bbox[2], bbox[3],
-                             linewidth=2, edgecolor='r', facecolor='none')
-
-    insiders = rect.contains_points(XY)
-    insiders_idx = np.arange(0, len(XY), 1)[insiders]
-    outsiders_idx = np.arange(0, len(XY), 1)[~insiders]
-    iimg, jimg = np.unravel_index(outsiders_idx, ximg.shape)
-
-    # copy and mask
-    ximg_m = ximg.copy()
-    yimg_m = yimg.copy()
-    img_m = img.copy()
-    dst_m = dst.copy()
-
-    ximg_m[iimg, jimg] = np.ma.masked
-    yimg_m[iimg, jimg] = np.ma.masked
-    img_m[iimg, jimg, :] = np.ma.masked
-    dst_m[iimg, jimg, :] = np.ma.masked
-
-    print("\n  -- Interpolating, please wait...")
-    # interpolate
-    points = XY[insiders_idx, :]
+    bbox = parse_bbox(args.bbox)
 
     dx = float(args.dx)
     dy = float(args.dy)
-    grid_x, grid_y = np.meshgrid(np.arange(bbox[0], bbox[0] + bbox[2], dx),
-                                 np.arange(bbox[1], bbox[1] + bbox[3], dy))
-
-    values = np.vstack([dst_m[:, :, 0].flatten()[insiders_idx],
-                        dst_m[:, :, 1].flatten()[insiders_idx],
-                        dst_m[:, :, 2].flatten()[insiders_idx]]).T
-    rgb = griddata(points,
-                   values,
-                   (grid_x, grid_y),
-                   method=args.interp_method).clip(0, 255)
-
-    # output
-    save_as_geotiff(grid_x, grid_y, dx, dy, rgb, args.epsg, args.output)
-
-    # plot
-    if args.show:
-        plot(grid_x, grid_y, rgb, gcps=xyz)
+
+    # homography, pixels inside the bounding box, grid and lookup tables
+    # are cached and shared by all images
+    geom = None
+    cache = None if args.no_geometry_cache else args.geometry_cache
+
+    bands = []
+    descriptions = []
+    for i, fname in enumerate(inputs):
+
+        # read image
+        img = cv2.cvtColor(cv2.imread(fname), cv2.COLOR_BGR2RGB)
+
+        if geom is None:
+            geom = GeometryBundle.load(mtx, dist, xyz, uv, pheight,
+                                       img.shape, bbox=bbox, dx=dx, dy=dy,
+                                       cache=cache)
+            grid_x, grid_y = geom.grid()
+        elif tuple(img.shape[:2]) != tuple(geom.meta["shape"][:2]):
+            raise ValueError(f"Image \"{fname}\" does not have the same "
+                             "size as the first image.")
+
+        print(f"\n  -- Interpolating {fname}, please wait...")
+        rgb = rectify(img, geom, mtx, dist, method=args.interp_method,
+                      engine=args.engine)
+
+        # output
+        if args.stack:
+            name = os.path.splitext(os.path.basename(fname))[0]
+            bands.append(rgb)
+            descriptions += [f"{name}_{c}" for c in "rgb"]
+        else:
+            save_as_geotiff(grid_x, grid_y, dx, dy, rgb, args.epsg,
+                            outputs[i])
+
+        # plot
+        if args.show:
+            plot(grid_x, grid_y, rgb, gcps=xyz)
+
+    if args.stack:
+        save_as_geotiff(grid_x, grid_y, dx, dy, np.dstack(bands), args.epsg,
+                        outputs[0], descriptions=descriptions)
 
     print("\nMy work is done!\n")
 
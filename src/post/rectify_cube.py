@@ -0,0 +1,241 @@
+"""
+Rectify a series of images into a NetCDF cube.
+
+# SCRIPT   : rectify_cube.py
+# POURPOSE : Rectify every frame of a capture cycle and stream the results
+#            to a chunked and compressed (time, y, x, band) NetCDF file.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import argparse
+
+import datetime
+
+import cv2
+
+from tqdm import tqdm
+
+from frames import FrameSource, list_images, add_frame_source_arguments
+from geometry import (GeometryBundle, REMAP_METHODS, read_camera_matrix,
+                      read_gcps, parse_bbox, add_geometry_arguments)
+from ncstream import NetCDFStream
+
+
+def rectify_cube(frames: FrameSource, geom: GeometryBundle, mtx, dist,
+                 output: str, start: datetime.datetime, freq: float,
+                 method: str = "nearest", chunk_size: int = 32,
+                 complevel: int = 4, attrs: dict = None,
+                 progress: bool = True):
+    """
+    Rectify all frames and write them to a NetCDF file.
+
+    Parameters
+    ----------
+    frames : FrameSource
+        Decoded RGB frames.
+    geom : GeometryBundle
+        Image geometry with a bounding box.
+    mtx : np.ndarray
+        3x3 camera matrix.
+    dist : np.ndarray
+        Distortion coefficients.
+    output : str
+        Output file name.
+    start : datetime.datetime
+        Time of the first frame.
+    freq : float
+        Acquisition frequency in Hz.
+    method : str, optional
+        Interpolation method, nearest, linear or cubic. By default nearest.
+    chunk_size : int, optional
+        Number of frames per chunk, which is also the number of rectified
+        frames kept in memory. By default 32.
+    complevel : int, optional
+        Compression level from 0 (none) to 9, by default 4.
+    attrs : dict, optional
+        Global attributes.
+    progress : bool, optional
+        Show a progress bar, by default True.
+
+    Returns
+    -------
+    None
+        Will write to file instead.
+    """
+    # build the lookup tables before the first frame arrives
+    geom.remap_tables(mtx, dist)
+
+    coords = {"y": (geom.ylin, {"units": "m"}),
+              "x": (geom.xlin, {"units": "m"}),
+              "band": ["r", "g", "b"]}
+    variables = {"rgb": dict(dims=("time", "y", "x", "band"), dtype="u1",
+                             attrs={"long_name": "rectified image"})}
+
+    dt = datetime.timedelta(seconds=1 / freq)
+
+    pbar = tqdm(total=len(frames), disable=not progress)
+    with NetCDFStream(output, variables, coords=coords, attrs=attrs,
+                      buffer_size=chunk_size, complevel=complevel) as nc:
+        for i, (_, img) in enumerate(frames):
+            nc.append(start + i * dt, rgb=geom.remap(img, mtx, dist, method))
+            pbar.update()
+    pbar.close()
+
+
+if __name__ == "__main__":
+
+    print("\nRectifying images, please wait...\n")
+
+    # Argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--input", "-i",
+                        action="store",
+                        dest="input",
+                        required=True,
+                        help="Input folder with images.",)
+
+    parser.add_argument("--output", "-o",
+                        action="store",
+                        dest="output",
+                        default="rectified.nc",
+                        required=False,
+                        help="Output netCDF file. Default is rectified.nc.",)
+
+    parser.add_argument("--camera_matrix", "-mtx",
+                        action="store",
+                        dest="camera_matrix",
+                        required=True,
+                        help="Camera Matrix in JSON or pickle format.",)
+
+    parser.add_argument("--ground_control_points", "-gcps", "--gcps",
+                        action="store",
+                        dest="gcps",
+                        required=True,
+                        help="File with x,y,z,u,v data in csv format.",)
+
+    parser.add_argument("--bbox", "-bbox",
+                        action="store",
+                        dest="bbox",
+                        required=True,
+                        help="Bounding box to cut the data. Format is "
+                             "\'bottom_left,bottom_right,dx,dy\'",)
+
+    parser.add_argument("--dx", "-dx",
+                        action="store",
+                        dest="dx",
+                        default=1,
+                        help="Grid resolution (x) in meters. Default is 1m.")
+
+    parser.add_argument("--dy", "-dy",
+                        action="store",
+                        dest="dy",
+                        default=1,
+                        help="Grid resolution (y) in meters. Default is 1m.")
+
+    parser.add_argument("--epsg",
+                        action="store",
+                        dest="epsg",
+                        required=False,
+                        default="28356",
+                        help="EPSG code of the grid coordinates.",)
+
+    parser.add_argument("--method",
+                        action="store",
+                        dest="interp_method",
+                        default="nearest",
+                        choices=list(REMAP_METHODS),
+                        help="Interpolation method. Default is nearest.")
+
+    parser.add_argument("--projection_height",
+                        action="store",
+                        dest="projection_height",
+                        required=False,
+                        default="-999",
+                        help="Project height in meters. Default is -999 which "
+                             "uses the mean height of the GCPS.")
+
+    parser.add_argument("--start_time",
+                        action="store",
+                        dest="start_time",
+                        required=False,
+                        default="20200101:000000",
+                        help="Start time in YYYYMMDD:HHMMSS format. "
+                             "Default is {20200101:000000}")
+
+    parser.add_argument("--frequency", "-fps",
+                        action="store",
+                        dest="aquisition_frequency",
+                        required=False,
+                        default=2,
+                        help="Aquistion frequency in Hz. Default is 2Hz.")
+
+    parser.add_argument("--image_format",
+                        action="store",
+                        dest="image_format",
+                        required=False,
+                        default="jpg",
+                        help="Input images format. Default is jpg.")
+
+    parser.add_argument("--chunk_size",
+                        action="store",
+                        dest="chunk_size",
+                        default=32,
+                        required=False,
+                        help="Number of frames per chunk in the output. "
+                             "This is also the number of rectified frames "
+                             "kept in memory. Default is 32.")
+
+    parser.add_argument("--complevel",
+                        action="store",
+                        dest="complevel",
+                        default=4,
+                        required=False,
+                        help="Compression level from 0 (none) to 9. "
+                             "Default is 4.")
+
+    add_frame_source_arguments(parser)
+    add_geometry_arguments(parser)
+
+    args = parser.parse_args()
+
+    # read camera matrix and distortion coefficients
+    mtx, dist = read_camera_matrix(args.camera_matrix)
+
+    # read coordinates
+    xyz, uv = read_gcps(args.gcps)
+    if int(args.projection_height) == int(-999):
+        pheight = xyz[:, 2].mean()
+    else:
+        pheight = float(args.projection_height)
+
+    # search for images
+    images = list_images(args.input, args.image_format)
+    if not images:
+        raise IOError(f"No images found in \"{args.input}\"")
+    print(f"  -- Found {len(images)} images")
+    first_img = cv2.imread(images[0])
+
+    # homography, grid and lookup tables are cached
+    cache = None if args.no_geometry_cache else args.geometry_cache
+    geom = GeometryBundle.load(mtx, dist, xyz, uv, pheight, first_img.shape,
+                               bbox=parse_bbox(args.bbox),
+                               dx=float(args.dx), dy=float(args.dy),
+                               cache=cache)
+
+    frames = FrameSource(images, workers=int(args.workers),
+                         prefetch_mb=float(args.prefetch_mb),
+                         processes=args.use_processes, color="rgb")
+    rectify_cube(frames, geom, mtx, dist, args.output,
+                 datetime.datetime.strptime(args.start_time,
+                                            "%Y%m%d:%H%M%S"),
+                 float(args.aquisition_frequency),
+                 method=args.interp_method,
+                 chunk_size=int(args.chunk_size),
+                 complevel=int(args.complevel),
+                 attrs={"epsg": int(args.epsg),
+                        "dx": float(args.dx), "dy": float(args.dy)})
+
+    print("\nMy work is done!\n")
@@ -0,0 +1,462 @@
+"""
+Streaming reducers for a series of images.
+
+# SCRIPT   : reducers.py
+# POURPOSE : Accumulate statistics over a series of images, one frame at a
+#            time, without keeping the frames in memory.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import heapq
+
+import numpy as np
+
+
+def to_uint8(arr: np.ndarray):
+    """
+    Scale an array to the 0-255 range and cast it to integers.
+
+    Parameters
+    ----------
+    arr : np.ndarray
+        Input array.
+
+    Returns
+    -------
+    np.ndarray
+        Scaled uint8 array.
+    """
+    amin = arr.min()
+    amax = arr.max()
+    if amax == amin:
+        return np.zeros(arr.shape, dtype=np.uint8)
+    return ((arr - amin) * (1 / (amax - amin) * 255)).astype('uint8')
+
+
+class Reducer:
+    """
+    Base class for all reducers.
+
+    A reducer is fed one frame at a time with ``update()`` and returns its
+    products as a dictionary of images with ``result()``.
+    """
+
+    def update(self, frame: np.ndarray):
+        """
+        Add a frame to the reducer.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            HxWxC uint8 image.
+
+        Returns
+        -------
+        None
+        """
+        raise NotImplementedError
+
+    def result(self):
+        """
+        Get the products of the reducer.
+
+        Returns
+        -------
+        dict
+            Product name to uint8 image.
+        """
+        raise NotImplementedError
+
+
+class MeanReducer(Reducer):
+    """
+    Running average of a series of images.
+
+    Frames are copied into a preallocated block and summed block by block
+    into an integer accumulator with in-place operations, so that no
+    temporary arrays are created per frame. The division only happens once,
+    at the end.
+
+    Parameters
+    ----------
+    block_size : int, optional
+        Number of frames summed at once, by default 16.
+    dtype : np.dtype, optional
+        Precision of the average, float32 or float64. By default float64.
+    """
+
+    def __init__(self, block_size: int = 16, dtype=np.float64):
+        self.block_size = max(int(block_size), 1)
+        self.dtype = np.dtype(dtype)
+        self.n = 0
+        self.k = 0  # frames in the current block
+        self.block = None
+        self.partial = None
+        self.sum = None
+
+    def _allocate(self, frame):
+        if frame.dtype == np.uint8:
+            acc = np.uint32  # exact for up to 16 million frames
+        else:
+            acc = self.dtype
+        self.block = np.empty((self.block_size, ) + frame.shape, frame.dtype)
+        self.partial = np.empty(frame.shape, acc)
+        self.sum = np.zeros(frame.shape, acc)
+
+    def _flush(self):
+        if self.k == 0:
+            return
+        np.sum(self.block[:self.k], axis=0, out=self.partial)
+        np.add(self.sum, self.partial, out=self.sum)
+        self.k = 0
+
+    def update(self, frame):
+        if self.sum is None:
+            self._allocate(frame)
+        self.block[self.k] = frame
+        self.k += 1
+        self.n += 1
+        if self.k == self.block_size:
+            self._flush()
+
+    def mean(self):
+        """Average image as floats."""
+        self._flush()
+        out = self.sum.astype(self.dtype)
+        out /= self.n
+        return out
+
+    def result(self):
+        return {"average": to_uint8(self.mean())}
+
+
+class StreamingMoments:
+    """
+    Streaming mean, variance, skewness, minimum and maximum of arrays.
+
+    Batches of arrays are reduced with numpy and merged with Chan's
+    parallel algorithm, which is also used to merge partial results
+    computed by different workers, so memory does not grow with the number
+    of arrays. All statistics are element-wise, i.e., one value per pixel.
+
+    Parameters
+    ----------
+    dtype : np.dtype, optional
+        Storage precision, float32 or float64. By default float64.
+    skipna : bool, optional
+        Ignore NaN values. The number of samples is then counted per
+        element and ``n`` is an array. By default False.
+    skewness : bool, optional
+        Also keep track of the third moment, by default False.
+    extrema : bool, optional
+        Also keep track of the minimum and maximum, by default False.
+    shape : tuple, optional
+        Shape of the arrays. If given, the statistics start as arrays of
+        this shape without samples (NaN minimum and maximum when skipna is
+        used). By default they are created by the first batch.
+    """
+
+    def __init__(self, dtype=np.float64, skipna: bool = False,
+                 skewness: bool = False, extrema: bool = False,
+                 shape: tuple = None):
+        self.dtype = np.dtype(dtype)
+        self.skipna = skipna
+        self.track_skewness = skewness
+        self.track_extrema = extrema
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+        self.m3 = None
+        self.min = None
+        self.max = None
+        if shape is None:
+            return
+
+        if skipna:
+            self.n = np.zeros(shape, np.int64)
+        self.mean = np.zeros(shape, self.dtype)
+        self.m2 = np.zeros(shape, self.dtype)
+        if skewness:
+            self.m3 = np.zeros(shape, self.dtype)
+        if extrema:
+            # NaN is ignored by fmin and fmax, infinity by minimum and maximum
+            self.min = np.full(shape, np.nan if skipna else np.inf,
+                               self.dtype)
+            self.max = np.full(shape, np.nan if skipna else -np.inf,
+                               self.dtype)
+
+    def add_batch(self, xs: np.ndarray):
+        """
+        Add a batch of arrays stacked along the first axis.
+
+        Parameters
+        ----------
+        xs : np.ndarray
+            Input arrays with shape (batch, ...).
+
+        Returns
+        -------
+        None
+        """
+        if len(xs) == 0:
+            return
+        if self.skipna:
+            valid = ~np.isnan(xs)
+            nb = valid.sum(axis=0)
+            mean = np.where(valid, xs, 0).sum(axis=0, dtype=self.dtype)
+            mean /= np.maximum(nb, 1)
+            d = np.subtract(xs, mean, dtype=self.dtype)
+            d[~valid] = 0
+        else:
+            nb = len(xs)
+            mean = xs.mean(axis=0, dtype=self.dtype)
+            d = np.subtract(xs, mean, dtype=self.dtype)
+        m3 = None
+        if self.track_skewness:
+            d2 = d * d
+            m2 = d2.sum(axis=0)
+            d2 *= d
+            m3 = d2.sum(axis=0)
+            del d2
+        else:
+            d *= d
+            m2 = d.sum(axis=0)
+        del d
+        mins = maxs = None
+        if self.track_extrema:
+            # fmin and fmax ignore NaN, minimum and maximum propagate it
+            lower = np.fmin if self.skipna else np.minimum
+            upper = np.fmax if self.skipna else np.maximum
+            mins = lower.reduce(xs, axis=0)
+            maxs = upper.reduce(xs, axis=0)
+        self._merge(nb, mean, m2, m3, mins, maxs)
+
+    def merge(self, other):
+        """
+        Merge the moments computed by another instance into this one.
+
+        Parameters
+        ----------
+        other : StreamingMoments
+            Partial results, e.g., from another worker, tracking the same
+            statistics.
+
+        Returns
+        -------
+        None
+        """
+        if other.mean is None or not np.any(other.n):
+            return
+        if (self.track_skewness and not other.track_skewness) or \
+                (self.track_extrema and not other.track_extrema):
+            raise ValueError("Cannot merge moments that do not track the "
+                             "same statistics.")
+        self._merge(other.n, other.mean, other.m2, other.m3,
+                    other.min, other.max)
+
+    def _merge(self, nb, mean, m2, m3, mins, maxs):
+        """Chan's parallel update with the moments of a second sample."""
+        if self.mean is None:
+            self.n = np.array(nb) if self.skipna else nb
+            self.mean = np.array(mean, self.dtype)
+            self.m2 = np.array(m2, self.dtype)
+            if self.track_skewness:
+                self.m3 = np.array(m3, self.dtype)
+            if self.track_extrema:
+                self.min = np.array(mins, self.dtype)
+                self.max = np.array(maxs, self.dtype)
+            return
+
+        # elements without samples in either side have zero weight
+        na = self.n
+        n = na + nb
+        weight = nb / np.maximum(n, 1)
+        delta = np.subtract(mean, self.mean, dtype=self.dtype)
+        if self.track_skewness:
+            self.m3 += m3
+            self.m3 += delta ** 3 * (na * weight * (na - nb) /
+                                     np.maximum(n, 1))
+            self.m3 += 3 * delta * (na * m2 - nb * self.m2) / np.maximum(n, 1)
+        self.m2 += m2
+        self.m2 += delta ** 2 * (na * weight)
+        delta *= weight
+        self.mean += delta
+        if self.track_extrema:
+            lower = np.fmin if self.skipna else np.minimum
+            upper = np.fmax if self.skipna else np.maximum
+            lower(self.min, mins, out=self.min, casting="unsafe")
+            upper(self.max, maxs, out=self.max, casting="unsafe")
+        self.n = n
+
+    def variance(self, ddof: int = 1):
+        """Variance, by default the sample variance (ddof=1)."""
+        return self.m2 / np.maximum(self.n - ddof, 1)
+
+    def std(self, ddof: int = 1):
+        """Standard deviation, by default the sample deviation (ddof=1)."""
+        return np.sqrt(self.variance(ddof))
+
+    def skewness(self):
+        """Fisher-Pearson coefficient of skewness (biased)."""
+        if not self.track_skewness:
+            raise ValueError("Skewness was not tracked. Use skewness=True.")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.sqrt(self.n) * self.m3 / self.m2 ** 1.5
+
+
+class VarianceReducer(Reducer):
+    """
+    Running variance of a series of images.
+
+    Frames are collected in blocks which are reduced at once and merged
+    with Chan's parallel algorithm (see StreamingMoments).
+
+    Parameters
+    ----------
+    block_size : int, optional
+        Number of frames reduced at once, by default 4.
+    dtype : np.dtype, optional
+        Storage precision, float32 or float64. By default float64.
+    """
+
+    def __init__(self, block_size: int = 4, dtype=np.float64):
+        self.block_size = max(int(block_size), 1)
+        self.moments = StreamingMoments(dtype=dtype)
+        self.k = 0  # frames in the current block
+        self.block = None
+
+    def _flush(self):
+        if self.k == 0:
+            return
+        self.moments.add_batch(self.block[:self.k])
+        self.k = 0
+
+    def update(self, frame):
+        if self.block is None:
+            self.block = np.empty((self.block_size, ) + frame.shape,
+                                  frame.dtype)
+        self.block[self.k] = frame
+        self.k += 1
+        if self.k == self.block_size:
+            self._flush()
+
+    def variance(self, ddof=1):
+        """Sample variance image (ddof=1) as floats."""
+        self._flush()
+        return self.moments.variance(ddof)
+
+    def result(self):
+        return {"variance": to_uint8(self.variance())}
+
+
+class BrightnessReducer(Reducer):
+    """
+    Keep track of the brightest and darkest images in a series.
+
+    By default, brightness is the sum of the ``V`` channel of the HSV colour
+    space, which is simply the maximum of the three colour channels and is
+    computed straight from the uint8 data. The sum of the luma (Rec. 601)
+    is also available and, because it is linear, only needs the sum of each
+    channel. The ``keep`` brightest and darkest frames are kept in memory so
+    they never have to be read again.
+
+    Parameters
+    ----------
+    metric : str, optional
+        Brightness metric, v or luma. By default v.
+    stride : int, optional
+        Only use every stride-th row and column to score the frames, by
+        default 1 (all pixels).
+    keep : int, optional
+        Number of brightest and darkest frames to keep, by default 1.
+    order : str, optional
+        Channel order of the frames, rgb or bgr. By default rgb.
+    """
+
+    LUMA = np.array([0.299, 0.587, 0.114])
+
+    def __init__(self, metric: str = "v", stride: int = 1, keep: int = 1,
+                 order: str = "rgb"):
+        if metric not in ("v", "luma"):
+            raise ValueError(f"Unknown brightness metric \"{metric}\". "
+                             "Use v or luma.")
+        if order not in ("rgb", "bgr"):
+            raise ValueError(f"Unknown channel order \"{order}\". "
+                             "Use rgb or bgr.")
+        self.metric = metric
+        self.stride = max(int(stride), 1)
+        self.keep = max(int(keep), 1)
+        self.weights = self.LUMA if order == "rgb" else self.LUMA[::-1]
+        self.brightness = []
+        self.bright = []  # min-heaps of (key, index, frame)
+        self.dark = []
+
+    def score(self, frame: np.ndarray):
+        """
+        Brightness of a frame.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            HxWx3 image.
+
+        Returns
+        -------
+        float
+            Brightness score.
+        """
+        if self.stride > 1:
+            frame = frame[::self.stride, ::self.stride]
+        if self.metric == "luma":
+            sums = frame.sum(axis=(0, 1), dtype=np.uint64)
+            return float(np.dot(sums, self.weights))
+        v = np.maximum(frame[:, :, 0], frame[:, :, 1])
+        np.maximum(v, frame[:, :, 2], out=v)
+        return int(v.sum(dtype=np.uint64))
+
+    def _push(self, heap, key, index, frame):
+        """Keep the frames with the largest keys, copying only winners."""
+        if len(heap) < self.keep:
+            heapq.heappush(heap, (key, -index, frame.copy()))
+        elif (key, -index) > heap[0][:2]:
+            heapq.heapreplace(heap, (key, -index, frame.copy()))
+
+    def update(self, frame):
+        value = self.score(frame)
+        index = len(self.brightness)
+        self.brightness.append(value)
+
+        # ties go to the earliest frame
+        self._push(self.bright, value, index, frame)
+        self._push(self.dark, -value, index, frame)
+
+    def ranked(self):
+        """
+        Brightest and darkest frames sorted from the most extreme.
+
+        Returns
+        -------
+        brightest, darkest : list
+            Lists of (index, brightness, frame).
+        """
+        out = []
+        for heap in (self.bright, self.dark):
+            out.append([(-index, self.brightness[-index], frame)
+                        for _, index, frame in sorted(heap, reverse=True)])
+        return out
+
+    def result(self):
+        products = {}
+        for name, frames in zip(("brightest", "darkest"), self.ranked()):
+            for rank, (_, _, frame) in enumerate(frames):
+                products[name if rank == 0 else f"{name}_{rank + 1}"] = frame
+        return products
+
+
+# which reducer creates which product
+REDUCERS = {"average": MeanReducer,
+            "variance": VarianceReducer,
+            "brightest": BrightnessReducer,
+            "darkest": BrightnessReducer}
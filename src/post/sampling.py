@@ -0,0 +1,112 @@
+"""
+Sample a few pixels of many frames.
+
+# SCRIPT   : sampling.py
+# POURPOSE : Turn the bilinear taps of the timestack pixels into sparse
+#            operators so that each frame is sampled with one compact
+#            gather and one sparse product.
+# AUTHOR   : Caio Eadi Stringari
+# DATE     : 17/10/2026
+# VERSION  : 1.0
+"""
+
+import numpy as np
+
+from scipy.sparse import csr_matrix
+
+
+# statistics used to combine the neighbours of each point
+STATISTICS = ["mean", "median", "max", "min", "deviation", "variance"]
+
+
+class StackSampler:
+    """
+    Sample the timestack points of a frame.
+
+    The pixels needed by all points are gathered into a compact uint8 array
+    and interpolated with a single sparse matrix product. For the mean, the
+    averaging over neighbours is folded into the matrix. The deviation and
+    variance use the first two moments of the interpolated neighbours, and
+    the median, min and max work on the neighbours rounded to uint8.
+
+    Parameters
+    ----------
+    idx : np.ndarray
+        Flat pixel indexes from GeometryBundle.stack_taps(), shape
+        (points, 4) or (points, neighbours, 4).
+    weights : np.ndarray
+        Interpolation weights, same shape as idx.
+    statistic : str, optional
+        How to combine the neighbours of each point, one of STATISTICS. By
+        default mean.
+    """
+
+    def __init__(self, idx: np.ndarray, weights: np.ndarray,
+                 statistic: str = "mean"):
+
+        if statistic not in STATISTICS:
+            raise ValueError(f"Unknown statistic \"{statistic}\". Use one of "
+                             f"{', '.join(STATISTICS)}.")
+
+        idx = np.asarray(idx)
+        weights = np.asarray(weights, dtype=np.float64)
+        if idx.ndim == 2:
+            idx = idx[:, None, :]
+            weights = weights[:, None, :]
+        self.npoints, self.neighbours, ntaps = idx.shape
+        self.statistic = statistic
+
+        # only these pixels are read from each frame
+        self.pixels, inverse = np.unique(idx, return_inverse=True)
+
+        # one row per neighbour
+        rows = np.repeat(np.arange(self.npoints * self.neighbours), ntaps)
+        matrix = csr_matrix((weights.ravel(), (rows, inverse.ravel())),
+                            shape=(self.npoints * self.neighbours,
+                                   len(self.pixels)))
+
+        # one row per point
+        if statistic == "mean" and self.neighbours > 1:
+            rows = np.repeat(np.arange(self.npoints), self.neighbours)
+            average = csr_matrix(
+                (np.full(len(rows), 1 / self.neighbours), (rows,
+                 np.arange(len(rows)))),
+                shape=(self.npoints, self.npoints * self.neighbours))
+            matrix = (average @ matrix).tocsr()
+        self.matrix = matrix
+
+    def __call__(self, img: np.ndarray):
+        """
+        Sample a frame.
+
+        Parameters
+        ----------
+        img : np.ndarray
+            Raw frame, (rows, cols) or (rows, cols, bands).
+
+        Returns
+        -------
+        np.ndarray
+            float64 array of shape (points, bands) or (points, ).
+        """
+        pixels = img.reshape(img.shape[0] * img.shape[1], -1)[self.pixels]
+        values = self.matrix @ pixels
+
+        if self.neighbours == 1 or self.statistic == "mean":
+            return values.reshape((self.npoints, ) + img.shape[2:])
+
+        values = values.reshape(self.npoints, self.neighbours, -1)
+        if self.statistic in ["deviation", "variance"]:
+            mean = values.mean(axis=1)
+            var = np.maximum((values * values).mean(axis=1) - mean * mean, 0)
+            out = np.sqrt(var) if self.statistic == "deviation" else var
+        else:
+            # neighbours along the last axis, as uint8
+            values = np.rint(values).astype(np.uint8).transpose(0, 2, 1)
+            if self.statistic == "median":
+                out = np.median(values, axis=-1)
+            elif self.statistic == "max":
+                out = values.max(axis=-1).astype(np.float64)
+            else:
+                out = values.min(axis=-1).astype(np.float64)
+        return out.reshape((self.npoints, ) + img.shape[2:])
@@ -9,34 +9,36 @@ Create a timestack from a series of images.
 """
 
 import os
-from posixpath import basename
 import sys
 
 # arguments
-import json
 import argparse
 
+import json
 import datetime
 
 from glob import glob
 from natsort import natsorted
 
 import numpy as np
+import pandas as pd
 
 import pickle
 
-import cv2
-
-from scipy.interpolate import griddata
+import netCDF4
 
-from scipy.spatial import KDTree
+import cv2
 
 from tqdm import tqdm
 
-from matplotlib import path
-import matplotlib.patches as patches
 import matplotlib.pyplot as plt
 
+from frames import FrameSource, add_frame_source_arguments
+from ncstream import NetCDFStream, Manifest
+from sampling import StackSampler, STATISTICS
+from geometry import (GeometryBundle, find_homography, read_camera_matrix,
+                      read_gcps, hash_parameters, add_geometry_arguments)
+
 
 try:
     import gooey
@@ -83,99 +85,88 @@ else:
 # <<< END GUI >>>
 
 
-def find_homography(uv: np.ndarray, xyz: np.ndarray, mtx: np.ndarray,
-                    dist_coeffs: np.ndarray = np.zeros((1, 4)), z: float = 0,
-                    compute_error: bool = False):
+def read_transects(fname: str):
     """
-    Find homography based on ground control points.
+    Read timestack transects from a GeoJSON or CSV file.
+
+    GeoJSON files may have LineString or MultiLineString features, named
+    after their "name" or "id" property. The parts of a MultiLineString
+    get the part number appended, e.g. T_0 and T_1. CSV files must have
+    the columns transect, x and y, with one row per vertex in drawing
+    order. Transect names must be unique.
 
     Parameters
     ----------
-    uv : np.ndarray
-        Nx2 array of image coordinates of gcps.
-    xyz : np.ndarray
-        Nx3 array of real-world coordinates of gcps.
-    mtx : np.ndarray
-        3x3 array containing the camera matrix
-    dist_coeffs : np.ndarray
-        1xN array with distortion coefficients with N = 4, 5 or 8
-    z : float
-        Real-world elevation to which the image should be projected.
-    compute_error : bool
-        Will compute re-projection erros in pixels if true.
+    fname : str
+        Input file name.
 
     Returns
     -------
-    error: float
-        Rectification error in pixels or nan if compute_error=False.
-    H: np.ndarray
-        3x3 homography matrix.
+    list
+        List of (name, Nx2 array of vertices) tuples.
     """
-    uv = np.asarray(uv).astype(np.float32)
-    xyz = np.asarray(xyz).astype(np.float32)
-    mtx = np.asarray(mtx).astype(np.float32)
-
-    # compute camera pose
-    retval, rvec, tvec = cv2.solvePnP(xyz, uv, mtx, dist_coeffs)
-
-    # convert rotation vector to rotation matrix
-    R = cv2.Rodrigues(rvec)[0]
-
-    # assume height of projection plane
-    R[:, 2] = R[:, 2] * z
-
-    # add translation vector
-    R[:, 2] = R[:, 2] + tvec.flatten()
-
-    # compute homography
-    H = np.linalg.inv(np.dot(mtx, R))
-
-    # normalize homography
-    H = H / H[-1, -1]
-
-    # compute errors
-    if compute_error:
-        tot_error = 0
-        total_points = 0
-        for i in range(len(xyz)):
-            reprojected_points, _ = cv2.projectPoints(xyz[i],
-                                                      rvec, tvec,
-                                                      mtx,
-                                                      dist_coeffs)
-            tot_error += np.sum(np.abs(uv[i] - reprojected_points)**2)
-            total_points += i
-        mean_error_px = np.sqrt(tot_error / total_points)
+    transects = []
+    if fname.lower().endswith((".json", ".geojson")):
+        with open(fname, "r") as f:
+            features = json.load(f)["features"]
+        for i, feature in enumerate(features):
+            props = feature.get("properties") or {}
+            name = str(props.get("name", props.get("id", i)))
+            geometry = feature["geometry"]
+            if geometry["type"] == "LineString":
+                lines = [geometry["coordinates"]]
+            elif geometry["type"] == "MultiLineString":
+                lines = geometry["coordinates"]
+            else:
+                raise ValueError(f"Transect \"{name}\" is a "
+                                 f"{geometry['type']}, not a line.")
+            for j, line in enumerate(lines):
+                transects.append((f"{name}_{j}" if len(lines) > 1 else name,
+                                  np.asarray(line, float)[:, :2]))
     else:
-        mean_error_px = None
-
-    return mean_error_px, H
-
-
-def rectify_image(img: np.ndarray, mtx: np.ndarray):
+        df = pd.read_csv(fname)
+        # consecutive rows with the same name are one transect
+        runs = (df["transect"] != df["transect"].shift()).cumsum()
+        for _, group in df.groupby(runs, sort=False):
+            transects.append((str(group["transect"].iloc[0]),
+                              group[["x", "y"]].values))
+
+    names = set()
+    for name, vertices in transects:
+        if len(vertices) < 2:
+            raise ValueError(f"Transect \"{name}\" needs at least two "
+                             "vertices.")
+        if name in names:
+            raise ValueError(f"Transect \"{name}\" is repeated in "
+                             f"\"{fname}\", names must be unique.")
+        names.add(name)
+    return transects
+
+
+def sample_polyline(vertices: np.ndarray, npoints: int):
     """
-    Rectify mage coordinates.
+    Points equally spaced along a polyline.
 
     Parameters
     ----------
-    img : np.ndarray
-        Input image aray.
-    mtx : np.ndarray
-        3x3 array containing the camera matrix
+    vertices : np.ndarray
+        Nx2 array of vertices.
+    npoints : int
+        Number of points.
 
     Returns
     -------
-    x, y: np.ndarray
-        rectified coordinates
+    points : np.ndarray
+        npointsx2 array of coordinates.
+    length : float
+        Length of the polyline.
     """
-
-    # get_pixel_coordinates(img)
-    u, v = np.meshgrid(range(img.shape[1]), range(img.shape[0]))
-    uv = np.vstack((u.flatten(), v.flatten())).T
-
-    # transform image using homography
-    xy = cv2.perspectiveTransform(np.asarray([uv]).astype(np.float32), mtx)[0]
-
-    return xy[:, 0].reshape(u.shape[:2]), xy[:, 1].reshape(v.shape[:2])
+    distance = np.concatenate(
+        [[0], np.cumsum(np.hypot(*np.diff(vertices, axis=0).T))])
+    s = np.linspace(0, distance[-1], npoints)
+    points = np.vstack([np.interp(s, distance, vertices[:, 0]),
+                        np.interp(s, distance, vertices[:, 1])]).T
+    return points, distance[-1]
 
 
 @gui_decorator
@@ -216,8 +207,9 @@ def main():
                             action="store",
                             dest="output",
                             required=False,
-                            default="timestack.pkl",
-                            help="Timestack in pickle format.")
+                            default="timestack.nc",
+                            help="Output timestack in netCDF format, or in "
+                                 "pickle format if the name ends with .pkl.")
 
     else:  # add the same thing but a nicer widget
         parser.add_argument("--input", "-i",
@@ -248,8 +240,9 @@ def main():
                             action="store",
                             dest="output",
                             required=False,
-                            default="timestack.pkl",
-                            help="Timestack in pickle format.",
+                            default="timestack.nc",
+                            help="Output timestack in netCDF format, or in "
+                                 "pickle format if the name ends with .pkl.",
                             widget='FileSaver')
 
     parser.add_argument("--timestack_line",
@@ -260,6 +253,16 @@ def main():
                         help="Coordinates of the timestack line. Format is"
                              "\'x1,y1,x2,y2\'.")
 
+    parser.add_argument("--transects",
+                        action="store",
+                        dest="transects",
+                        required=False,
+                        default=None,
+                        help="GeoJSON or CSV (transect,x,y) file with "
+                             "several timestack lines. All lines are "
+                             "sampled from each frame and --timestack_line "
+                             "is ignored.")
+
     parser.add_argument("--start_time",
                         action="store",
                         dest="start_time",
@@ -316,6 +319,38 @@ def main():
                         help="Which statistic to use to compute if neighbours "
                              ">1. Default is np.mean.")
 
+    parser.add_argument("--chunk_size",
+                        action="store",
+                        dest="chunk_size",
+                        default=512,
+                        required=False,
+                        help="Number of frames per chunk in the netCDF "
+                             "output. Default is 512.")
+
+    parser.add_argument("--complevel",
+                        action="store",
+                        dest="complevel",
+                        default=4,
+                        required=False,
+                        help="Compression level of the netCDF output from 0 "
+                             "(none) to 9. Default is 4.")
+
+    parser.add_argument("--append",
+                        action="store_true",
+                        dest="append",
+                        help="Append the images to an existing netCDF "
+                             "timestack instead of overwriting it. Images "
+                             "that were already added are skipped.")
+
+    parser.add_argument("--append_to",
+                        action="store",
+                        dest="append_to",
+                        default=None,
+                        required=False,
+                        help="Also append the images to this long-term "
+                             "netCDF timestack, see --append. The images are "
+                             "only decoded once.")
+
     parser.add_argument("--show_results", "-show",
                         action="store_true",
                         dest="show",
@@ -326,19 +361,13 @@ def main():
                         dest="save_as_image",
                         help="Save as an image (png).")
 
+    add_frame_source_arguments(parser)
+    add_geometry_arguments(parser)
+
     args = parser.parse_args()
 
     # read camera matrix and distortion coefficients
-    if args.camera_matrix.lower().endswith("json"):
-        with open(args.camera_matrix, 'r') as f:
-            cam = json.load(f)
-            mtx = np.asarray(cam["camera_matrix"])
-            dist = np.asarray(cam["distortion_coefficients"])
-    else:
-        with open(args.camera_matrix, 'rb') as f:
-            cam = pickle.load(f)
-            mtx = cam["camera_matrix"]
-            dist = cam["distortion_coefficients"]
+    mtx, dist = read_camera_matrix(args.camera_matrix)
 
     # parse time and FPS
     start_date = datetime.datetime.strptime(args.start_time, "%Y%m%d:%H%M%S")
@@ -350,31 +379,21 @@ def main():
     print(f"  -- Found {len(images)} images, starting at {start}")
     first_img = cv2.imread(images[0])
 
-    # build the timestack line
+    # build the timestack lines, all points are sampled at once
     npoints = int(args.npoints)
-    stackline = args.stackline.split(",")
-    stackline = np.array([float(stackline[0]), float(stackline[1]),
-                          float(stackline[2]), float(stackline[3])])
-    stack_x = np.linspace(stackline[0], stackline[2], npoints)
-    stack_y = np.linspace(stackline[1], stackline[3], npoints)
-    stack_points = np.vstack([stack_x, stack_y]).T
-    stack_length = np.sqrt(
-        (stack_x[-1] - stack_x[0])**2 - (stack_y[-1] - stack_y[0])**2)
+    if args.transects:
+        transects = read_transects(args.transects)
+    else:
+        stackline = np.array([float(c) for c in args.stackline.split(",")])
+        transects = [("0", stackline.reshape(2, 2))]
+    names = [name for name, _ in transects]
+    lines = [sample_polyline(vertices, npoints) for _, vertices in transects]
+    stack_points = np.vstack([points for points, _ in lines])
+    stack_length = np.array([length for _, length in lines])
+    print(f"  -- Sampling {len(transects)} transect(s)")
 
     # read gcp coordinates
-    xyz = []
-    uv = []
-    f = open(args.gcps, "r")
-    for i, line in enumerate(f.readlines()):
-        if i > 0:  # ignore header
-            xyz.append([line.split(",")[0],
-                        line.split(",")[1],
-                        line.split(",")[2]])
-            uv.append([line.split(",")[3],
-                       line.split(",")[4]])
-    f.close()
-    xyz = np.array(xyz).astype(np.float32)
-    uv = np.array(uv).astype(np.float32)
+    xyz, uv = read_gcps(args.gcps)
 
     # rectify
     if int(args.projection_height) == int(-999):
@@ -382,115 +401,224 @@ def main():
     else:
         pheight = float(args.projection_height)
 
-    error, H = find_homography(uv, xyz, mtx, dist_coeffs=dist, z=pheight,
-                               compute_error=args.reprojection_error)
-    ximg, yimg = rectify_image(first_img, H)
-    if error:
+    if args.reprojection_error:
+        error, _ = find_homography(uv, xyz, mtx, dist_coeffs=dist, z=pheight,
+                                   compute_error=True)
         print(f"  -- Re-projection error is {round(error, 1)} pixels")
 
-    # image coordinate points
-    XY = np.vstack([ximg.flatten(), yimg.flatten()]).T
-
-    # build the searching tree
-    Tree = KDTree(XY)
+    # the homography and the stack indexes are cached
+    cache = None if args.no_geometry_cache else args.geometry_cache
+    geom = GeometryBundle.load(mtx, dist, xyz, uv, pheight, first_img.shape,
+                               cache=cache)
 
-    # search for nearest points to the timestack line
+    # search for nearest points to the timestack line and map them to the
+    # raw image, so that frames do not need to be undistorted
     neighbours = int(args.neighbours)
+    idx, weights = geom.stack_taps(stack_points, mtx, dist, neighbours)
 
-    _, stack_indexes = Tree.query(stack_points, neighbours)
-    istk, jstk = np.unravel_index(stack_indexes, ximg.shape)
-
-    if args.statistic == "mean":
-        operator = np.mean
-    elif args.statistic == "median":
-        operator = np.median
-    elif args.statistic == "max":
-        operator = np.max
-    elif args.statistic == "min":
-        operator = np.min
-    elif args.statistic == "deviation":
-        operator = np.std
-    elif args.statistic == "variance":
-        operator = np.var
-    else:
+    # statistic used to combine the neighbours
+    statistic = args.statistic
+    if statistic not in STATISTICS:
         print("  -- warning: unknown statistic for n. of neighbours > 1, "
               "falling back to np.mean.")
-        operator = np.mean
+        statistic = "mean"
+
+    # sparse operator that samples all points of a frame at once
+    sampler = StackSampler(idx, weights, statistic)
+
+    # time
+    nframes = len(images)
+    dt = datetime.timedelta(seconds=1 / freq)
+    stack_seconds = np.arange(nframes) / freq
+    stack_times = np.array([start_date + i * dt for i in range(nframes)])
+
+    # pixel values are stored as uint8 unless the statistic does not fit
+    netcdf = not args.output.lower().endswith(".pkl")
+    if neighbours == 1 or (netcdf and statistic in ["mean", "median",
+                                                    "max", "min"]):
+        dtype = np.uint8
+    else:
+        dtype = np.float32
+
+    ntransects = len(transects)
+
+    # append to a long-term timestack, each cycle is only added once
+    longterm = args.output if args.append else args.append_to
+    if longterm:
+        try:
+            if not longterm.lower().endswith(".nc"):
+                raise ValueError("Can only append to a netCDF timestack.")
+            manifest = Manifest(longterm)
+            manifest.check({"geometry": geom.key, "transects": names,
+                            "points": hash_parameters(stack_points),
+                            "neighbours": neighbours, "statistic": statistic,
+                            "dtype": np.dtype(dtype).name})
+            cycle = Manifest.key(os.path.abspath(args.input),
+                                 *[os.path.basename(f) for f in images])
+            if os.path.isfile(longterm) and \
+                    not os.path.isfile(manifest.fname):
+                raise ValueError(f"\"{longterm}\" exists but has no "
+                                 "manifest, it was not created with "
+                                 "--append. Use a new output file.")
+
+            # the manifest must describe exactly what is in the file
+            dropped = manifest.recover()
+            if dropped:
+                print(f"  -- Dropped {dropped} time steps left in "
+                      f"\"{longterm}\" by an interrupted append.")
+            if cycle not in manifest and manifest.entries and \
+                    datetime.datetime.fromisoformat(
+                        manifest.entries[-1]["end"]) >= stack_times[0]:
+                raise ValueError("The start time is before the end of the "
+                                 "timestack, check --start_time.")
+        except ValueError as e:
+            # a problem with the long-term timestack must not cost the
+            # timestack of this cycle
+            if args.append:
+                raise
+            print(f"  -- warning: {e} Not appending to \"{longterm}\".")
+            longterm = None
+
+    if longterm and cycle in manifest:
+        print("  -- These images are already in the long-term "
+              "timestack.")
+        if args.append:
+            return
+        longterm = None
+
+    def open_stream(fname, mode="w", start=None):
+        """Stream the timestack to a netCDF file."""
+        distance = np.vstack([np.linspace(0, length, npoints)
+                              for length in stack_length])
+        xy = stack_points.reshape(ntransects, npoints, 2)
+        return NetCDFStream(
+            fname,
+            {"rgb": dict(dims=("time", "transect", "point", "band"),
+                         dtype=dtype, chunks=(1, npoints, 3),
+                         attrs={"long_name": "timestack",
+                                "units": "DN" if statistic != "variance"
+                                or neighbours == 1 else "DN2"})},
+            coords={"transect": names,
+                    "point": np.arange(npoints),
+                    "band": ["r", "g", "b"]},
+            statics={"x": (("transect", "point"), xy[:, :, 0],
+                           {"units": "m"}),
+                     "y": (("transect", "point"), xy[:, :, 1],
+                           {"units": "m"}),
+                     "distance": (("transect", "point"), distance,
+                                  {"units": "m"}),
+                     "length": (("transect", ), stack_length,
+                                {"units": "m"})},
+            attrs={"neighbours": neighbours, "statistic": statistic},
+            buffer_size=int(args.chunk_size),
+            complevel=int(args.complevel),
+            mode=mode, start=start)
+
+    # stream to disk, memory does not depend on the number of frames. The
+    # frames are decoded once for both outputs.
+    streams = []
+    if netcdf and not args.append:
+        streams.append(open_stream(args.output))
+    if longterm:
+        if not os.path.isfile(longterm):
+            manifest.save()  # marks the file as created with --append
+        streams.append(open_stream(longterm, "a", len(manifest)))
+    if not netcdf:
+        # preallocate the output, points are gathered straight into it
+        rgb_stack = np.empty((len(stack_points), nframes, 3), dtype=dtype)
 
     # < timeloop >
 
     pbar = tqdm(total=len(images))
 
-    stack_sec = 0
-    stack_now = start_date
-
-    rgb_stack = []
-    stack_datetimes = []
-    stack_seconds = []
-
-    for i, image in enumerate(images):
-
-        # read the image
-        img = cv2.cvtColor(cv2.imread(image), cv2.COLOR_BGR2RGB)
+    frames = FrameSource(images, workers=int(args.workers),
+                         prefetch_mb=float(args.prefetch_mb),
+                         processes=args.use_processes, color="rgb")
+    for i, (image, img) in enumerate(frames):
 
-        # undistort
-        h,  w = img.shape[:2]
-        newcameramtx, roi = cv2.getOptimalNewCameraMatrix(
-            mtx, dist, (w, h), 1, (w, h))
+        # bilinear interpolation of the raw frame at the stack pixels
+        # combined over neighbours, shape (npoints, 3)
+        values = sampler(img)
+        if dtype == np.uint8:
+            values = np.rint(values)
 
-        # undistort image
-        dst = cv2.undistort(img, mtx, dist, None, newcameramtx)
-        dst = dst / 255.  # to float
-
-        # extract points
-        if neighbours == 1:
-            rgb_stack.append(dst[istk, jstk, :])
-        else:
-            rgb_stack.append(operator(dst[istk, jstk, :], axis=1))
-
-        # time increment
-        dt = datetime.timedelta(seconds=1 / freq)
-        stack_datetimes.append(stack_now)
-        stack_seconds.append(stack_sec)
-        stack_now += dt
-        stack_sec += 1 / freq
+        for nc in streams:
+            nc.append(stack_times[i], rgb=values.reshape(ntransects,
+                                                         npoints, 3))
+        if not netcdf:
+            rgb_stack[:, i, :] = values
 
         pbar.update()
     pbar.close()
 
-    # to arrays
-    rgb_stack = np.array(rgb_stack)
-    rgb_stack = np.swapaxes(rgb_stack, 0, 1)
-    stack_times = np.array(stack_datetimes)
-    stack_seconds = np.array(stack_seconds)
-
-    # output goes here
-    out = {}
-    out["seconds"] = stack_seconds
-    out["time"] = stack_times
-    out["rgb"] = rgb_stack
-    out["coordinates"] = stack_points
-    out["length"] = stack_length
-    out["points"] = npoints
-    out["neighbours"] = neighbours
-    out["statistic"] = args.statistic
-    with open(args.output, 'wb') as f:
-        pickle.dump(out, f)
-
-    # if save as RGB, save
+    for nc in streams:
+        nc.close()
+    if longterm:
+        manifest.add(cycle, nframes, input=os.path.abspath(args.input),
+                     start=stack_times[0].isoformat(),
+                     end=stack_times[-1].isoformat())
+
+    if netcdf:
+        # read back only what we need to show
+        if args.save_as_image or args.show:
+            with netCDF4.Dataset(args.output) as ds:
+                ds.set_auto_mask(False)
+                rgb_stack = np.stack([np.swapaxes(ds["rgb"][:, k], 0, 1)
+                                      for k in range(ntransects)])
+    else:
+        # to [0, 1] floats, as before
+        scale = 255.**2 if statistic == "variance" and neighbours > 1 \
+            else 255.
+        rgb_stack = rgb_stack.astype(np.float32) / scale
+
+        # one stack per transect, (transect, points, time, 3)
+        rgb_stack = rgb_stack.reshape(ntransects, npoints, nframes, 3)
+        stack_points = stack_points.reshape(ntransects, npoints, 2)
+
+        # output goes here
+        out = {}
+        out["seconds"] = stack_seconds
+        out["time"] = stack_times
+        if args.transects:
+            out["transects"] = names
+            out["rgb"] = rgb_stack
+            out["coordinates"] = stack_points
+            out["length"] = stack_length
+        else:
+            out["rgb"] = rgb_stack[0]
+            out["coordinates"] = stack_points[0]
+            out["length"] = stack_length[0]
+        out["points"] = npoints
+        out["neighbours"] = neighbours
+        out["statistic"] = statistic
+        with open(args.output, 'wb') as f:
+            pickle.dump(out, f)
+
+    # scale for display
+    if args.save_as_image or args.show:
+        if rgb_stack.dtype != np.uint8:
+            rgb_stack = rgb_stack / max(rgb_stack.max(), 1e-12)
+
+    # if save as RGB, save one image per transect
     if args.save_as_image:
         bname = os.path.basename(args.output).split(".")[0]
-        plt.imsave(bname + ".png", np.flipud(rgb_stack))
+        for name, rgb in zip(names, rgb_stack):
+            if args.transects:
+                plt.imsave(f"{bname}_{name}.png", np.flipud(rgb))
+            else:
+                plt.imsave(bname + ".png", np.flipud(rgb))
 
-    
     # plot
     if args.show:
-        fig, ax = plt.subplots(figsize=(12, 6))
-        ax.imshow(rgb_stack, extent=[0, stack_length, 0, stack_seconds.max()],
-                  origin="lower")
-        ax.set_xlabel("Time [s]")
-        ax.set_ylabel("Distance [m]")
-        fig.tight_layout()
+        for name, rgb, length in zip(names, rgb_stack, stack_length):
+            fig, ax = plt.subplots(figsize=(12, 6))
+            ax.imshow(rgb, extent=[0, length, 0, stack_seconds.max()],
+                      origin="lower")
+            ax.set_xlabel("Time [s]")
+            ax.set_ylabel("Distance [m]")
+            if args.transects:
+                ax.set_title(f"Transect {name}")
+            fig.tight_layout()
         plt.show()
 
 
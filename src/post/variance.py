@@ -8,17 +8,9 @@ Compute the variance of a series of images.
 # VERSION  : 1.0
 """
 import argparse
-from glob import glob
-from natsort import natsorted
 
-import numpy as np
-
-from welford import Welford
-
-from skimage.io import imread, imsave
-from skimage.util import img_as_float64
-
-from tqdm import tqdm
+from frames import add_frame_source_arguments
+from products import compute_products, add_average_arguments
 
 
 if __name__ == "__main__":
@@ -38,52 +30,17 @@ if __name__ == "__main__":
     parser.add_argument("--output", "-o",
                         action="store",
                         dest="output",
-                        default="average.png",
+                        default="variance.png",
                         required=False,
-                        help="Output average image name.",)
-
-    args = parser.parse_args()
-
-    # main()
-
-    imlist = natsorted(glob(args.input + "/*"))
-
-    # assuming all images are the same size, get dimensions of first image
-    h, w, c = imread(imlist[0]).shape
-    N = len(imlist)
-
-    # create a numpy array of floats to store the average (assume RGB images)
-    arr = np.zeros((h, w, c), np.float64)
+                        help="Output variance image name.",)
 
-    # instanciate Welford's object
-    w = Welford()
+    add_average_arguments(parser)
+    add_frame_source_arguments(parser)
 
-    # progress bar
-    pbar = tqdm(total=N)
-
-    # add data iteratively
-    for i, im in enumerate(imlist):
-
-        # ignore files that are not images
-        try:
-            img = imread(im)
-        except Exception:
-            pass
-
-        imarr = img_as_float64(img)
-
-        w.add(imarr)
-
-        pbar.update()
-
-    pbar.close()
-
-    # extract the variance
-    arr = w.var_s
-
-    # scale the values and cast to integers
-    new_arr = ((arr - arr.min()) *
-               (1 / (arr.max() - arr.min()) * 255)).astype('uint8')
+    args = parser.parse_args()
 
-    # save the output
-    imsave(args.output, new_arr)
+    compute_products(args.input, {"variance": args.output},
+                     workers=int(args.workers),
+                     prefetch_mb=float(args.prefetch_mb),
+                     processes=args.use_processes,
+                     precision=args.precision)
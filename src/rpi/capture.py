@@ -10,7 +10,11 @@
 # system
 import os
 import sys
+import time
 import subprocess
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 # files
 from glob import glob
@@ -25,7 +29,19 @@ import argparse
 
 # PiCamera
 from picamera2 import Picamera2
-from picamera2.encoders import Quality
+from picamera2.encoders import H264Encoder, Quality
+from picamera2.outputs import FfmpegOutput
+
+# OpenCV is only needed to process frames while recording
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# streaming statistics live with the post-processing scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "post"))
+from reducers import BrightnessReducer, REDUCERS  # noqa
 
 
 # logger
@@ -60,6 +76,379 @@ def set_camera_parameters(cfg: dict) -> Picamera2:
     return picam2
 
 
+# colour conversions from picamera2 pixel formats to OpenCV's BGR order
+BGR_CONVERSIONS = {"XBGR8888": "COLOR_RGBA2BGR",
+                   "XRGB8888": "COLOR_BGRA2BGR",
+                   "BGR888": "COLOR_RGB2BGR",
+                   "RGB888": None,
+                   "YUV420": "COLOR_YUV2BGR_I420"}
+
+
+class FrameWriter:
+    """
+    Write frames to disk using a pool of background threads.
+
+    Frames are submitted as they come out of the camera and are converted
+    and encoded by the worker threads. The number of frames waiting to be
+    written is bounded by ``max_pending`` to keep memory usage under
+    control, so the capture loop waits when the SD card falls behind. The
+    time spent waiting is added to ``waited``.
+
+    Parameters
+    ----------
+    out : str
+        Output path.
+    date : datetime.datetime
+        Capture date.
+    ext : str
+        File extension.
+    fmt : str
+        Picamera2 pixel format of the frames.
+    workers : int, optional
+        Number of writer threads, by default 2.
+    max_pending : int, optional
+        Maximum number of frames waiting to be written, by default 32.
+    """
+
+    def __init__(self, out, date, ext, fmt, workers=2, max_pending=32):
+
+        if fmt not in BGR_CONVERSIONS:
+            raise ValueError(f"Unsupported pixel format \"{fmt}\".")
+
+        # make sure output path exists
+        os.makedirs(out, exist_ok=True)
+
+        # same naming convention used by ffmpeg in extract_frames()
+        self.template = os.path.join(
+            out, "000000-{}_{{:06d}}.{}".format(date.strftime("%Y%m%d_%H%M"),
+                                                 ext))
+        code = BGR_CONVERSIONS[fmt]
+        self.code = getattr(cv2, code) if code else None
+
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()  # errors are counted by the workers
+        self.count = 0
+        self.errors = 0
+        self.waited = 0.
+
+    def _write(self, fname, frame):
+        try:
+            if self.code is not None:
+                frame = cv2.cvtColor(frame, self.code)
+            if not cv2.imwrite(fname, frame):
+                raise IOError(f"Could not write \"{fname}\"")
+        except Exception as e:
+            with self.lock:
+                self.errors += 1
+            logger.error(e)
+        finally:
+            self.pending.release()
+
+    def submit(self, frame):
+        """
+        Queue a frame for writing. Blocks if too many frames are pending.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            Frame array as returned by picamera2.
+
+        Returns
+        -------
+        None
+        """
+        start = time.monotonic()
+        self.pending.acquire()
+        self.waited += time.monotonic() - start
+        self.count += 1  # ffmpeg starts counting at 1
+        self.pool.submit(self._write, self.template.format(self.count), frame)
+
+    def close(self):
+        """
+        Wait for all pending frames to be written.
+
+        Returns
+        -------
+        None
+        """
+        self.pool.shutdown(wait=True)
+
+
+class FrameStatistics:
+    """
+    Update cycle statistics in a background thread while capturing.
+
+    Frames are fed to the reducers in ``src/post/reducers.py`` one by one,
+    in capture order, so that the statistical images are ready as soon as
+    the recording ends and the frames never have to be read back. When
+    ``max_pending`` frames are already queued, a new frame waits for at
+    most ``timeout`` seconds and is then skipped and counted in
+    ``skipped``. The time spent waiting is added to ``waited``.
+
+    Parameters
+    ----------
+    fmt : str
+        Picamera2 pixel format of the frames.
+    reducers : list
+        List of reducers to update.
+    products : list, optional
+        Names of the products to save, by default all reducer results.
+    max_pending : int, optional
+        Maximum number of frames waiting to be processed, by default 8.
+    timeout : float, optional
+        Seconds to wait for a queued frame to be processed before skipping
+        a new one, 0 to skip it right away. By default None, which waits
+        as long as needed and never skips frames.
+    """
+
+    def __init__(self, fmt, reducers, products=None, max_pending=8,
+                 timeout=None):
+
+        if fmt not in BGR_CONVERSIONS:
+            raise ValueError(f"Unsupported pixel format \"{fmt}\".")
+        code = BGR_CONVERSIONS[fmt]
+        self.code = getattr(cv2, code) if code else None
+
+        self.reducers = reducers
+        self.products = products
+        self.pool = ThreadPoolExecutor(max_workers=1)  # keeps frame order
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.timeout = timeout
+        self.count = 0
+        self.skipped = 0
+        self.waited = 0.
+
+    def _update(self, frame):
+        try:
+            if self.code is not None:
+                frame = cv2.cvtColor(frame, self.code)
+            for reducer in self.reducers:
+                reducer.update(frame)
+        except Exception as e:
+            logger.error(e)
+        finally:
+            self.pending.release()
+
+    def submit(self, frame):
+        """
+        Queue a frame for processing. If too many frames are pending, waits
+        for up to ``timeout`` seconds and then skips it.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            Frame array as returned by picamera2.
+
+        Returns
+        -------
+        None
+        """
+        start = time.monotonic()
+        acquired = self.pending.acquire(timeout=self.timeout)
+        self.waited += time.monotonic() - start
+        if not acquired:
+            self.skipped += 1
+            return
+        self.count += 1
+        self.pool.submit(self._update, frame)
+
+    def close(self):
+        """
+        Wait for all pending frames to be processed.
+
+        Returns
+        -------
+        None
+        """
+        self.pool.shutdown(wait=True)
+
+    def save(self, out, date):
+        """
+        Write the statistical images to disk.
+
+        Parameters
+        ----------
+        out : str
+            Output path.
+        date : datetime.datetime
+            Capture date.
+
+        Returns
+        -------
+        None
+        """
+        if self.count == 0:
+            logger.warning("No frames were processed, nothing to save")
+            return
+        if self.skipped:
+            total = self.count + self.skipped
+            logger.warning(f"Statistics were computed from {self.count} of "
+                           f"{total} frames, {self.skipped} frames were "
+                           "skipped because the reducers could not keep up")
+        if self.waited >= 1:
+            logger.warning(f"The capture waited {self.waited:.1f} seconds "
+                           "for the statistics")
+        dt = date.strftime("%Y%m%d_%H%M")
+        saved = []
+        for reducer in self.reducers:
+            for name, img in reducer.result().items():
+                if self.products and name.split("_")[0] not in self.products:
+                    continue
+                fname = os.path.join(out, f"{name}_{dt}.png")
+                cv2.imwrite(fname, img)
+                saved.append(name)
+                logger.info(f"Saved {name} image to {fname}")
+
+        # how the images were made, skipped frames make them differ from
+        # products.py
+        fname = os.path.join(out, f"online_products_{dt}.json")
+        with open(fname, "w") as f:
+            json.dump({"products": saved, "frames": self.count,
+                       "skipped": self.skipped,
+                       "waited": round(self.waited, 3),
+                       "timeout": self.timeout}, f, indent=4)
+        logger.info(f"Saved the statistics metadata to {fname}")
+
+
+def get_reducers(products):
+    """
+    Get the reducers for the products computed while recording.
+
+    Parameters
+    ----------
+    products : list
+        Product names, any of average, variance, brightest and darkest.
+
+    Returns
+    -------
+    list
+        List of reducers, one per class.
+    """
+    classes = []
+    for name in products:
+        if name not in REDUCERS:
+            raise ValueError(f"Unknown product \"{name}\". Use one of "
+                             f"{', '.join(REDUCERS)}.")
+        if REDUCERS[name] not in classes:
+            classes.append(REDUCERS[name])
+
+    # picamera2 frames are converted to BGR before reaching the reducers
+    return [cls(order="bgr") if cls is BrightnessReducer else cls()
+            for cls in classes]
+
+
+def record_and_process(picam2, fname, out, date, cfg, quality,
+                       extract=True, products=None):
+    """
+    Record the video and process every frame at the same time.
+
+    Frames are pulled from the camera request stream while the encoder is
+    running and are written to disk and/or used to update the cycle
+    statistics, so there is no need to decode the video afterwards. The
+    camera drops frames when the loop is too slow to pull them, these are
+    counted from the gaps between sensor timestamps and reported with the
+    time the loop waited for the frame writer.
+
+    Parameters
+    ----------
+    picam2 : Picamera2
+        Configured Picamera2 instance.
+    fname : str
+        Output video file.
+    out : str
+        Output path for the frames.
+    date : datetime.datetime
+        Capture date.
+    cfg : dict
+        Configuration dictionary.
+    quality : Quality
+        Video encoder quality.
+    extract : bool, optional
+        Write every frame to disk, by default True.
+    products : list, optional
+        Statistical images to compute from every frame, by default None.
+
+    Returns
+    -------
+    None
+    """
+    if cv2 is None:
+        raise ImportError("OpenCV is required to process frames while "
+                          "recording. Install it with "
+                          "\"sudo apt install python3-opencv\".")
+
+    fmt = picam2.camera_configuration()["main"]["format"]
+    sinks = []
+    if extract:
+        logger.info("Extracting frames while recording")
+        writer = FrameWriter(out, date, cfg["data"]["format"], fmt,
+                             workers=cfg["post_processing"].get(
+                                 "writer_threads", 2))
+        sinks.append(writer)
+    if products:
+        logger.info("Computing statistics while recording")
+        stats = FrameStatistics(fmt, get_reducers(products), products,
+                                timeout=cfg["post_processing"].get(
+                                    "online_timeout"))
+        sinks.append(stats)
+
+    # sensor timestamps are in nanoseconds
+    period = 1e9 / cfg["capture"]["framerate"]
+    received = 0
+    dropped = 0
+    last = None
+
+    picam2.start_recording(H264Encoder(), FfmpegOutput(fname),
+                           quality=quality)
+    stop = time.monotonic() + cfg["capture"]["duration"]
+    try:
+        while time.monotonic() < stop:
+            request = picam2.capture_request()
+            try:
+                frame = request.make_array("main")  # this is a copy
+                stamp = request.get_metadata().get("SensorTimestamp")
+            finally:
+                request.release()
+            received += 1
+            if stamp is not None and last is not None:
+                dropped += max(round((stamp - last) / period) - 1, 0)
+            last = stamp
+            for sink in sinks:
+                sink.submit(frame)
+    finally:
+        picam2.stop_recording()
+        logger.info("Waiting for pending frames to be processed")
+        for sink in sinks:
+            sink.close()
+
+    report = {"frames": received, "dropped": dropped}
+    if dropped:
+        logger.warning(f"The camera dropped {dropped} frames because the "
+                       "capture loop was busy, the frames do not match the "
+                       "video")
+    if extract:
+        logger.info(f"Wrote {writer.count - writer.errors} frames to {out}")
+        if writer.errors:
+            logger.warning(f"Failed to write {writer.errors} frames")
+        if writer.waited >= 1:
+            logger.warning(f"The capture waited {writer.waited:.1f} seconds "
+                           "for frames to be written")
+        report.update({"written": writer.count - writer.errors,
+                       "errors": writer.errors,
+                       "waited": round(writer.waited, 3)})
+
+    # what was captured and written, next to the video
+    dt = date.strftime("%Y%m%d_%H%M")
+    meta = os.path.join(cfg["data"]["output"], f"capture_{dt}.json")
+    with open(meta, "w") as f:
+        json.dump(report, f, indent=4)
+    logger.info(f"Saved the capture metadata to {meta}")
+
+    if products:
+        stats.save(cfg["data"]["output"], date)
+
+
 def run_single_camera(cfg):
     """
     Capture frames and save them to a file.
@@ -94,14 +483,25 @@ def run_single_camera(cfg):
         quality = Quality.HIGH
     else:
         quality = Quality.HIGH
-    
-    picam2.start_and_record_video(output=fname, duration=duration, quality=quality)
+
+    # process frames from the request stream while recording
+    post = cfg["post_processing"]
+    extract = (post["extract_frames"] and not post["only_last_frame"] and
+               post.get("extract_while_recording", False))
+    products = post.get("online_products", [])
+    if extract or products:
+        out = os.path.join(cfg["data"]["output"],
+                           start.strftime("%Y%m%d_%H%M"))
+        record_and_process(picam2, fname, out, start, cfg, quality,
+                           extract=extract, products=products)
+    else:
+        picam2.start_and_record_video(output=fname, duration=duration, quality=quality)
     
     # stop recording
     end = datetime.datetime.now()
     logger.info(f"Capture finished at {end}")
 
-    if cfg["post_processing"]["extract_frames"]:
+    if cfg["post_processing"]["extract_frames"] and not extract:
         if cfg["post_processing"]["only_last_frame"]:
             logger.info("Extracting frames (only last frame)")
             out = os.path.join(cfg["data"]["output"],
@@ -38,18 +38,14 @@ echo $(<$log)
 
 # statistical images
 capdate=$(date +'%Y%m%d_%H%00')
-python3 $workdir/post/average.py -i "/mnt/data/$capdate/" -o "average_$datestr.png"
-python3 $workdir/post/variance.py -i "/mnt/data/$capdate/" -o "variance_$datestr.png"
-python3 $workdir/post/brightest_and_darkest.py -i "/mnt/data/$capdate/" -b "brightest_$datestr.png" -d "darkest_$datestr.png"
-
-# rectified images
-python3 $workdir/post/rectify.py -i "average_$datestr.png" -o "average_rect_$datestr.tif" -gcps "xyzuv.csv" --camera_matrix "camera_matrix.json" --epsg "12345" --bbox "xmin,ymin,dx,dy"
-python3 $workdir/post/rectify.py -i "variance_$datestr.png" -o "variance_$datestr.png" -gcps "xyzuv.csv" --camera_matrix "camera_matrix.json" --epsg "12345" --bbox "xmin,ymin,dx,dy"
-python3 $workdir/post/rectify.py -i "brightest_$datestr.png" -o "brightest_rect_$datestr.tif" -gcps "xyzuv.csv" --camera_matrix "camera_matrix.json" --epsg "12345" --bbox "xmin,ymin,dx,dy"
-python3 $workdir/post/rectify.py -i "brightest_$datestr.png" -o "brightest_rect_$datestr.png" -gcps "xyzuv.csv" --camera_matrix "camera_matrix.json" --epsg "12345" --bbox "xmin,ymin,dx,dy"
-
-# timestack
-python3 src/post/timestack.py -i "/mnt/data/$capdate/" -o "timestack_$datestr.nc" -gcps "xyzuv.csv" --camera_matrix "camera_matrix.json" --stackline "x1,y1,x2,y2"
+python3 $workdir/post/products.py -i "/mnt/data/$capdate/" -a "average_$datestr.png" -v "variance_$datestr.png" -b "brightest_$datestr.png" -d "darkest_$datestr.png"
+
+# rectified images, all sharing the same geometry
+python3 $workdir/post/rectify.py -i "average_$datestr.png" "variance_$datestr.png" "brightest_$datestr.png" "darkest_$datestr.png" -o "{name}_rect.tif" -gcps "xyzuv.csv" --camera_matrix "camera_matrix.json" --epsg "12345" --bbox "xmin,ymin,dx,dy"
+
+# timestack of this cycle, also appended to the long-term timestack
+stackstart=$(date +'%Y%m%d:%H0000')
+python3 src/post/timestack.py -i "/mnt/data/$capdate/" -o "timestack_$datestr.nc" --append_to "timestack.nc" --start_time "$stackstart" -gcps "xyzuv.csv" --camera_matrix "camera_matrix.json" --timestack_line "x1,y1,x2,y2"
 
 # Call the notification
 script=notify.py
@@ -0,0 +1,9 @@
+"""
+The scripts import each other as top level modules, see src/post.
+"""
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+for folder in ["post", "exp", "bench"]:
+    sys.path.insert(0, os.path.join(SRC, folder))
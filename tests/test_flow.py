@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+import pytest
+
+from flow import (FARNEBACK, FlowStatistics, flow_create, flow_window,
+                  lattice)
+
+
+@pytest.fixture(scope="module")
+def pair():
+    """Texture moving by about 16 pixels, too far for a single level."""
+    rng = np.random.default_rng(0)
+    shape = (640, 640)
+    texture = rng.integers(0, 256, shape).astype(np.float32)
+    texture = cv2.GaussianBlur(texture, (0, 0), 2)
+    rows, cols = np.mgrid[:shape[0], :shape[1]].astype(np.float32)
+    dx = 16 + 3 * np.sin(rows / 30)
+    dy = 8 * np.cos(cols / 40)
+    return texture, cv2.remap(texture, cols - dx, rows - dy,
+                              cv2.INTER_LINEAR)
+
+
+def cropped_flow(prv, nxt, rows, cols, params, spacing=0, window=None,
+                 margin=None):
+    """Flow of a region computed on the whole frame and on a window."""
+    if margin is None:
+        r0, r1, c0, c1 = flow_window(rows, cols, prv.shape, params, spacing,
+                                     window)
+    else:
+        r0, r1 = rows[0] - margin, rows[1] + margin
+        c0, c1 = cols[0] - margin, cols[1] + margin
+    full = flow_create(prv.shape, params, spacing, window).calc(prv, nxt,
+                                                                None)
+    crop = flow_create((r1 - r0, c1 - c0), params, spacing, window).calc(
+        prv[r0:r1, c0:c1], nxt[r0:r1, c0:c1], None)
+
+    # cells of the region, on the lattice for the sparse flow
+    step = max(spacing, 1)
+    lrows, lcols = lattice(prv.shape, spacing) if spacing else \
+        (np.arange(prv.shape[0]), np.arange(prv.shape[1]))
+    inside = np.ix_((lrows >= rows[0]) & (lrows < rows[1]),
+                    (lcols >= cols[0]) & (lcols < cols[1]))
+    full = full[inside]
+    crop = crop[np.ix_(*[(lattice_ >= first) & (lattice_ < last)
+                         for lattice_, first, last in
+                         [(lrows[r0 // step:][:crop.shape[0]], *rows),
+                          (lcols[c0 // step:][:crop.shape[1]], *cols)]])]
+    return full, crop
+
+
+@pytest.mark.parametrize("spacing, window", [(0, None), (8, 24), (16, 24)])
+def test_flow_window(pair, spacing, window):
+    params = dict(FARNEBACK, levels=3, winsize=3)
+    full, crop = cropped_flow(*pair, (290, 350), (250, 330), params,
+                              spacing, window)
+    assert full.shape == crop.shape
+    np.testing.assert_allclose(crop, full, atol=0.01)
+
+
+def test_flow_window_needs_the_pyramid(pair):
+    # a margin for the finest level only is not enough
+    params = dict(FARNEBACK, levels=3, winsize=3)
+    full, crop = cropped_flow(*pair, (290, 350), (250, 330), params,
+                              margin=2 * max(params["winsize"],
+                                             params["poly_n"]))
+    assert np.abs(crop - full).max() > 1
+
+
+def test_flow_window_bounds():
+    params = dict(FARNEBACK, levels=3, winsize=3)
+
+    # the window keeps the pyramid of OpenCV (min. 32 pixels at 1/8)
+    r0, r1, c0, c1 = flow_window((300, 302), (0, 2), (1000, 200), params)
+    assert r1 - r0 >= 256 and (c0, c1) == (0, 200)
+
+    # and starts on the lattice of the sparse flow
+    r0, r1, c0, c1 = flow_window((301, 330), (37, 40), (1000, 1000),
+                                 params, spacing=8)
+    assert r0 % 8 == 0 and c0 % 8 == 0
+
+
+# numpy warns about the cell that never has flow
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_flow_statistics():
+    rng = np.random.default_rng(0)
+    shape = (6, 7)
+    u = rng.normal(1, 1, (23, ) + shape).astype(np.float32)
+    v = rng.normal(0, 2, (23, ) + shape).astype(np.float32)
+    u[rng.random(u.shape) < 0.3] = np.nan
+    u[:, 0, 0] = np.nan  # never any flow
+    v[np.isnan(u)] = np.nan
+    displacement = np.hypot(u, v)
+    angle = np.arctan2(v, u)
+
+    stats = FlowStatistics(shape, block_size=5)
+    for k in range(20):
+        stats.add(u[k], v[k], displacement[k], angle[k])
+    stats.add_batch(u[20:], v[20:], displacement[20:], angle[20:])
+    out = stats.result()
+
+    np.testing.assert_array_equal(out["count"], np.isfinite(u).sum(axis=0))
+    valid = out["count"] > 1
+    for name, x in [("u", u), ("v", v), ("displacement", displacement)]:
+        np.testing.assert_allclose(out[f"{name}_mean"][valid],
+                                   np.nanmean(x, axis=0)[valid], rtol=1e-5)
+        np.testing.assert_allclose(out[f"{name}_std"][valid],
+                                   np.nanstd(x, axis=0, ddof=1)[valid],
+                                   rtol=1e-5)
+    c = np.nanmean(np.cos(angle), axis=0)[valid]
+    s = np.nanmean(np.sin(angle), axis=0)[valid]
+    np.testing.assert_allclose(out["steadiness"][valid], np.hypot(c, s),
+                               rtol=1e-5)
+    np.testing.assert_allclose(out["angle"][valid],
+                               np.mod(np.arctan2(s, c), 2 * np.pi),
+                               rtol=1e-5)
+    for name in ["u_mean", "u_std", "angle", "steadiness"]:
+        assert np.isnan(out[name][0, 0])
+
+
+def test_flow_statistics_empty():
+    out = FlowStatistics((3, 4)).result()
+    assert not out["count"].any()
+    assert np.isnan(out["u_mean"]).all() and np.isnan(out["angle"]).all()
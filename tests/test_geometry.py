@@ -0,0 +1,45 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from geometry import GeometryBundle, read_camera_matrix, read_gcps
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+
+# remap interpolates the raw image and griddata the undistorted one, so they
+# do not agree exactly. Measured on data/boomerang, inside the footprint:
+# median 2.8-3.0 DN and p99 62-66 DN, for both methods.
+MEDIAN_TOLERANCE = 4
+P99_TOLERANCE = 80
+
+
+@pytest.fixture(scope="module")
+def boomerang():
+    """Geometry of the boomerang camera on a 1 m grid and one frame."""
+    mtx, dist = read_camera_matrix(os.path.join(DATA, "flir_tamron_8mm.json"))
+    xyz, uv = read_gcps(os.path.join(DATA, "xyzuv.csv"))
+    img = cv2.cvtColor(
+        cv2.imread(os.path.join(DATA, "boomerang", "16139467-0.jpg")),
+        cv2.COLOR_BGR2RGB)
+    bbox = np.array([457200, 6422080, 100, 100], dtype=float)
+    geom = GeometryBundle.load(mtx, dist, xyz, uv, xyz[:, 2].mean(),
+                               img.shape, bbox=bbox, cache=None)
+    return geom, img, mtx, dist
+
+
+@pytest.mark.parametrize("method", ["nearest", "linear"])
+def test_remap_matches_griddata(boomerang, method):
+    geom, img, mtx, dist = boomerang
+    fast = geom.remap(img, mtx, dist, method).astype(np.float64)
+    ref = geom.griddata(img, mtx, dist, method)
+    assert fast.shape == ref.shape
+
+    # remap sets the cells the camera does not see to 0
+    inside = np.any(fast > 0, axis=-1) & np.all(np.isfinite(ref), axis=-1)
+    assert inside.mean() > 0.9
+
+    diff = np.abs(fast - ref)[inside]
+    assert np.median(diff) <= MEDIAN_TOLERANCE
+    assert np.percentile(diff, 99) <= P99_TOLERANCE
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from reducers import StreamingMoments
+
+
+def skewness(x, axis=0):
+    """Biased Fisher-Pearson skewness, ignoring NaN."""
+    d = x - np.nanmean(x, axis=axis)
+    return np.nanmean(d ** 3, axis=axis) / np.nanmean(d ** 2, axis=axis) ** 1.5
+
+
+def moments(**kwargs):
+    return StreamingMoments(skewness=True, extrema=True, **kwargs)
+
+
+def check(m, x):
+    np.testing.assert_allclose(m.mean, np.nanmean(x, axis=0))
+    np.testing.assert_allclose(m.variance(), np.nanvar(x, axis=0, ddof=1))
+    np.testing.assert_allclose(m.skewness(), skewness(x), rtol=1e-6)
+    np.testing.assert_array_equal(m.min, np.nanmin(x, axis=0))
+    np.testing.assert_array_equal(m.max, np.nanmax(x, axis=0))
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    return rng.gamma(2, 10, (37, 4, 5))
+
+
+def test_batches(frames):
+    m = moments()
+    for start in range(0, len(frames), 8):
+        m.add_batch(frames[start:start + 8])
+    assert m.n == len(frames)
+    check(m, frames)
+
+
+def test_merge_workers(frames):
+    # each worker reduces an uneven part of the series
+    parts = []
+    for block in np.split(frames, [3, 20, 21]):
+        m = moments()
+        m.add_batch(block)
+        parts.append(m)
+    total = moments()
+    for m in parts:
+        total.merge(m)
+    check(total, frames)
+
+
+def test_uint8_float32():
+    rng = np.random.default_rng(1)
+    frames = rng.integers(0, 256, (20, 3, 3), dtype=np.uint8)
+    m = StreamingMoments(dtype=np.float32, extrema=True)
+    m.add_batch(frames[:7])
+    m.add_batch(frames[7:])
+    assert m.mean.dtype == np.float32
+    np.testing.assert_allclose(m.variance(), frames.var(axis=0, ddof=1),
+                               rtol=1e-5)
+    np.testing.assert_array_equal(m.min, frames.min(axis=0))
+
+
+def test_skipna(frames):
+    rng = np.random.default_rng(2)
+    frames[rng.random(frames.shape) < 0.3] = np.nan
+    frames[:, 0, 0] = np.nan  # a cell that never has data
+    frames[:20, 1, 1] = np.nan  # a cell without data in the first part
+
+    first, second = moments(skipna=True), moments(skipna=True)
+    first.add_batch(frames[:20])
+    second.add_batch(frames[20:28])
+    second.add_batch(frames[28:])
+    first.merge(second)
+
+    np.testing.assert_array_equal(first.n, np.isfinite(frames).sum(axis=0))
+    valid = first.n > 2
+    with np.errstate(all="ignore"), pytest.warns(RuntimeWarning):
+        expected = [np.nanmean(frames, axis=0),
+                    np.nanvar(frames, axis=0, ddof=1),
+                    skewness(frames),
+                    np.nanmin(frames, axis=0)]
+    np.testing.assert_allclose(first.mean[valid], expected[0][valid])
+    np.testing.assert_allclose(first.variance()[valid], expected[1][valid])
+    np.testing.assert_allclose(first.skewness()[valid], expected[2][valid],
+                               rtol=1e-6)
+    np.testing.assert_array_equal(first.min[valid], expected[3][valid])
+    assert np.isnan(first.min[0, 0]) and np.isnan(first.max[0, 0])
+
+
+def test_merge_needs_same_statistics(frames):
+    m = StreamingMoments()
+    m.add_batch(frames)
+    with pytest.raises(ValueError):
+        moments().merge(m)
+
+
+@pytest.mark.parametrize("skipna", [False, True])
+def test_shape(frames, skipna):
+    m = moments(skipna=skipna, shape=frames.shape[1:])
+    assert np.all(m.n == 0) and np.all(m.mean == 0)
+    m.add_batch(frames[:10])
+    m.merge(moments(skipna=skipna, shape=frames.shape[1:]))  # empty
+    m.add_batch(frames[10:])
+    check(m, frames)
+    if skipna:
+        assert m.n.shape == frames.shape[1:]
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import shutil
+import datetime
+
+import numpy as np
+import netCDF4
+import pytest
+
+import timestack
+from ncstream import NetCDFStream, Manifest
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+
+
+def cycle(folder, frames):
+    os.makedirs(folder)
+    for k in frames:
+        shutil.copy(os.path.join(DATA, "boomerang", f"16139467-{k}.jpg"),
+                    folder)
+    return folder
+
+
+def run(monkeypatch, tmp_path, folder, output, start, *extra):
+    monkeypatch.setattr(sys, "argv", [
+        "timestack.py", "-i", folder, "-o", output, "--start_time", start,
+        "--npoints", "50", "--chunk_size", "2",
+        "--camera_matrix", os.path.join(DATA, "flir_tamron_8mm.json"),
+        "--gcps", os.path.join(DATA, "xyzuv.csv"),
+        "--geometry_cache", str(tmp_path / "cache"), *extra])
+    timestack.main()
+
+
+def interrupt(fname, steps):
+    """Append time steps without recording them, like a power cut."""
+    with netCDF4.Dataset(fname) as ds:
+        dtype = ds["rgb"].dtype
+        shape = ds["rgb"].shape[1:]
+    nc = NetCDFStream(fname, {"rgb": dict(dims=("time", "transect", "point",
+                                                "band"), dtype=dtype)},
+                      mode="a")
+    for i in range(steps):
+        nc.append(datetime.datetime(2021, 1, 1, 0, 0, i),
+                  rgb=np.full(shape, 7, dtype))
+    nc.close()
+
+
+def times(fname):
+    with netCDF4.Dataset(fname) as ds:
+        return netCDF4.num2date(ds["time"][:], ds["time"].units,
+                                ds["time"].calendar)
+
+
+def test_interrupted_append(monkeypatch, tmp_path):
+    first = cycle(str(tmp_path / "c1"), [0, 1, 2, 3])
+    second = cycle(str(tmp_path / "c2"), [4, 5, 6])
+    longterm = str(tmp_path / "timestack.nc")
+
+    run(monkeypatch, tmp_path, first, str(tmp_path / "c1.nc"),
+        "20200101:100000", "--append_to", longterm)
+    with netCDF4.Dataset(longterm) as ds:
+        expected = ds["rgb"][:]
+    interrupt(longterm, 3)
+    assert len(times(longterm)) == 7
+
+    # the next cycle writes its own timestack and replaces the tail
+    run(monkeypatch, tmp_path, second, str(tmp_path / "c2.nc"),
+        "20200101:110000", "--append_to", longterm)
+    assert len(times(str(tmp_path / "c2.nc"))) == 3
+    with netCDF4.Dataset(longterm) as ds:
+        assert ds["rgb"].shape[0] == 7
+        np.testing.assert_array_equal(ds["rgb"][:4], expected)
+        with netCDF4.Dataset(str(tmp_path / "c2.nc")) as cycle_ds:
+            np.testing.assert_array_equal(ds["rgb"][4:], cycle_ds["rgb"][:])
+        assert list(ds["transect"][:]) == ["0"]
+        assert ds["rgb"].chunking()[0] == 2
+    assert times(longterm)[4].hour == 11
+    assert len(Manifest(longterm)) == 7
+
+    # running the same cycle again does nothing
+    run(monkeypatch, tmp_path, second, longterm, "20200101:110000",
+        "--append")
+    assert len(times(longterm)) == 7
+
+
+def test_interrupted_first_append(monkeypatch, tmp_path):
+    first = cycle(str(tmp_path / "c1"), [0, 1])
+    longterm = str(tmp_path / "timestack.nc")
+
+    # the manifest exists before the data are written
+    run(monkeypatch, tmp_path, first, longterm, "20200101:100000",
+        "--append")
+    manifest = Manifest(longterm)
+    manifest.entries = []
+    manifest.save()
+
+    assert Manifest(longterm).recover() == 2
+    assert len(times(longterm)) == 0
+
+
+def test_append_to_foreign_file(monkeypatch, tmp_path, capsys):
+    first = cycle(str(tmp_path / "c1"), [0, 1])
+    longterm = str(tmp_path / "timestack.nc")
+    run(monkeypatch, tmp_path, first, longterm, "20200101:100000")
+
+    # --append refuses, --append_to still writes the cycle
+    with pytest.raises(ValueError):
+        run(monkeypatch, tmp_path, first, longterm, "20200101:100000",
+            "--append")
+    run(monkeypatch, tmp_path, first, str(tmp_path / "c1.nc"),
+        "20200101:100000", "--append_to", longterm)
+    assert "warning" in capsys.readouterr().out
+    assert len(times(str(tmp_path / "c1.nc"))) == 2
+    assert not os.path.isfile(longterm + ".manifest.json")
+
+
+def line(name, *coords):
+    return {"type": "Feature", "properties": {"name": name},
+            "geometry": {"type": "MultiLineString" if len(coords) > 1
+                         else "LineString",
+                         "coordinates": coords if len(coords) > 1
+                         else coords[0]}}
+
+
+def write_geojson(fname, *features):
+    with open(fname, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+    return fname
+
+
+def test_multilinestring_names(tmp_path):
+    fname = write_geojson(str(tmp_path / "lines.geojson"),
+                          line("T", [[0, 0], [1, 1]], [[1, 1], [2, 2]],
+                               [[2, 2], [3, 3]]),
+                          line("along", [[0, 0], [0, 5]]))
+    names = [name for name, _ in timestack.read_transects(fname)]
+    assert names == ["T_0", "T_1", "T_2", "along"]
+
+
+def test_duplicate_names(tmp_path):
+    fname = write_geojson(str(tmp_path / "lines.geojson"),
+                          line("T", [[0, 0], [1, 1]], [[1, 1], [2, 2]]),
+                          line("T_1", [[0, 0], [0, 5]]))
+    with pytest.raises(ValueError, match="T_1"):
+        timestack.read_transects(fname)
+
+    fname = str(tmp_path / "lines.csv")
+    with open(fname, "w") as f:
+        f.write("transect,x,y\na,0,0\na,1,1\nb,0,0\nb,0,1\na,5,5\na,6,6\n")
+    with pytest.raises(ValueError, match="\"a\""):
+        timestack.read_transects(fname)